@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+钱包成交流水增量同步
+Data API /activity 按时间倒序分页返回。本地记住已同步到的最新成交时间与该时刻的成交ID (游标),
+之后每次只向后翻页, 遇到游标及更早的记录就停止; 新记录按ID去重后写入本地 SQLite 流水。
+
+  - 参数写法: 依次尝试 user / address / wallet 等几种, 第一次取到数据的写法记入库中, 之后直接使用;
+    该写法请求失败时下次同步重新探测
+  - 首次同步 (没有游标) 最多翻 max_pages 页
+  - 行格式与 records.TradeTape.append 的参数一致: (id, kind, ts, ts_ms, price, size, usdc, market, outcome, reason)
+  - 行ID由调用方生成; 生成方式变化时提高 SCHEMA_VERSION, 旧库会被清空后重新同步
+
+用法:
+  python activity_sync.py show <钱包地址> [--db activity.db] [--last 20]
+  python activity_sync.py stats [--db activity.db]
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS activity (
+    user     TEXT NOT NULL,
+    id       TEXT NOT NULL,
+    kind     TEXT NOT NULL,
+    ts,
+    ts_ms    INTEGER NOT NULL,
+    price    REAL,
+    size     REAL,
+    usdc     REAL NOT NULL,
+    market   TEXT,
+    outcome  TEXT,
+    reason   TEXT,
+    PRIMARY KEY (user, id)
+);
+CREATE INDEX IF NOT EXISTS idx_activity_ts ON activity (user, ts_ms);
+CREATE TABLE IF NOT EXISTS sync_meta (
+    user      TEXT PRIMARY KEY,
+    shape     INTEGER,
+    synced_at REAL
+);
+"""
+
+# 行ID的生成方式变化时加一: 打开旧版本的库时清空流水重新同步, 避免新旧两种ID的同一成交重复计入
+SCHEMA_VERSION = 2
+
+_COLUMNS = ("id", "kind", "ts", "ts_ms", "price", "size", "usdc", "market", "outcome", "reason")
+
+# /activity 的几种参数写法: (地址参数名, 是否分页)
+PARAM_SHAPES = (
+    ("user", True),
+    ("user", False),
+    ("address", True),
+    ("wallet", True),
+)
+
+
+class ActivityLog:
+    """本地成交流水; 一个连接多线程共用, 读写加锁。path 为 ":memory:" 时不落盘"""
+    def __init__(self, path):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            if path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+                self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(_SCHEMA)
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                self.conn.execute("DELETE FROM activity")
+                self.conn.execute("DELETE FROM sync_meta")
+                self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def insert_many(self, user, rows):
+        """写入新行, 返回实际新增的行 (已存在的ID跳过)"""
+        sql = (f"INSERT OR IGNORE INTO activity (user, {', '.join(_COLUMNS)}) "
+               f"VALUES ({', '.join('?' * (len(_COLUMNS) + 1))})")
+        added = []
+        with self.lock:
+            cur = self.conn.cursor()
+            for row in rows:
+                cur.execute(sql, (user,) + tuple(row))
+                if cur.rowcount:
+                    added.append(row)
+            self.conn.commit()
+        return added
+
+    def rows(self, user, last=None):
+        """按成交时间排序的全部 (或最近 last 条) 行"""
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM activity WHERE user = ? ORDER BY ts_ms, rowid"
+        with self.lock:
+            rows = [tuple(r) for r in self.conn.execute(sql, (user,))]
+        return rows[-last:] if last else rows
+
+    def cursor(self, user):
+        """(最新成交时间ms, 该时刻的成交ID集合); 没有记录时为 (0, 空集)"""
+        with self.lock:
+            r = self.conn.execute("SELECT MAX(ts_ms) FROM activity WHERE user = ?", (user,)).fetchone()
+            newest = int(r[0] or 0)
+            ids = {x[0] for x in self.conn.execute(
+                "SELECT id FROM activity WHERE user = ? AND ts_ms = ?", (user, newest))}
+        return newest, ids
+
+    def get_shape(self, user):
+        with self.lock:
+            r = self.conn.execute("SELECT shape FROM sync_meta WHERE user = ?", (user,)).fetchone()
+        return None if r is None or r[0] is None else int(r[0])
+
+    def set_shape(self, user, shape):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO sync_meta (user, shape, synced_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user) DO UPDATE SET shape = excluded.shape, synced_at = excluded.synced_at",
+                (user, shape, time.time()))
+            self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            return [tuple(r) for r in self.conn.execute(
+                "SELECT user, COUNT(*), MIN(ts_ms), MAX(ts_ms) FROM activity GROUP BY user")]
+
+
+class ActivitySync:
+    """
+    单个钱包的增量同步
+    fetch(params) → 原始列表 (失败返回 None); normalize(原始dict) → 行元组, 不需要的记录返回 None
+    """
+    def __init__(self, user, fetch, normalize, log, page_size=500, max_pages=10):
+        self.user = user
+        self.fetch = fetch
+        self.normalize = normalize
+        self.log = log
+        self.page_size = int(page_size)
+        self.max_pages = max(1, int(max_pages))
+        self.shape = log.get_shape(user)
+        self.cursor = log.cursor(user)
+        self.requests = 0
+        self.last_new = 0
+
+    def rows(self):
+        return self.log.rows(self.user)
+
+    def sync(self):
+        """拉取游标之后的新记录并写入流水, 返回新增行 (按成交时间排序)"""
+        if self.shape is not None:
+            fresh = self._pull(self.shape, probe=False)
+            if fresh is None:
+                # 记住的写法失效, 下次重新探测
+                self.shape = None
+                fresh = []
+        else:
+            fresh = []
+            for shape in range(len(PARAM_SHAPES)):
+                got = self._pull(shape, probe=True)
+                if got is not None:
+                    self.shape = shape
+                    self.log.set_shape(self.user, shape)
+                    fresh = got
+                    break
+        added = self.log.insert_many(self.user, fresh)
+        added.sort(key=lambda r: r[3])
+        if added:
+            newest = max(self.cursor[0], added[-1][3])
+            ids = set(self.cursor[1]) if newest == self.cursor[0] else set()
+            ids.update(r[0] for r in added if r[3] == newest)
+            self.cursor = (newest, ids)
+        self.last_new = len(added)
+        return added
+
+    def _pull(self, shape, probe):
+        """按某种参数写法翻页; 请求失败 (探测时为取不到任何数据) 返回 None"""
+        key, paged = PARAM_SHAPES[shape]
+        newest, seen_ids = self.cursor
+        out = []
+        offset = 0
+        for page in range(self.max_pages if paged else 1):
+            params = {key: self.user}
+            if paged:
+                params.update(limit=self.page_size, offset=offset)
+                if newest and not probe:
+                    # 探测时不带起始时间, 能否取到数据才说明写法有效
+                    params["start"] = newest // 1000
+            data = self.fetch(params)
+            self.requests += 1
+            if page > 0 and not isinstance(data, list):
+                # 中途失败时丢弃本轮结果, 否则游标会越过没取到的记录; 下次同步重取
+                return []
+            if not isinstance(data, list) or (probe and page == 0 and not data):
+                return None
+            reached = False
+            for item in data:
+                row = self.normalize(item) if isinstance(item, dict) else None
+                if row is None:
+                    continue
+                if row[3] < newest or (row[3] == newest and row[0] in seen_ids):
+                    reached = True
+                    continue
+                out.append(row)
+            if reached or not paged or len(data) < self.page_size:
+                break
+            offset += len(data)
+        return out
+
+    def stats(self):
+        return {
+            "shape": None if self.shape is None else "/".join(str(x) for x in PARAM_SHAPES[self.shape]),
+            "cursor_ms": self.cursor[0],
+            "requests": self.requests,
+            "last_new": self.last_new,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地钱包成交流水")
+    sub = parser.add_subparsers(dest="cmd")
+    p_show = sub.add_parser("show", help="查看某钱包最近的流水")
+    p_show.add_argument("user")
+    p_show.add_argument("--db", default="activity.db")
+    p_show.add_argument("--last", type=int, default=20)
+    p_stats = sub.add_parser("stats", help="各钱包流水条数与时间范围")
+    p_stats.add_argument("--db", default="activity.db")
+    args = parser.parse_args()
+    if args.cmd not in ("show", "stats"):
+        parser.print_help()
+        return
+    if not os.path.exists(args.db):
+        print(f"文件不存在: {args.db}")
+        sys.exit(1)
+    log = ActivityLog(args.db)
+    if args.cmd == "stats":
+        for user, n, lo, hi in log.stats():
+            print(f"{user}  {n} 条  {time.strftime('%Y-%m-%d %H:%M', time.localtime(lo / 1000))}"
+                  f" ~ {time.strftime('%Y-%m-%d %H:%M', time.localtime(hi / 1000))}")
+        return
+    for tid, kind, ts, ts_ms, price, size, usdc, market, outcome, reason in log.rows(args.user.strip().lower(), args.last):
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts_ms / 1000)) if ts_ms else str(ts)
+        px = "-" if price is None else f"{price:.3f}"
+        qty = "-" if size is None else f"{size:g}"
+        print(f"{when}  {kind:<6} {outcome:<5} {qty:>10} @ {px:<6} ${usdc:,.2f}  {reason}")
+
+
+if __name__ == "__main__":
+    main()
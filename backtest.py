@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+15分钟窗口向量化回测
+每个窗口按秒采样 (Chainlink, PTB, UP/DOWN 价格) 组成 [窗口数, 秒] 矩阵,
+条件引擎一次性对整张矩阵求值, 下单/撤单/止损状态机按秒推进、对所有窗口同时计算
+
+决策语义与 TradingSession.on_tick 一致:
+  - 下单结果在下一个tick处理 (挂单、尝试次数、last_order 方向)
+  - 超过 ORDER_TIMEOUT_SEC 的挂单仅在当tick条件触发时查询, 未成交即撤单, 同方向不再追单
+  - 止损每tick检查, 按持仓方向当前价格卖出
+  - 窗口结束时仍未确认的挂单按成交模型判定, 成交则持有到结算
+  - LEAD_LAG_TRIGGER 开启时, 置信度足够的秒按录制时的币安领先预测价差求值条件, 止损仍看实际价差
+
+用法:
+  python backtest.py build captures/ -o windows.npz     # 从录制文件生成回测数据
+  python backtest.py run windows.npz [--fill-model check]
+"""
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+from dotenv import load_dotenv
+
+from condition_engine import ConditionEngine, load_rules
+from tick_store import rolling_matrix_stats
+from fair_value import load_surface, sigma_from_vol
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(BASE_DIR, "config.env"))
+
+# 与实盘脚本相同的配置项和默认值
+TRADE_AMOUNT = float(os.getenv("TRADE_AMOUNT", "5"))
+ORDER_TIMEOUT_SEC = int(os.getenv("ORDER_TIMEOUT_SEC", "8"))
+MAX_RETRY_PER_MARKET = int(os.getenv("MAX_RETRY_PER_MARKET", "2"))
+STOP_LOSS_DIFF = float(os.getenv("STOP_LOSS_DIFF", "40"))
+LEAD_LAG_TRIGGER = os.getenv("LEAD_LAG_TRIGGER", "false").lower() == "true"
+LEAD_LAG_MIN_CONFIDENCE = float(os.getenv("LEAD_LAG_MIN_CONFIDENCE", "0.5"))
+
+WINDOW_SEC = 900
+
+# 成交模型: 挂单在查询时是否已成交
+#   always: 总是成交
+#   check:  查询时该方向中间价 ≤ 限价 (与 replay.py 的模拟Trader一致)
+#   touch:  挂单以来该方向中间价曾经 ≤ 限价
+FILL_MODELS = ("always", "check", "touch")
+
+EXIT_NONE = 0
+EXIT_STOP = 1
+EXIT_SETTLE = 2
+
+
+class WindowData:
+    """
+    回测数据: 第 j 列对应剩余时间 remaining[j] (900 → 1)
+    btc/up/down 为 [W, T], ptb/outcome 为 [W]; outcome: 1=UP, -1=DOWN, 0=未知
+    pred/conf 为 [W, T]: 该秒由币安领先估计预测的 Chainlink 价格及其置信度, 无预测为 NaN
+    (旧版数据文件没有这两列, 按全部无预测处理)
+    """
+    def __init__(self, slugs, btc, ptb, up, down, outcome, remaining=None, pred=None, conf=None):
+        self.slugs = np.asarray(slugs)
+        self.btc = np.asarray(btc, dtype=np.float64)
+        self.ptb = np.asarray(ptb, dtype=np.float64)
+        self.up = np.asarray(up, dtype=np.float64)
+        self.down = np.asarray(down, dtype=np.float64)
+        self.outcome = np.asarray(outcome, dtype=np.int8)
+        T = self.btc.shape[1]
+        self.remaining = np.arange(T, 0, -1, dtype=np.float64) if remaining is None else np.asarray(remaining, dtype=np.float64)
+        self.pred = np.full(self.btc.shape, np.nan) if pred is None else np.asarray(pred, dtype=np.float64)
+        self.conf = np.full(self.btc.shape, np.nan) if conf is None else np.asarray(conf, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.slugs)
+
+    def subset(self, index):
+        return WindowData(self.slugs[index], self.btc[index], self.ptb[index], self.up[index],
+                          self.down[index], self.outcome[index], self.remaining, self.pred[index], self.conf[index])
+
+    def save(self, path):
+        np.savez_compressed(path, slugs=self.slugs, btc=self.btc, ptb=self.ptb, up=self.up,
+                            down=self.down, outcome=self.outcome, remaining=self.remaining,
+                            pred=self.pred, conf=self.conf)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as z:
+            extra = {k: z[k] for k in ("pred", "conf") if k in z.files}
+            return cls(z["slugs"], z["btc"], z["ptb"], z["up"], z["down"], z["outcome"], z["remaining"], **extra)
+
+    def diff(self):
+        """与实盘一致: Chainlink 或 PTB 缺失时价差按 0 处理"""
+        ptb = self.ptb[:, None]
+        valid = (self.btc > 0) & (ptb > 0)
+        return np.where(valid, self.btc - ptb, 0.0)
+
+    def signal_diff(self, lead_lag_trigger=LEAD_LAG_TRIGGER, min_confidence=LEAD_LAG_MIN_CONFIDENCE):
+        """条件求值用的价差: 与实盘一致, 开启领先触发且预测置信度足够时用预测价差, 否则为实际价差"""
+        diff = self.diff()
+        if not lead_lag_trigger:
+            return diff
+        ptb = self.ptb[:, None]
+        use = (self.btc > 0) & (ptb > 0) & ~np.isnan(self.pred) & (self.conf >= min_confidence)
+        return np.where(use, self.pred - ptb, diff)
+
+    def prediction_coverage(self):
+        """有领先预测的采样点占比; 旧版数据或录制时估计未就绪为 0"""
+        sampled = ~np.isnan(self.btc)
+        return float((~np.isnan(self.pred) & sampled).sum() / max(1, sampled.sum()))
+
+
+def build_from_captures(paths):
+    """用回放引擎逐tick采样 TradingSession 看到的价格, 生成 WindowData"""
+    from replay import Replayer
+
+    class _Sampler(Replayer):
+        def __init__(self, paths):
+            super().__init__(paths)
+            self.rows = {}
+
+        def _run_ticks(self, until):
+            import polymarket_auto_trade as bot
+            while self.next_tick is not None and self.next_tick <= until:
+                if self.market:
+                    remaining = int(self.market_end - self.next_tick)
+                    if 0 < remaining <= WINDOW_SEC:
+                        slug = self.market["slug"]
+                        row = self.rows.get(slug)
+                        if row is None:
+                            row = np.full((6, WINDOW_SEC), np.nan)
+                            self.rows[slug] = row
+                        j = WINDOW_SEC - remaining
+                        snap = bot.PRICE_BUS.snapshot()
+                        row[0, j] = snap["btc"] or np.nan
+                        row[1, j] = snap["ptb"] or np.nan
+                        row[2, j] = snap["up_price"] or self.market.get("up_price") or np.nan
+                        row[3, j] = snap["down_price"] or self.market.get("down_price") or np.nan
+                        lead = bot.lead_lag.snapshot(snap["binance"])
+                        if lead["predicted"] is not None:
+                            row[4, j] = lead["predicted"]
+                            row[5, j] = lead["confidence"] or 0.0
+                self.next_tick += self.tick_sec
+
+    sampler = _Sampler(paths)
+    sampler.run()
+    slugs = sorted(sampler.rows.keys())
+    W = len(slugs)
+    btc = np.full((W, WINDOW_SEC), np.nan)
+    up = np.full((W, WINDOW_SEC), np.nan)
+    down = np.full((W, WINDOW_SEC), np.nan)
+    pred = np.full((W, WINDOW_SEC), np.nan)
+    conf = np.full((W, WINDOW_SEC), np.nan)
+    ptb = np.full(W, np.nan)
+    outcome = np.zeros(W, dtype=np.int8)
+    for i, slug in enumerate(slugs):
+        row = sampler.rows[slug]
+        btc[i], up[i], down[i], pred[i], conf[i] = row[0], row[2], row[3], row[4], row[5]
+        known = row[1][~np.isnan(row[1])]
+        ptb[i] = known[-1] if len(known) else np.nan
+        side = sampler.outcomes.get(slug)
+        outcome[i] = 1 if side == "UP" else (-1 if side == "DOWN" else 0)
+    return WindowData(np.array(slugs), btc, ptb, up, down, outcome, pred=pred, conf=conf)
+
+
+def apply_market_index(data, index):
+    """用历史市场索引中的开盘价和结算结果覆盖录制推断的 PTB / outcome, 返回覆盖的窗口数"""
+    n = 0
+    for i, slug in enumerate(data.slugs):
+        row = index.get(str(slug))
+        if not row:
+            continue
+        if row.get("open_price"):
+            data.ptb[i] = row["open_price"]
+        if row.get("outcome") in ("UP", "DOWN"):
+            data.outcome[i] = 1 if row["outcome"] == "UP" else -1
+        n += 1
+    return n
+
+
+class TradeTable:
+    """每个窗口最多 K 笔开仓 (受 MAX_RETRY_PER_MARKET 限制) 的列式成交记录"""
+    def __init__(self, W, K):
+        self.rule = np.full((W, K), -1, dtype=np.int32)
+        self.side = np.zeros((W, K), dtype=np.int8)
+        self.entry_price = np.full((W, K), np.nan)
+        self.entry_j = np.full((W, K), -1, dtype=np.int32)
+        self.filled = np.zeros((W, K), dtype=bool)
+        self.exit_price = np.full((W, K), np.nan)
+        self.exit_j = np.full((W, K), -1, dtype=np.int32)
+        self.exit_reason = np.zeros((W, K), dtype=np.int8)
+        self.pnl = np.full((W, K), np.nan)
+
+
+_surface = []
+
+
+def fair_surface():
+    """公允概率曲面只在首次用到时生成, 每个进程一份"""
+    if not _surface:
+        _surface.append(load_surface(base_dir=BASE_DIR))
+    return _surface[0]
+
+
+def condition_features(data, window, with_fair=True):
+    """
+    条件过滤用的矩阵 (vol, velocity, fair): 只取决于数据和统计窗口, 与条件参数无关。
+    fair 按信号价差查公允概率曲面, with_fair 为 False 时为 None
+    """
+    vol, velocity = rolling_matrix_stats(data.btc, window)
+    fair = None
+    if with_fair:
+        fair = fair_surface().lookup_many(data.signal_diff(), data.remaining[None, :], sigma_from_vol(vol, window))
+    return vol, velocity, fair
+
+
+def simulate(data, engine, stop_loss_diff=STOP_LOSS_DIFF, order_timeout=ORDER_TIMEOUT_SEC,
+             max_retry=MAX_RETRY_PER_MARKET, size=TRADE_AMOUNT, fill_model="check", features=None):
+    """
+    对所有窗口同时推进实盘状态机, 返回 TradeTable
+    features: 按 engine.stats_window 预先算好的 condition_features 结果 (参数扫描中各配置共用), None 时现算
+    """
+    if fill_model not in FILL_MODELS:
+        raise ValueError(f"未知成交模型: {fill_model}")
+    W, T = data.up.shape
+    K = max(0, int(max_retry))
+    trades = TradeTable(W, max(K, 1))
+    if W == 0 or K == 0:
+        return trades
+
+    # 条件和公允概率按信号价差 (可能是领先预测) 求值, 止损按实际价差
+    diff_abs = np.abs(data.diff())
+    signal = data.signal_diff()
+    vol = velocity = fair = None
+    if features is not None:
+        vol, velocity, fair = features
+    if (engine.uses_stats and vol is None) or (engine.uses_fair and fair is None):
+        vol, velocity, fair = condition_features(data, engine.stats_window, engine.uses_fair)
+    rule_idx, ok, side = engine.evaluate_many(data.remaining[None, :], signal, data.up, data.down, vol, velocity, fair)
+    side_price = np.where(side > 0, data.up, data.down)
+    rows = np.arange(W)
+
+    # 状态 (均为长度 W 的数组)
+    entry_inflight = np.zeros(W, dtype=bool)
+    pending = np.zeros(W, dtype=bool)
+    pend_j = np.zeros(W, dtype=np.int32)
+    pend_price = np.zeros(W)
+    pend_side = np.zeros(W, dtype=np.int8)
+    pend_min = np.full(W, np.inf)  # 挂单以来该方向的最低中间价 (touch 模型)
+    check_inflight = np.zeros(W, dtype=bool)
+    check_filled = np.zeros(W, dtype=bool)
+    pos = np.zeros(W, dtype=bool)
+    pos_side = np.zeros(W, dtype=np.int8)
+    last_side = np.zeros(W, dtype=np.int8)
+    retry = np.zeros(W, dtype=np.int32)
+    slot = np.zeros(W, dtype=np.int32)     # 当前/下一笔开仓在 TradeTable 中的列
+
+    def fill_now(mask, j):
+        if fill_model == "always":
+            return mask.copy()
+        mid = np.where(pend_side > 0, data.up[:, j], data.down[:, j])
+        if fill_model == "check":
+            return mask & (mid <= pend_price)
+        return mask & (np.minimum(pend_min, mid) <= pend_price)
+
+    for j in range(T):
+        # 1. 处理上一tick提交的交易意图
+        m = entry_inflight
+        pending = pending | m
+        entry_inflight = np.zeros(W, dtype=bool)
+
+        m = check_inflight
+        filled = m & check_filled
+        cur = slot - 1
+        trades.filled[rows[filled], cur[filled]] = True
+        pos = pos | filled
+        pos_side = np.where(filled, pend_side, pos_side)
+        pending = pending & ~m
+        check_inflight = np.zeros(W, dtype=bool)
+
+        # touch 模型记录挂单期间最低价
+        if fill_model == "touch":
+            mid = np.where(pend_side > 0, data.up[:, j], data.down[:, j])
+            pend_min = np.where(pending, np.fmin(pend_min, mid), np.inf)
+
+        # 2. 条件触发
+        trig = ok[:, j]
+        s = side[:, j]
+        price = side_price[:, j]
+
+        # 2a. 超时挂单: 查询状态, 未成交则撤单
+        due = trig & pending & ((j - pend_j) > order_timeout)
+        check_inflight = due
+        check_filled = fill_now(due, j)
+
+        # 2b. 新开仓
+        new = trig & ~pending & ~pos & (last_side != s) & (retry < K)
+        if new.any():
+            r = rows[new]
+            c = slot[new]
+            trades.rule[r, c] = rule_idx[new, j]
+            trades.side[r, c] = s[new]
+            trades.entry_price[r, c] = price[new]
+            trades.entry_j[r, c] = j
+            entry_inflight = new
+            pend_j = np.where(new, j, pend_j)
+            pend_price = np.where(new, price, pend_price)
+            pend_side = np.where(new, s, pend_side)
+            pend_min = np.where(new, np.inf, pend_min)
+            last_side = np.where(new, s, last_side)
+            retry = retry + new
+            slot = slot + new
+
+        # 3. 止损
+        stop = pos & (diff_abs[:, j] < stop_loss_diff)
+        if stop.any():
+            r = rows[stop]
+            c = slot[stop] - 1
+            exit_price = np.where(pos_side > 0, data.up[:, j], data.down[:, j])
+            trades.exit_price[r, c] = exit_price[stop]
+            trades.exit_j[r, c] = j
+            trades.exit_reason[r, c] = EXIT_STOP
+            pos = pos & ~stop
+
+    # 窗口结束: 未处理的查询结果生效, 未确认的挂单按成交模型判定
+    last = T - 1
+    filled = check_inflight & check_filled
+    unresolved = (pending & ~check_inflight) | entry_inflight
+    if fill_model == "touch":
+        mid = np.where(pend_side > 0, data.up[:, last], data.down[:, last])
+        pend_min = np.where(unresolved, np.fmin(pend_min, mid), pend_min)
+    filled = filled | fill_now(unresolved, last)
+    cur = slot - 1
+    trades.filled[rows[filled], cur[filled]] = True
+    pos = pos | filled
+    held = pos
+    r = rows[held]
+    c = slot[held] - 1
+    trades.exit_reason[r, c] = EXIT_SETTLE
+    trades.exit_j[r, c] = T
+
+    # 盈亏: 止损按卖出价, 持有到期按结算方向兑付 (结果未知则为 NaN)
+    win = (trades.side == data.outcome[:, None]).astype(np.float64)
+    settle_value = np.where(data.outcome[:, None] != 0, win, np.nan)
+    exit_value = np.where(trades.exit_reason == EXIT_STOP, trades.exit_price, settle_value)
+    trades.pnl = np.where(trades.filled, (exit_value - trades.entry_price) * size, np.nan)
+    return trades
+
+
+def summarize(trades, engine):
+    """按条件汇总: 开仓次数, 成交率, 止损次数, 胜率, 盈亏"""
+    rows = []
+    for i, rule in enumerate(engine.rules):
+        m = trades.rule == i
+        entries = int(m.sum())
+        filled = m & trades.filled
+        settled = filled & ~np.isnan(trades.pnl)
+        n_fill = int(filled.sum())
+        n_settled = int(settled.sum())
+        pnl = trades.pnl[settled]
+        rows.append({
+            "rule": rule.name,
+            "entries": entries,
+            "fills": n_fill,
+            "fill_rate": (n_fill / entries) if entries else None,
+            "stops": int((filled & (trades.exit_reason == EXIT_STOP)).sum()),
+            "settled": n_settled,
+            "hit_rate": float((pnl > 0).mean()) if n_settled else None,
+            "pnl": float(pnl.sum()) if n_settled else 0.0,
+            "avg_pnl": float(pnl.mean()) if n_settled else None,
+        })
+    pnl_all = trades.pnl[~np.isnan(trades.pnl)]
+    total = {
+        "rule": "合计",
+        "entries": int((trades.rule >= 0).sum()),
+        "fills": int(trades.filled.sum()),
+        "stops": int((trades.filled & (trades.exit_reason == EXIT_STOP)).sum()),
+        "settled": int(len(pnl_all)),
+        "hit_rate": float((pnl_all > 0).mean()) if len(pnl_all) else None,
+        "pnl": float(pnl_all.sum()) if len(pnl_all) else 0.0,
+        "avg_pnl": float(pnl_all.mean()) if len(pnl_all) else None,
+    }
+    total["fill_rate"] = (total["fills"] / total["entries"]) if total["entries"] else None
+    return rows, total
+
+
+def _fmt_pct(v):
+    return "-" if v is None else f"{v*100:.1f}%"
+
+
+def _fmt_num(v, fmt="+.3f"):
+    return "-" if v is None else format(v, fmt)
+
+
+def print_summary(rows, total, windows, fill_model):
+    print(f"窗口: {windows}  成交模型: {fill_model}")
+    print(f"{'条件':<10}{'开仓':>6}{'成交':>6}{'成交率':>8}{'止损':>6}{'结算':>6}{'胜率':>8}{'盈亏':>12}{'均值':>10}")
+    for r in rows + [total]:
+        print(f"{r['rule']:<10}{r['entries']:>6}{r['fills']:>6}{_fmt_pct(r['fill_rate']):>8}{r['stops']:>6}"
+              f"{r['settled']:>6}{_fmt_pct(r['hit_rate']):>8}{r['pnl']:>+12.3f}{_fmt_num(r['avg_pnl']):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="15分钟窗口向量化回测")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_build = sub.add_parser("build", help="从录制文件生成回测数据")
+    p_build.add_argument("path", help="录制文件或目录")
+    p_build.add_argument("-o", "--output", default="windows.npz")
+    p_build.add_argument("--index", default="", help="market_index.py 生成的索引, 用其开盘价和结算结果")
+
+    p_run = sub.add_parser("run", help="运行回测")
+    p_run.add_argument("data", help="build 生成的 .npz 文件")
+    p_run.add_argument("--fill-model", choices=FILL_MODELS, default="check")
+    p_run.add_argument("--stop-loss", type=float, default=STOP_LOSS_DIFF)
+    p_run.add_argument("--timeout", type=int, default=ORDER_TIMEOUT_SEC)
+    p_run.add_argument("--max-retry", type=int, default=MAX_RETRY_PER_MARKET)
+    p_run.add_argument("--size", type=float, default=TRADE_AMOUNT)
+    p_run.add_argument("--json", default="", help="把汇总写入JSON文件")
+    args = parser.parse_args()
+
+    if args.cmd == "build":
+        from feed_recorder import list_feed_files
+        paths = list_feed_files(args.path)
+        if not paths:
+            print(f"没有找到录制文件: {args.path}")
+            sys.exit(1)
+        data = build_from_captures(paths)
+        if args.index:
+            from market_index import MarketIndex
+            index = MarketIndex(args.index)
+            print(f"从索引更新 {apply_market_index(data, index)} 个窗口的开盘价和结算结果")
+            index.close()
+        data.save(args.output)
+        print(f"已生成 {args.output}: {len(data)} 个窗口, 结果已知 {int((data.outcome != 0).sum())} 个")
+        return
+
+    data = WindowData.load(args.data)
+    if LEAD_LAG_TRIGGER:
+        print(f"LEAD_LAG_TRIGGER 已开启: 条件按领先预测价差求值 (有预测的采样点 {data.prediction_coverage()*100:.1f}%)")
+    engine = ConditionEngine(load_rules(base_dir=BASE_DIR))
+    trades = simulate(data, engine, stop_loss_diff=args.stop_loss, order_timeout=args.timeout,
+                      max_retry=args.max_retry, size=args.size, fill_model=args.fill_model)
+    rows, total = summarize(trades, engine)
+    print_summary(rows, total, len(data), args.fill_model)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"conditions": rows, "total": total}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+链上账户读取
+  - RpcClient: 长期持有的 JSON-RPC 客户端, requests.Session 连接池复用 TCP/TLS 连接
+  - RpcPool: 多个节点; 后台定时用 eth_blockNumber 探测延迟与区块高度, 每次调用发往最快的健康节点。
+    读请求超过 hedge 时间未返回时再向下一个节点发出同样的请求 (对冲), 取先成功的结果; 出错时立即换下一个节点。
+    连续出错或区块落后过多的节点标记为不健康, 探测恢复后重新启用
+  - ChainReader: USDC 余额和各持仓 token 的 CTF 余额打包成一次 Multicall3.aggregate 调用 (一次往返);
+    USDC 精度只在第一次读取时一并查询, 之后缓存
+
+用法:
+  python chain_reader.py <RPC地址[,RPC地址...]> <钱包地址> [token_id ...]
+  python chain_reader.py probe <RPC地址[,RPC地址...]>    # 各节点延迟与区块高度
+"""
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from eth_abi import encode as abi_encode, decode as abi_decode
+    HAS_ABI = True
+except ImportError:
+    HAS_ABI = False
+
+MULTICALL3 = "0xcA11bde05977b3631167028862bE2a173976CA11"
+USDC_E_CONTRACT = "0x2791bca1f2de4661ed88a30c99a7a9449aa84174"
+CTF_CONTRACT = "0x4d97dcd97ec945f40cf65f87097ace5ea0476045"
+
+SEL_AGGREGATE = bytes.fromhex("252dba42")       # aggregate((address,bytes)[])
+SEL_BALANCE_OF = bytes.fromhex("70a08231")      # balanceOf(address)
+SEL_DECIMALS = bytes.fromhex("313ce567")        # decimals()
+SEL_BALANCE_OF_1155 = bytes.fromhex("00fdd58e")  # balanceOf(address,uint256)
+SEL_REDEEM_POSITIONS = bytes.fromhex("01b7037c")  # redeemPositions(address,bytes32,bytes32,uint256[])
+
+
+class RpcError(Exception):
+    pass
+
+
+class RpcClient:
+    """单个 JSON-RPC 节点; 多线程共用一个 Session"""
+    def __init__(self, url, timeout=8, pool_size=8):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._ids = iter(range(1, 1 << 62))
+        self._id_lock = threading.Lock()
+
+    def call(self, method, params, timeout=None):
+        with self._id_lock:
+            rid = next(self._ids)
+        r = self.session.post(self.url, json={"jsonrpc": "2.0", "id": rid, "method": method, "params": params},
+                              timeout=timeout or self.timeout)
+        if r.status_code != 200:
+            raise RpcError(f"HTTP {r.status_code}")
+        data = r.json()
+        if data.get("error"):
+            raise RpcError(str(data["error"]))
+        return data.get("result")
+
+    def eth_call(self, to, data, timeout=None):
+        result = self.call("eth_call", [{"to": to, "data": "0x" + data.hex()}, "latest"], timeout=timeout)
+        return bytes.fromhex(str(result or "0x")[2:])
+
+    def close(self):
+        self.session.close()
+
+
+# 可以对冲/重试的只读方法
+_READ_PREFIXES = ("eth_call", "eth_get", "eth_blockNumber", "eth_chainId", "net_")
+
+
+def _redact(url):
+    """只保留协议与主机名, 节点地址中的 API key 不出现在日志和面板上"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.hostname or ''}{f':{parts.port}' if parts.port else ''}"
+
+
+class _Endpoint:
+    __slots__ = ("client", "name", "ewma_ms", "calls", "errors", "streak", "healthy", "block", "last_error")
+
+    def __init__(self, client):
+        self.client = client
+        self.name = _redact(client.url)
+        self.ewma_ms = None
+        self.calls = 0
+        self.errors = 0
+        self.streak = 0      # 连续出错次数
+        self.healthy = True
+        self.block = None
+        self.last_error = ""
+
+    def ok(self, ms):
+        self.calls += 1
+        self.streak = 0
+        self.ewma_ms = ms if self.ewma_ms is None else self.ewma_ms * 0.8 + ms * 0.2
+
+    def fail(self, err, max_errors):
+        self.calls += 1
+        self.errors += 1
+        self.streak += 1
+        self.last_error = str(err)[:200]
+        if self.streak >= max_errors:
+            self.healthy = False
+
+
+class RpcPool:
+    """多个 RPC 节点, 接口与 RpcClient 相同 (call / eth_call)"""
+    def __init__(self, urls, timeout=8, hedge_ms=400, probe_interval=15, max_errors=3, max_lag_blocks=5):
+        urls = [u.strip() for u in urls if u and u.strip()]
+        if not urls:
+            raise ValueError("没有配置 RPC 节点")
+        self.endpoints = [_Endpoint(RpcClient(u, timeout=timeout)) for u in urls]
+        self.timeout = timeout
+        self.hedge_sec = hedge_ms / 1000.0
+        self.probe_interval = probe_interval
+        self.max_errors = max_errors
+        self.max_lag_blocks = max_lag_blocks
+        self.hedges = 0
+        self.running = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._workers = ThreadPoolExecutor(max_workers=2 * len(self.endpoints), thread_name_prefix="rpc")
+
+    @property
+    def url(self):
+        return ",".join(ep.name for ep in self.endpoints)
+
+    def ranked(self):
+        """健康节点按平滑延迟排序 (未测过的按配置顺序排在后面), 不健康的节点作为最后的备选"""
+        with self._lock:
+            eps = list(self.endpoints)
+        inf = float("inf")
+        healthy = sorted((e for e in eps if e.healthy), key=lambda e: inf if e.ewma_ms is None else e.ewma_ms)
+        return healthy + [e for e in eps if not e.healthy]
+
+    def _attempt(self, ep, method, params, timeout):
+        t0 = time.perf_counter()
+        try:
+            result = ep.client.call(method, params, timeout=timeout)
+        except Exception as e:
+            with self._lock:
+                ep.fail(e, self.max_errors)
+            raise
+        with self._lock:
+            ep.ok((time.perf_counter() - t0) * 1000)
+        return result
+
+    def call(self, method, params, timeout=None):
+        queue = self.ranked()
+        errors = []
+        if not method.startswith(_READ_PREFIXES) or len(queue) == 1:
+            # 写请求不对冲, 只在出错时依次换节点
+            for ep in queue:
+                try:
+                    return self._attempt(ep, method, params, timeout)
+                except Exception as e:
+                    errors.append(f"{ep.name}: {e}")
+            raise RpcError("全部节点失败: " + "; ".join(errors))
+        pending = set()
+
+        def launch():
+            ep = queue.pop(0)
+            pending.add(self._workers.submit(self._attempt, ep, method, params, timeout))
+
+        launch()
+        while pending:
+            done, _ = wait(pending, timeout=self.hedge_sec if queue else None, return_when=FIRST_COMPLETED)
+            if not done:
+                self.hedges += 1
+                launch()
+                continue
+            for fut in done:
+                pending.discard(fut)
+                try:
+                    return fut.result()
+                except Exception as e:
+                    errors.append(str(e))
+            if queue and not pending:
+                launch()
+        raise RpcError("全部节点失败: " + "; ".join(errors))
+
+    def eth_call(self, to, data, timeout=None):
+        result = self.call("eth_call", [{"to": to, "data": "0x" + data.hex()}, "latest"], timeout=timeout)
+        return bytes.fromhex(str(result or "0x")[2:])
+
+    def probe(self):
+        """探测所有节点的延迟与区块高度, 更新健康状态"""
+        futures = {ep: self._workers.submit(self._probe_one, ep) for ep in self.endpoints}
+        wait(list(futures.values()))
+        with self._lock:
+            alive = [ep for ep, fut in futures.items() if fut.result()]
+            best = max((ep.block for ep in alive), default=None)
+            for ep in alive:
+                lag = best - ep.block
+                ep.healthy = lag <= self.max_lag_blocks
+                ep.last_error = "" if ep.healthy else f"区块落后 {lag}"
+
+    def _probe_one(self, ep):
+        """探测成功返回 True; 健康状态由 probe() 统一比较区块高度后设置"""
+        t0 = time.perf_counter()
+        try:
+            block = int(str(ep.client.call("eth_blockNumber", [], timeout=min(self.timeout, 5))), 16)
+        except Exception as e:
+            with self._lock:
+                ep.fail(e, self.max_errors)
+            return False
+        with self._lock:
+            ep.ok((time.perf_counter() - t0) * 1000)
+            ep.block = block
+        return True
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.probe()
+            except Exception:
+                pass
+            self._stop.wait(self.probe_interval)
+
+    def start(self):
+        if self.running:
+            return self
+        self.running = True
+        threading.Thread(target=self._loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self._stop.set()
+        self._workers.shutdown(wait=False)
+        for ep in self.endpoints:
+            ep.client.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hedges": self.hedges,
+                "endpoints": [{
+                    "name": ep.name,
+                    "healthy": ep.healthy,
+                    "ewma_ms": None if ep.ewma_ms is None else round(ep.ewma_ms, 1),
+                    "calls": ep.calls,
+                    "errors": ep.errors,
+                    "block": ep.block,
+                    "last_error": ep.last_error,
+                } for ep in self.endpoints],
+            }
+
+
+def redeem_calldata(condition_id, collateral=USDC_E_CONTRACT, index_sets=(1, 2)):
+    """CTF.redeemPositions(抵押品, 0, conditionId, indexSets) 的 calldata (0x 开头的十六进制)"""
+    if not HAS_ABI:
+        raise RuntimeError("缺少 eth_abi (随 web3 安装)")
+    args = abi_encode(["address", "bytes32", "bytes32", "uint256[]"],
+                      [collateral, b"\x00" * 32, bytes.fromhex(condition_id[2:]), list(index_sets)])
+    return "0x" + (SEL_REDEEM_POSITIONS + args).hex()
+
+
+def _address_word(addr):
+    return bytes.fromhex(addr[2:].rjust(64, "0"))
+
+
+class ChainReader:
+    def __init__(self, rpc, usdc=USDC_E_CONTRACT, ctf=CTF_CONTRACT, multicall=MULTICALL3):
+        if not HAS_ABI:
+            raise RuntimeError("缺少 eth_abi (随 web3 安装)")
+        self.rpc = rpc
+        self.usdc = usdc
+        self.ctf = ctf
+        self.multicall = multicall
+        self.decimals = None
+        self.calls = 0
+        self.last_ms = None
+
+    def aggregate(self, calls):
+        """[(合约地址, calldata)] → 各调用的返回数据; 一次 eth_call"""
+        data = SEL_AGGREGATE + abi_encode(["(address,bytes)[]"], [[(to, cd) for to, cd in calls]])
+        t0 = time.perf_counter()
+        raw = self.rpc.eth_call(self.multicall, data)
+        self.calls += 1
+        self.last_ms = (time.perf_counter() - t0) * 1000
+        _, results = abi_decode(["uint256", "bytes[]"], raw)
+        return results
+
+    def account_state(self, user, token_ids=()):
+        """(USDC余额, {token_id: CTF余额}); 余额按 USDC 精度换算 (CTF 持仓份额与抵押品同精度)"""
+        user_word = _address_word(user)
+        token_ids = [str(t) for t in token_ids]
+        calls = [(self.usdc, SEL_BALANCE_OF + user_word)]
+        calls += [(self.ctf, SEL_BALANCE_OF_1155 + user_word + int(t).to_bytes(32, "big")) for t in token_ids]
+        need_decimals = self.decimals is None
+        if need_decimals:
+            calls.append((self.usdc, SEL_DECIMALS))
+        results = self.aggregate(calls)
+        if need_decimals:
+            self.decimals = int.from_bytes(results[-1], "big")
+        scale = 10 ** self.decimals
+        balance = int.from_bytes(results[0], "big") / scale
+        sizes = {t: int.from_bytes(results[i + 1], "big") / scale for i, t in enumerate(token_ids)}
+        return balance, sizes
+
+    def stats(self):
+        out = {"calls": self.calls, "last_ms": None if self.last_ms is None else round(self.last_ms, 1)}
+        if isinstance(self.rpc, RpcPool):
+            out["rpc"] = self.rpc.stats()
+        return out
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(f"用法: python {sys.argv[0]} <RPC地址[,RPC地址...]> <钱包地址> [token_id ...]")
+        print(f"      python {sys.argv[0]} probe <RPC地址[,RPC地址...]>")
+        return
+    if sys.argv[1] == "probe":
+        pool = RpcPool(sys.argv[2].split(","))
+        pool.probe()
+        for ep in pool.stats()["endpoints"]:
+            ms = "-" if ep["ewma_ms"] is None else f"{ep['ewma_ms']:.0f}ms"
+            print(f"{'OK ' if ep['healthy'] else 'BAD'} {ep['name']:<40} {ms:>7}  区块 {ep['block'] or '-'}  {ep['last_error']}")
+        pool.stop()
+        return
+    reader = ChainReader(RpcPool(sys.argv[1].split(",")))
+    balance, sizes = reader.account_state(sys.argv[2], sys.argv[3:])
+    print(f"USDC: {balance:,.6f}  (耗时 {reader.last_ms:.0f}ms)")
+    for token_id, size in sizes.items():
+        print(f"  {token_id}: {size:,.6f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+触发条件引擎
+把条件配置 (时间窗口, 带方向的价差阈值, 概率区间, 方向, 优先级) 编译成扁平规则表,
+每个tick按优先级一次遍历求值; 实盘主循环与回测共用同一套语义:
+按优先级找到第一条 时间+价差 满足的规则, 由它决定触发或跳过 (与原 if/elif 链一致)
+可选过滤: 波动/速度 (Chainlink 滚动统计) 和模型 edge (fair_value 曲面概率 - 市场概率)
+"""
+import os
+import json
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except:
+    HAS_NUMPY = False
+
+# 规则数达到该值时单tick求值改用 NumPy 向量化
+NUMPY_MIN_RULES = int(os.getenv("CONDITION_NUMPY_MIN_RULES", "16"))
+# 波动/速度过滤使用的 Chainlink 滚动窗口 (秒)
+STATS_WINDOW = max(1, int(os.getenv("CONDITION_STATS_WINDOW", "30")))
+
+SIDE_UP = "UP"      # 价差 ≥ +阈值, 检查UP概率, 买UP
+SIDE_DOWN = "DOWN"  # 价差 ≤ -阈值, 检查DOWN概率, 买DOWN
+SIDE_ANY = "ANY"    # |价差| ≥ 阈值, 按价差方向买入
+
+_SIGN = {SIDE_UP: 1, SIDE_DOWN: -1, SIDE_ANY: 0}
+
+# 原 C1~C5 的默认值: (时间, 价差, 方向, 最小概率, 最大概率)
+DEFAULT_CONDITIONS = {
+    1: (120, 30.0, SIDE_UP, 0.95, 1.0),
+    2: (120, 30.0, SIDE_DOWN, 0.0, 0.05),
+    3: (60, 50.0, SIDE_UP, 0.90, 1.0),
+    4: (60, 50.0, SIDE_DOWN, 0.0, 0.20),
+    5: (40, 60.0, SIDE_ANY, None, None),
+}
+
+
+class Rule:
+    """单条触发规则"""
+    __slots__ = ("name", "time", "diff", "side", "min_prob", "max_prob", "priority", "order",
+                 "max_vol", "min_velocity", "min_edge")
+
+    def __init__(self, name, time, diff, side, min_prob=None, max_prob=None, priority=0, order=0,
+                 max_vol=None, min_velocity=None, min_edge=None):
+        side = str(side or SIDE_ANY).upper()
+        if side not in _SIGN:
+            raise ValueError(f"{name}: 未知方向 {side}")
+        self.name = str(name)
+        self.time = int(time)
+        self.diff = float(diff)
+        self.side = side
+        self.min_prob = None if min_prob is None else float(min_prob)
+        self.max_prob = None if max_prob is None else float(max_prob)
+        self.priority = int(priority)
+        self.order = int(order)
+        self.max_vol = None if max_vol is None else float(max_vol)            # 已实现波动上限 (美元)
+        self.min_velocity = None if min_velocity is None else float(min_velocity)  # 顺势速度下限 (美元/秒)
+        self.min_edge = None if min_edge is None else float(min_edge)              # 模型概率 - 市场概率 下限
+
+    @property
+    def has_band(self):
+        return self.min_prob is not None or self.max_prob is not None
+
+    @property
+    def has_filters(self):
+        return self.max_vol is not None or self.min_velocity is not None
+
+    @property
+    def has_edge(self):
+        return self.min_edge is not None
+
+    def edge_ok(self, side, prob, fair):
+        """模型 edge 过滤, fair 为模型 UP 概率; 缺少模型或市场概率时视为不满足"""
+        if self.min_edge is None:
+            return True
+        if fair is None or prob is None:
+            return False
+        model = fair if side == SIDE_UP else 1.0 - fair
+        return model - prob >= self.min_edge
+
+    def stats_ok(self, side, stats):
+        """波动/速度过滤; 没有统计数据时视为不满足"""
+        if not self.has_filters:
+            return True
+        if not stats:
+            return False
+        if self.max_vol is not None and not stats["vol"] <= self.max_vol:
+            return False
+        if self.min_velocity is not None:
+            sign = 1 if side == SIDE_UP else -1
+            if not stats["velocity"] * sign >= self.min_velocity:
+                return False
+        return True
+
+    @property
+    def band(self):
+        lo = 0.0 if self.min_prob is None else self.min_prob
+        hi = 1.0 if self.max_prob is None else self.max_prob
+        return lo, hi
+
+    def _diff_text(self):
+        if self.side == SIDE_DOWN:
+            return f"价差≤-${self.diff:g}"
+        return f"价差≥${self.diff:g}"
+
+    def label(self, side, prob):
+        """触发时的条件描述"""
+        if not self.has_band:
+            return f"{self.name}: 剩余≤{self.time}s 且 {self._diff_text()} (激进)"
+        return f"{self.name}: 剩余≤{self.time}s 且 {self._diff_text()} ({side}概率{prob*100:.0f}%)"
+
+    def skip_message(self, side, prob):
+        lo, hi = self.band
+        prob_text = "N/A" if prob is None else f"{prob*100:.1f}%"
+        return f"{self.name}跳过: {side}概率{prob_text} 不在 {lo*100:.0f}%~{hi*100:.0f}%"
+
+    def stats_message(self, side, stats):
+        if not stats:
+            return f"{self.name}跳过: 波动/速度数据不足"
+        return (f"{self.name}跳过: 波动${stats['vol']:.1f} 速度{stats['velocity']:+.2f}$/s "
+                f"不满足{self._filters_text()}")
+
+    def edge_message(self, side, prob, fair):
+        if fair is None or prob is None:
+            return f"{self.name}跳过: 缺少模型/市场概率"
+        model = fair if side == SIDE_UP else 1.0 - fair
+        return (f"{self.name}跳过: {side}模型{model*100:.1f}% 市场{prob*100:.1f}% "
+                f"edge {(model - prob)*100:+.1f}% < {self.min_edge*100:g}%")
+
+    def _filters_text(self):
+        parts = []
+        if self.max_vol is not None:
+            parts.append(f"波动≤${self.max_vol:g}")
+        if self.min_velocity is not None:
+            parts.append(f"顺势速度≥{self.min_velocity:g}$/s")
+        if self.min_edge is not None:
+            parts.append(f"edge≥{self.min_edge*100:g}%")
+        return " ".join(parts)
+
+    def summary(self):
+        if not self.has_band:
+            band = "激进"
+        else:
+            lo, hi = self.band
+            prob_side = self.side if self.side != SIDE_ANY else "顺势"
+            band = f"{prob_side}概率{lo*100:.0f}-{hi*100:.0f}%"
+        extra = f" {self._filters_text()}" if self.has_filters or self.has_edge else ""
+        return f"{self.name}: 剩余≤{self.time}秒 且 {self._diff_text()} ({band}){extra}"
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "time": self.time,
+            "diff": self.diff,
+            "side": self.side,
+            "min_prob": self.min_prob,
+            "max_prob": self.max_prob,
+            "priority": self.priority,
+            "max_vol": self.max_vol,
+            "min_velocity": self.min_velocity,
+            "min_edge": self.min_edge,
+        }
+
+
+def _env_value(getenv, key, default):
+    v = getenv(key)
+    if v is None or str(v).strip() == "":
+        return default
+    return v
+
+
+def _opt_float(v):
+    if v is None or str(v).strip() == "":
+        return None
+    return float(v)
+
+
+def load_rules_from_env(getenv=os.getenv):
+    """
+    从环境变量读取 CONDITION_N_* (N从1开始连续编号)
+    1~5 未配置时沿用内置默认值, 6及以上需至少配置 CONDITION_N_TIME
+    """
+    rules = []
+    n = 1
+    while True:
+        default = DEFAULT_CONDITIONS.get(n)
+        prefix = f"CONDITION_{n}_"
+        if default is None and not str(getenv(prefix + "TIME") or "").strip():
+            break
+        d_time, d_diff, d_side, d_min, d_max = default or (0, 0.0, SIDE_ANY, None, None)
+        rules.append(Rule(
+            name=f"条件{n}",
+            time=int(float(_env_value(getenv, prefix + "TIME", d_time))),
+            diff=float(_env_value(getenv, prefix + "DIFF", d_diff)),
+            side=_env_value(getenv, prefix + "SIDE", d_side),
+            min_prob=_opt_float(_env_value(getenv, prefix + "MIN_PROB", d_min)),
+            max_prob=_opt_float(_env_value(getenv, prefix + "MAX_PROB", d_max)),
+            priority=int(_env_value(getenv, prefix + "PRIORITY", n)),
+            order=n,
+            max_vol=_opt_float(getenv(prefix + "MAX_VOL")),
+            min_velocity=_opt_float(getenv(prefix + "MIN_VELOCITY")),
+            min_edge=_opt_float(getenv(prefix + "MIN_EDGE")),
+        ))
+        n += 1
+    return rules
+
+
+def load_rules_from_file(path):
+    """从JSON文件读取规则列表: [{"name","time","diff","side","min_prob","max_prob","priority","max_vol","min_velocity","min_edge"}, ...]"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("conditions") or data.get("rules") or []
+    rules = []
+    for i, item in enumerate(data, 1):
+        rules.append(Rule(
+            name=item.get("name") or f"条件{i}",
+            time=item["time"],
+            diff=item["diff"],
+            side=item.get("side", SIDE_ANY),
+            min_prob=_opt_float(item.get("min_prob")),
+            max_prob=_opt_float(item.get("max_prob")),
+            priority=item.get("priority", i),
+            order=i,
+            max_vol=_opt_float(item.get("max_vol")),
+            min_velocity=_opt_float(item.get("min_velocity")),
+            min_edge=_opt_float(item.get("min_edge")),
+        ))
+    return rules
+
+
+def load_rules(getenv=os.getenv, base_dir=None):
+    """配置了 CONDITIONS_FILE 时从文件读取, 否则读取 CONDITION_N_* 环境变量"""
+    path = str(getenv("CONDITIONS_FILE") or "").strip()
+    if path:
+        if base_dir and not os.path.isabs(path):
+            path = os.path.join(base_dir, path)
+        return load_rules_from_file(path)
+    return load_rules_from_env(getenv)
+
+
+class ConditionEngine:
+    """编译后的规则表"""
+    def __init__(self, rules, stats_window=STATS_WINDOW):
+        self.rules = sorted(rules, key=lambda r: (r.priority, r.order))
+        self.stats_window = int(stats_window)
+        self.uses_stats = any(r.has_filters for r in self.rules)
+        self.uses_fair = any(r.has_edge for r in self.rules)
+        # 扁平表: (时间, 方向符号, 价差阈值, 是否有概率区间, 下限, 上限)
+        self.table = []
+        for r in self.rules:
+            lo, hi = r.band
+            self.table.append((r.time, _SIGN[r.side], r.diff, r.has_band, lo, hi))
+        self.max_time = max([r.time for r in self.rules], default=0)
+        self.vectorized = HAS_NUMPY and len(self.rules) >= NUMPY_MIN_RULES
+        if HAS_NUMPY:
+            self._time = np.array([t[0] for t in self.table], dtype=np.float64)
+            self._sign = np.array([t[1] for t in self.table], dtype=np.int8)
+            self._diff = np.array([t[2] for t in self.table], dtype=np.float64)
+            self._has_band = np.array([t[3] for t in self.table], dtype=bool)
+            self._lo = np.array([t[4] for t in self.table], dtype=np.float64)
+            self._hi = np.array([t[5] for t in self.table], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def first_gate(self, remaining, diff):
+        """返回第一条 时间+价差 满足的规则下标, 无则 -1"""
+        if self.vectorized:
+            signed = np.where(self._sign == 0, abs(diff), diff * self._sign)
+            hit = (remaining <= self._time) & (signed >= self._diff)
+            if not hit.any():
+                return -1
+            return int(hit.argmax())
+        diff_abs = abs(diff)
+        for i, (t, sign, d, _, _, _) in enumerate(self.table):
+            if remaining > t:
+                continue
+            if sign > 0:
+                if diff >= d:
+                    return i
+            elif sign < 0:
+                if diff <= -d:
+                    return i
+            elif diff_abs >= d:
+                return i
+        return -1
+
+    def evaluate(self, remaining, diff, up_price, down_price, stats=None, fair=None):
+        """
+        单tick求值, stats 为 Chainlink 滚动统计 {"vol", "velocity", ...} (规则有波动/速度过滤时使用),
+        fair 为模型 UP 概率 (规则有 edge 过滤时使用)
+        返回 None (无规则命中) 或 {"rule", "triggered", "side", "prob", "reason"}
+        triggered=False 表示命中的规则因概率不在区间 (reason="band")、
+        波动/速度不满足 (reason="stats") 或 edge 不足 (reason="edge") 被跳过, 不再继续匹配后续规则
+        """
+        i = self.first_gate(remaining, diff)
+        if i < 0:
+            return None
+        _, sign, _, has_band, lo, hi = self.table[i]
+        if sign > 0:
+            side = SIDE_UP
+        elif sign < 0:
+            side = SIDE_DOWN
+        else:
+            side = SIDE_UP if diff > 0 else SIDE_DOWN
+        prob = up_price if side == SIDE_UP else down_price
+        rule = self.rules[i]
+        ok = True
+        reason = ""
+        if has_band:
+            ok = prob is not None and lo <= prob <= hi
+            reason = "" if ok else "band"
+        if ok and not rule.stats_ok(side, stats):
+            ok = False
+            reason = "stats"
+        if ok and not rule.edge_ok(side, prob, fair):
+            ok = False
+            reason = "edge"
+        return {"rule": rule, "triggered": ok, "side": side, "prob": prob, "reason": reason}
+
+    def evaluate_many(self, remaining, diff, up_price, down_price, vol=None, velocity=None, fair=None):
+        """
+        向量化批量求值 (回测用), 输入为同形状数组; vol/velocity/fair 缺失 (或为 NaN) 时过滤视为不满足
+        返回 (规则下标数组 -1=无, 是否触发数组, 方向数组 1=UP -1=DOWN 0=无)
+        """
+        remaining = np.asarray(remaining, dtype=np.float64)
+        diff = np.asarray(diff, dtype=np.float64)
+        up_price = np.asarray(up_price, dtype=np.float64)
+        down_price = np.asarray(down_price, dtype=np.float64)
+        idx = np.full(diff.shape, -1, dtype=np.int32)
+        diff_abs = np.abs(diff)
+        # 逆序覆盖, 最终保留优先级最高的命中规则
+        for i in range(len(self.table) - 1, -1, -1):
+            t, sign, d, _, _, _ = self.table[i]
+            if sign > 0:
+                hit = diff >= d
+            elif sign < 0:
+                hit = diff <= -d
+            else:
+                hit = diff_abs >= d
+            hit &= remaining <= t
+            idx[hit] = i
+        matched = idx >= 0
+        safe = np.where(matched, idx, 0)
+        sign = self._sign[safe]
+        side = np.where(sign != 0, sign, np.where(diff > 0, 1, -1)).astype(np.int8)
+        prob = np.where(side > 0, up_price, down_price)
+        in_band = (prob >= self._lo[safe]) & (prob <= self._hi[safe])
+        ok = matched & (~self._has_band[safe] | in_band)
+        if self.uses_stats:
+            nan = np.full(diff.shape, np.nan)
+            vol = nan if vol is None else np.asarray(vol, dtype=np.float64)
+            velocity = nan if velocity is None else np.asarray(velocity, dtype=np.float64)
+            has_max = np.array([r.max_vol is not None for r in self.rules])[safe]
+            has_min = np.array([r.min_velocity is not None for r in self.rules])[safe]
+            max_vol = np.array([r.max_vol or 0.0 for r in self.rules])[safe]
+            min_vel = np.array([r.min_velocity or 0.0 for r in self.rules])[safe]
+            ok &= ~has_max | (vol <= max_vol)
+            ok &= ~has_min | (velocity * side >= min_vel)
+        if self.uses_fair:
+            fair = np.full(diff.shape, np.nan) if fair is None else np.asarray(fair, dtype=np.float64)
+            model = np.where(side > 0, fair, 1.0 - fair)
+            has_edge = np.array([r.min_edge is not None for r in self.rules])[safe]
+            min_edge = np.array([r.min_edge or 0.0 for r in self.rules])[safe]
+            ok &= ~has_edge | (model - prob >= min_edge)
+        side = np.where(matched, side, 0).astype(np.int8)
+        return idx, ok, side
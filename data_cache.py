@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Data API 共享缓存
+持仓、已平仓、成交流水按 (接口, 钱包地址) 缓存 ttl 秒, 自动领取与面板账户快照共用同一份数据:
+  - 过期前的读取直接返回缓存
+  - 同一键正在请求时, 其它线程等待这次请求的结果, 不重复发请求 (single-flight)
+  - 自己下单、成交、止损、领取后调用 invalidate() 作废, 下次读取重新请求
+  - 加载函数返回 None 视为请求失败, 不缓存
+"""
+import time
+import threading
+
+
+class _Flight:
+    __slots__ = ("done", "value", "gen")
+
+    def __init__(self, gen):
+        self.done = threading.Event()
+        self.value = None
+        self.gen = gen
+
+
+class TTLCache:
+    def __init__(self, ttl):
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._entries = {}   # (接口, 地址) → (过期时间, 值)
+        self._inflight = {}  # (接口, 地址) → _Flight
+        self._gen = 0        # 每次作废加一; 作废前发出的请求结果不写入缓存
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def get(self, endpoint, user, loader):
+        """缓存中的值; 没有或已过期时调用 loader() 加载 (同一键同时只加载一次)"""
+        key = (endpoint, user)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+            flight = self._inflight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self._inflight[key] = _Flight(self._gen)
+                self.misses += 1
+                leader = True
+        if not leader:
+            flight.done.wait()
+            return flight.value
+        value = None
+        try:
+            value = loader()
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                if value is not None and flight.gen == self._gen:
+                    self._entries[key] = (time.time() + self.ttl, value)
+            flight.value = value
+            flight.done.set()
+        return value
+
+    def invalidate(self, user=None, endpoints=None):
+        """作废某地址 (None 为全部地址) 的缓存; endpoints 为 None 时作废所有接口"""
+        with self._lock:
+            self._gen += 1
+            self.invalidations += 1
+            for table in (self._entries, self._inflight):
+                for key in [k for k in table if (user is None or k[1] == user)
+                            and (endpoints is None or k[0] in endpoints)]:
+                    del table[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+公允概率曲面
+窗口结束时 Chainlink ≥ PTB 即 UP 结算, 视作数字期权; 假设剩余时间内价格为无漂移布朗运动:
+  P(UP) = Φ(diff / (σ·√T))
+  σ: 每 √秒 的价格波动 (美元), 由 Chainlink 滚动窗口的已实现波动换算 σ = vol / √窗口时长
+启动时把 P(UP) 按 (价差, 剩余秒数, σ) 预先算成查找网格, 每tick只做一次三线性插值。
+网格轴: 价差均匀; 剩余时间按 √T 均匀 (临近结束时更密); σ 按对数均匀。
+也可用 FAIR_VALUE_SURFACE 指向同样轴定义的 .npz 曲面 (例如由历史数据统计得到) 替换模型曲面。
+
+用法:
+  python fair_value.py 30 60 5          # 查询 价差=30 剩余=60s σ=5 的UP概率
+  python fair_value.py save surface.npz # 导出模型曲面
+"""
+import os
+import sys
+import math
+
+import numpy as np
+
+# 没有足够tick估计波动时使用的 σ (美元/√秒)
+DEFAULT_SIGMA = float(os.getenv("FAIR_VALUE_SIGMA", "6"))
+
+DIFF_MAX = 400.0
+DIFF_STEP = 4.0
+TIME_MAX = 900.0
+TIME_POINTS = 121
+SIGMA_MIN = 0.5
+SIGMA_MAX = 50.0
+SIGMA_POINTS = 41
+
+
+def _norm_cdf(z):
+    """标准正态分布函数 (Abramowitz-Stegun 7.1.26, 误差 < 1e-7), 支持 ±inf"""
+    z = np.asarray(z, dtype=np.float64)
+    x = np.abs(z) / math.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1.0 - poly * np.exp(-x * x)
+    return 0.5 * (1.0 + np.sign(z) * erf)
+
+
+def model_surface(diffs, times, sigmas):
+    """模型曲面 [价差, 时间, σ]; T=0 时按价差符号直接结算 (价差=0 取 0.5)"""
+    d = diffs[:, None, None]
+    scale = np.sqrt(times)[None, :, None] * sigmas[None, None, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(scale > 0, d / np.where(scale > 0, scale, 1.0), np.sign(d) * np.inf)
+    p = _norm_cdf(z)
+    p = np.where(np.isnan(p), 0.5, p)
+    return p.astype(np.float32)
+
+
+class FairValueSurface:
+    """P(UP) 查找网格; lookup 为单tick O(1), lookup_many 为回测用的向量化版本"""
+    def __init__(self, diff_max=DIFF_MAX, diff_step=DIFF_STEP, time_max=TIME_MAX, time_points=TIME_POINTS,
+                 sigma_min=SIGMA_MIN, sigma_max=SIGMA_MAX, sigma_points=SIGMA_POINTS, grid=None):
+        self.diff_max = float(diff_max)
+        self.diff_step = float(diff_step)
+        self.time_max = float(time_max)
+        self.sigma_min = float(sigma_min)
+        self.sigma_max = float(sigma_max)
+        self.nd = int(round(2 * self.diff_max / self.diff_step)) + 1
+        self.nt = int(time_points)
+        self.ns = int(sigma_points)
+        self.diffs = np.linspace(-self.diff_max, self.diff_max, self.nd)
+        self.roots = np.linspace(0.0, math.sqrt(self.time_max), self.nt)
+        self.log_sigmas = np.linspace(math.log(self.sigma_min), math.log(self.sigma_max), self.ns)
+        self._root_step = float(self.roots[1] - self.roots[0])
+        self._log0 = float(self.log_sigmas[0])
+        self._log_step = float(self.log_sigmas[1] - self.log_sigmas[0])
+        if grid is None:
+            grid = model_surface(self.diffs, self.roots ** 2, np.exp(self.log_sigmas))
+        grid = np.asarray(grid, dtype=np.float32)
+        if grid.shape != (self.nd, self.nt, self.ns):
+            raise ValueError(f"曲面形状 {grid.shape} 与网格轴 {(self.nd, self.nt, self.ns)} 不符")
+        self.grid = grid
+
+    def _coords(self, diff, remaining, sigma):
+        x = (min(max(diff, -self.diff_max), self.diff_max) + self.diff_max) / self.diff_step
+        y = math.sqrt(min(max(remaining, 0.0), self.time_max)) / self._root_step
+        z = (math.log(min(max(sigma, self.sigma_min), self.sigma_max)) - self._log0) / self._log_step
+        return x, y, z
+
+    def lookup(self, diff, remaining, sigma):
+        """单点三线性插值, 返回 P(UP)"""
+        x, y, z = self._coords(float(diff), float(remaining), float(sigma))
+        i = min(int(x), self.nd - 2)
+        j = min(int(y), self.nt - 2)
+        k = min(int(z), self.ns - 2)
+        fx, fy, fz = x - i, y - j, z - k
+        (a, b), (c, d) = self.grid[i:i + 2, j:j + 2, k:k + 2].tolist()
+        lo = (a[0] + (c[0] - a[0]) * fx) * (1 - fy) + (b[0] + (d[0] - b[0]) * fx) * fy
+        hi = (a[1] + (c[1] - a[1]) * fx) * (1 - fy) + (b[1] + (d[1] - b[1]) * fx) * fy
+        return lo + (hi - lo) * fz
+
+    def lookup_many(self, diff, remaining, sigma):
+        """同形状数组的批量插值; NaN 输入得到 NaN"""
+        diff, remaining, sigma = np.broadcast_arrays(np.asarray(diff, dtype=np.float64),
+                                                     np.asarray(remaining, dtype=np.float64),
+                                                     np.asarray(sigma, dtype=np.float64))
+        bad = np.isnan(diff) | np.isnan(remaining) | np.isnan(sigma)
+        x = (np.clip(np.nan_to_num(diff), -self.diff_max, self.diff_max) + self.diff_max) / self.diff_step
+        y = np.sqrt(np.clip(np.nan_to_num(remaining), 0.0, self.time_max)) / self._root_step
+        z = (np.log(np.clip(np.nan_to_num(sigma, nan=self.sigma_min), self.sigma_min, self.sigma_max))
+             - self._log0) / self._log_step
+        i = np.minimum(x.astype(np.int64), self.nd - 2)
+        j = np.minimum(y.astype(np.int64), self.nt - 2)
+        k = np.minimum(z.astype(np.int64), self.ns - 2)
+        fx, fy, fz = x - i, y - j, z - k
+        g = self.grid
+        out = np.zeros(diff.shape)
+        for di in (0, 1):
+            wx = fx if di else 1.0 - fx
+            for dj in (0, 1):
+                wy = fy if dj else 1.0 - fy
+                for dk in (0, 1):
+                    wz = fz if dk else 1.0 - fz
+                    out += wx * wy * wz * g[i + di, j + dj, k + dk]
+        out[bad] = np.nan
+        return out
+
+    def save(self, path):
+        np.savez_compressed(path, grid=self.grid, axes=np.array([
+            self.diff_max, self.diff_step, self.time_max, self.nt, self.sigma_min, self.sigma_max, self.ns]))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            diff_max, diff_step, time_max, nt, sigma_min, sigma_max, ns = f["axes"].tolist()
+            return cls(diff_max, diff_step, time_max, int(nt), sigma_min, sigma_max, int(ns), grid=f["grid"])
+
+
+def sigma_from_stats(stats, default=DEFAULT_SIGMA):
+    """滚动统计 {"vol", "span", "count"} → σ (美元/√秒); 数据不足时返回默认值"""
+    if not stats or stats.get("count", 0) < 3 or not stats.get("span"):
+        return default
+    sigma = stats["vol"] / math.sqrt(stats["span"])
+    return sigma if sigma > 0 else default
+
+
+def sigma_from_vol(vol, window, default=DEFAULT_SIGMA):
+    """回测用: 按秒采样的滚动已实现波动矩阵 → σ 矩阵, NaN 处用默认值"""
+    sigma = np.asarray(vol, dtype=np.float64) / math.sqrt(window)
+    return np.where(np.isnan(sigma) | (sigma <= 0), default, sigma)
+
+
+class FairValue:
+    """实盘每tick的模型估值与 model-vs-market edge"""
+    def __init__(self, surface=None, default_sigma=DEFAULT_SIGMA):
+        self.surface = surface or FairValueSurface()
+        self.default_sigma = float(default_sigma)
+
+    def evaluate(self, diff, remaining, up_price=None, down_price=None, stats=None):
+        sigma = sigma_from_stats(stats, self.default_sigma)
+        fair_up = self.surface.lookup(diff, remaining, sigma)
+        return {
+            "sigma": sigma,
+            "fair_up": fair_up,
+            "fair_down": 1.0 - fair_up,
+            "edge_up": None if up_price is None else fair_up - up_price,
+            "edge_down": None if down_price is None else (1.0 - fair_up) - down_price,
+        }
+
+
+def load_surface(getenv=os.getenv, base_dir=None):
+    """配置了 FAIR_VALUE_SURFACE 时从文件加载, 否则生成模型曲面"""
+    path = str(getenv("FAIR_VALUE_SURFACE") or "").strip()
+    if path:
+        if base_dir and not os.path.isabs(path):
+            path = os.path.join(base_dir, path)
+        return FairValueSurface.load(path)
+    return FairValueSurface()
+
+
+def main():
+    if len(sys.argv) >= 3 and sys.argv[1] == "save":
+        FairValueSurface().save(sys.argv[2])
+        print(f"已保存: {sys.argv[2]}")
+        return
+    if len(sys.argv) < 3:
+        print(f"用法: python {os.path.basename(__file__)} <价差> <剩余秒数> [σ] | save <文件.npz>")
+        return
+    diff, remaining = float(sys.argv[1]), float(sys.argv[2])
+    sigma = float(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_SIGMA
+    surface = load_surface()
+    p = surface.lookup(diff, remaining, sigma)
+    exact = float(_norm_cdf(diff / (sigma * math.sqrt(remaining)))) if remaining > 0 else float(diff > 0)
+    print(f"价差 {diff:+g} 剩余 {remaining:g}s σ {sigma:g}: P(UP)={p:.4f} (模型精确值 {exact:.4f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+行情帧解码
+只取策略用到的字段, 返回元组而不是完整 dict:
+  币安:   decode_binance(帧) → (交易对, 买一, 卖一, 成交价)   bookTicker/aggTrade 为紧凑格式, 直接按字段名扫描, 不走JSON
+  市场:   decode_market(帧)  → [(asset_id, 买一, 卖一), ...]  book 只在价格字段上取最优价, 不转换数量
+  RTDS:   decode_rtds(帧)    → Chainlink 价格或 None
+JSON 后端: 安装了 orjson 时使用 orjson, 否则标准库 json; 可用 FEED_JSON=json 强制标准库。
+
+基准:
+  python feed_decode.py bench captures/   # 按录制帧测量每核每秒可解码的消息数 (原实现 vs 当前实现)
+  python feed_decode.py bench             # 无录制文件时使用合成帧
+"""
+import os
+import sys
+import json
+import time
+
+_BACKEND = os.getenv("FEED_JSON", "auto").strip().lower()
+
+loads = json.loads
+JSON_BACKEND = "json"
+if _BACKEND in ("auto", "orjson"):
+    try:
+        import orjson
+        loads = orjson.loads
+        JSON_BACKEND = "orjson"
+    except ImportError:
+        pass
+
+
+def _field(message, key):
+    """紧凑JSON中 "key":"value" 的字符串值, 没有时返回 None (key 需含引号和冒号, 如 '"b":"')"""
+    i = message.find(key)
+    if i < 0:
+        return None
+    i += len(key)
+    j = message.find('"', i)
+    return message[i:j] if j > i else None
+
+
+def decode_binance(message):
+    """币安组合流/单流帧 → (交易对, 买一, 卖一, 成交价), 无可用字段时返回 None"""
+    if '"b":"' in message and '"a":"' in message:  # bookTicker
+        try:
+            return _field(message, '"s":"') or "", float(_field(message, '"b":"')), float(_field(message, '"a":"')), None
+        except (TypeError, ValueError):
+            pass
+    elif '"p":"' in message:  # aggTrade / trade
+        try:
+            return _field(message, '"s":"') or "", None, None, float(_field(message, '"p":"'))
+        except (TypeError, ValueError):
+            pass
+    # 非紧凑格式等情况走完整解析
+    try:
+        data = loads(message)
+    except Exception:
+        return None
+    if not isinstance(data, dict):
+        return None
+    data = data.get("data", data)
+    symbol = str(data.get("s") or "")
+    try:
+        if "b" in data and "a" in data and isinstance(data.get("b"), str):
+            return symbol, float(data["b"]), float(data["a"]), None
+        if "p" in data:
+            return symbol, None, None, float(data["p"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def _best(levels, highest):
+    """
+    最优价位: 价格均为 "0.xx" 形式时字符串大小与数值大小一致, 直接比较字符串, 只转换一次 float;
+    出现其它格式时退回逐档 float
+    """
+    prices = [level["price"] for level in levels if "price" in level]
+    if not prices:
+        return None
+    lo, hi = min(prices), max(prices)
+    if lo.startswith("0.") and hi.startswith("0."):
+        return float(hi if highest else lo)
+    values = [float(p) for p in prices]
+    return max(values) if highest else min(values)
+
+
+def decode_market(message):
+    """市场频道帧 → [(asset_id, 买一, 卖一)], 只包含买一卖一都有效的条目"""
+    try:
+        data = loads(message)
+    except Exception:
+        return []
+    items = data if isinstance(data, list) else [data]
+    out = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        event_type = item.get("event_type")
+        if event_type == "book":
+            bids = item.get("bids")
+            asks = item.get("asks")
+            if not bids or not asks:
+                continue
+            best_bid = _best(bids, True)
+            best_ask = _best(asks, False)
+            if best_bid is not None and best_ask is not None:
+                out.append((item.get("asset_id"), best_bid, best_ask))
+        elif event_type == "price_change":
+            changes = item.get("price_changes")
+            if not changes:
+                continue
+            pc = changes[0]
+            try:
+                best_bid = float(pc.get("best_bid", 0))
+                best_ask = float(pc.get("best_ask", 0))
+            except (TypeError, ValueError):
+                continue
+            if best_bid > 0 and best_ask > 0:
+                out.append((item.get("asset_id"), best_bid, best_ask))
+    return out
+
+
+def parse_rtds(data):
+    """已解析的 RTDS 消息 → Chainlink BTC 价格, 无价格返回 None"""
+    if data.get("topic") == "crypto_prices" and data.get("payload"):
+        payload = data["payload"]
+        if "data" in payload and payload.get("symbol") == "btc/usd":
+            prices = payload["data"]
+            if prices:
+                return prices[-1]["value"]
+        elif "value" in payload:
+            return payload["value"]
+    return None
+
+
+def decode_rtds(message):
+    """RTDS 帧 → Chainlink 价格; 非 JSON 或字段缺失/类型不对的帧返回 None"""
+    try:
+        data = loads(message)
+        return parse_rtds(data) if isinstance(data, dict) else None
+    except (ValueError, KeyError, TypeError, IndexError, AttributeError):
+        return None
+
+
+# ============== 基准 ==============
+def _legacy_binance(message):
+    data = json.loads(message)
+    data = data.get("data", data)
+    if "b" in data and "a" in data:
+        return float(data["b"]), float(data["a"])
+    if "p" in data:
+        return float(data["p"])
+    return None
+
+
+def _legacy_market(message):
+    data = json.loads(message)
+    items = data if isinstance(data, list) else [data]
+    out = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        if item.get("event_type") == "book":
+            bids = item.get("bids") or []
+            asks = item.get("asks") or []
+            if bids and asks:
+                out.append((max([float(b["price"]) for b in bids], default=0),
+                            min([float(a["price"]) for a in asks], default=0)))
+        elif item.get("event_type") == "price_change":
+            pc = (item.get("price_changes") or [{}])[0]
+            out.append((float(pc.get("best_bid", 0)), float(pc.get("best_ask", 0))))
+    return out
+
+
+def _legacy_rtds(message):
+    return parse_rtds(json.loads(message))
+
+
+def _synthetic_frames():
+    """没有录制文件时的样例帧 (格式与线上一致)"""
+    book = {
+        "event_type": "book", "asset_id": "1234567890", "market": "0xabc",
+        "bids": [{"price": f"{p / 100:.2f}", "size": "125.5"} for p in range(1, 60)],
+        "asks": [{"price": f"{p / 100:.2f}", "size": "80.25"} for p in range(99, 60, -1)],
+        "timestamp": "1760000000000", "hash": "0xdef",
+    }
+    change = {"event_type": "price_change", "asset_id": "1234567890", "market": "0xabc",
+              "price_changes": [{"asset_id": "1234567890", "price": "0.59", "size": "10", "side": "BUY",
+                                 "best_bid": "0.59", "best_ask": "0.61"}], "timestamp": "1760000000000"}
+    ticker = ('{"stream":"btcusdt@bookTicker","data":{"u":400900217,"s":"BTCUSDT","b":"104250.01000000",'
+              '"B":"1.23400000","a":"104250.02000000","A":"0.56700000"}}')
+    trade = ('{"stream":"btcusdt@aggTrade","data":{"e":"aggTrade","E":1760000000123,"s":"BTCUSDT","a":3210987654,'
+             '"p":"104250.01000000","q":"0.01200000","f":4567890123,"l":4567890125,"T":1760000000122,"m":true,"M":true}}')
+    rtds = json.dumps({"topic": "crypto_prices", "type": "update", "timestamp": 1760000000000,
+                       "payload": {"symbol": "btc/usd", "timestamp": 1760000000000, "value": 104249.87}})
+    return {
+        "binance": [ticker, trade] * 500,
+        "market": [json.dumps([book])] * 50 + [json.dumps([change])] * 950,
+        "rtds": [rtds] * 1000,
+    }
+
+
+def _recorded_frames(path, limit=20000):
+    from feed_recorder import iter_feed, list_feed_files, SOURCE_BINANCE, SOURCE_RTDS, SOURCE_MARKET
+    names = {SOURCE_BINANCE: "binance", SOURCE_RTDS: "rtds", SOURCE_MARKET: "market"}
+    frames = {n: [] for n in names.values()}
+    for p in list_feed_files(path):
+        for _, _, source, payload in iter_feed(p):
+            name = names.get(source)
+            if name and len(frames[name]) < limit:
+                frames[name].append(payload)
+        if all(len(v) >= limit for v in frames.values()):
+            break
+    return frames
+
+
+def _rate(fn, frames, min_sec=0.5):
+    """单线程每秒处理的消息数"""
+    n = 0
+    start = time.perf_counter()
+    while True:
+        for f in frames:
+            try:
+                fn(f)
+            except Exception:
+                pass
+        n += len(frames)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_sec:
+            return n / elapsed
+
+
+def bench(path=None):
+    frames = _recorded_frames(path) if path else _synthetic_frames()
+    print(f"JSON后端: {JSON_BACKEND} | 数据: {path or '合成帧'}")
+    print(f"{'来源':<8} {'帧数':>7} {'原实现 msg/s':>14} {'当前 msg/s':>14} {'倍数':>6}")
+    pairs = {
+        "binance": (_legacy_binance, decode_binance),
+        "market": (_legacy_market, decode_market),
+        "rtds": (_legacy_rtds, decode_rtds),
+    }
+    for name, (old, new) in pairs.items():
+        data = frames.get(name) or []
+        if not data:
+            print(f"{name:<8} {0:>7} {'-':>14} {'-':>14}")
+            continue
+        before, after = _rate(old, data), _rate(new, data)
+        print(f"{name:<8} {len(data):>7} {before:>14,.0f} {after:>14,.0f} {after / before:>5.1f}x")
+
+
+def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == "bench":
+        bench(sys.argv[2] if len(sys.argv) > 2 else None)
+        return
+    print(f"用法: python {os.path.basename(__file__)} bench [录制文件或目录]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+原始行情录制
+在各 WebSocket 监听的 on_message 中调用 record(), 把原始帧连同单调时钟接收时间
+写入按15分钟市场slug划分的压缩文件, 供事后分析与回放
+
+文件格式 (gzip): 连续的 [头部 <qdBI: 单调ns, 墙钟秒, 来源, 长度] + [UTF-8 原始帧]
+未正常关闭的文件 (崩溃、正在录制) 读到最后一条完整记录为止; 重启后同一市场的文件若已截断, 改写 <slug>.1.feed.gz 等分片
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import queue
+import zlib
+import struct
+import threading
+
+SOURCE_META = 0     # 录制器自身写入的元数据 (市场信息, PTB 等), 内容为JSON
+SOURCE_BINANCE = 1
+SOURCE_RTDS = 2
+SOURCE_MARKET = 3
+
+SOURCE_NAMES = {
+    SOURCE_META: "meta",
+    SOURCE_BINANCE: "binance",
+    SOURCE_RTDS: "rtds",
+    SOURCE_MARKET: "market",
+}
+
+RECORD_HEADER = struct.Struct("<qdBI")
+FILE_SUFFIX = ".feed.gz"
+# 读取时视为文件在此截断 (进程崩溃或仍在写入时, 最后一个 gzip 成员没有结束标记)
+_TRUNCATED = (EOFError, zlib.error, gzip.BadGzipFile)
+
+_SWITCH = object()
+
+
+class FeedRecorder:
+    """低开销录制器: 监听线程只做一次 put_nowait, 压缩与写盘在后台线程完成"""
+    def __init__(self, out_dir, enabled=True, max_queue=50000, flush_sec=5.0):
+        self.out_dir = out_dir
+        self.enabled = bool(enabled)
+        self.flush_sec = float(flush_sec)
+        self.queue = queue.Queue(maxsize=max(1000, int(max_queue)))
+        self.slug = ""
+        self.path = ""
+        self.recorded = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self.last_error = ""
+        self.running = False
+        self.thread = None
+        self._fh = None
+
+    def record(self, source, message):
+        """监听线程调用: 队列满时直接丢弃并计数, 绝不阻塞"""
+        if not self.enabled:
+            return
+        try:
+            self.queue.put_nowait((time.monotonic_ns(), time.time(), source, message))
+        except queue.Full:
+            self.dropped += 1
+
+    def record_meta(self, kind, data):
+        if not self.enabled:
+            return
+        self.record(SOURCE_META, json.dumps({"kind": kind, "data": data}, ensure_ascii=False))
+
+    def set_window(self, slug, market=None):
+        """切换到新的15分钟市场文件, market 作为首条元数据写入"""
+        if not self.enabled or not slug or slug == self.slug:
+            return
+        self.slug = slug
+        try:
+            self.queue.put((time.monotonic_ns(), time.time(), _SWITCH, slug), timeout=1)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if market:
+            self.record_meta("market", market)
+
+    def _open(self, slug):
+        self._close()
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.path = _writable_path(self.out_dir, slug)
+        # 同一市场重启后追加为新的gzip成员, 读取时自动拼接
+        self._fh = gzip.open(self.path, "ab", compresslevel=6)
+
+    def _close(self):
+        if self._fh is not None:
+            try:
+                self._fh.close()
+            except Exception:
+                pass
+            self._fh = None
+
+    def _write(self, mono_ns, wall, source, message):
+        if self._fh is None:
+            return
+        payload = message if isinstance(message, bytes) else str(message).encode("utf-8")
+        self._fh.write(RECORD_HEADER.pack(mono_ns, wall, source, len(payload)))
+        self._fh.write(payload)
+        self.recorded += 1
+        self.bytes_written += RECORD_HEADER.size + len(payload)
+
+    def _loop(self):
+        last_flush = time.monotonic()
+        while self.running or not self.queue.empty():
+            try:
+                mono_ns, wall, source, message = self.queue.get(timeout=1)
+            except queue.Empty:
+                mono_ns = None
+            try:
+                if mono_ns is not None:
+                    if source is _SWITCH:
+                        self._open(message)
+                    else:
+                        self._write(mono_ns, wall, source, message)
+                if self._fh is not None and time.monotonic() - last_flush >= self.flush_sec:
+                    self._fh.flush()
+                    last_flush = time.monotonic()
+            except Exception as e:
+                self.last_error = str(e)
+        self._close()
+
+    def start(self):
+        if not self.enabled or self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        if not self.running:
+            return
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=timeout)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "slug": self.slug,
+            "path": self.path,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "queued": self.queue.qsize(),
+            "bytes": self.bytes_written,
+            "last_error": self.last_error,
+        }
+
+
+def _feed_name(slug, part):
+    return f"{slug}{FILE_SUFFIX}" if part == 0 else f"{slug}.{part}{FILE_SUFFIX}"
+
+
+def _gzip_complete(path):
+    """文件能完整解压 (最后一个 gzip 成员有结束标记) 时返回 True"""
+    try:
+        with gzip.open(path, "rb") as f:
+            while f.read(1 << 20):
+                pass
+        return True
+    except _TRUNCATED + (OSError,):
+        return False
+
+
+def _writable_path(out_dir, slug):
+    """
+    可以追加的录制文件: 最后一个分片完整时继续追加; 未正常关闭 (截断) 时不再追加,
+    改写下一个分片 <slug>.N.feed.gz, 否则新成员接在截断的成员后面, 之后的数据全部无法读取
+    """
+    part = 0
+    while os.path.exists(os.path.join(out_dir, _feed_name(slug, part + 1))):
+        part += 1
+    path = os.path.join(out_dir, _feed_name(slug, part))
+    if os.path.exists(path) and not _gzip_complete(path):
+        path = os.path.join(out_dir, _feed_name(slug, part + 1))
+    return path
+
+
+def iter_feed(path):
+    """逐条读取录制文件: 产出 (单调ns, 墙钟秒, 来源, 原始帧字符串); 文件截断时在最后一条完整记录处结束"""
+    with gzip.open(path, "rb") as f:
+        while True:
+            try:
+                head = f.read(RECORD_HEADER.size)
+                if len(head) < RECORD_HEADER.size:
+                    return
+                mono_ns, wall, source, length = RECORD_HEADER.unpack(head)
+                payload = f.read(length)
+            except _TRUNCATED:
+                return
+            if len(payload) < length:
+                return
+            yield mono_ns, wall, source, payload.decode("utf-8", errors="replace")
+
+
+def _feed_sort_key(name):
+    """按 (slug, 分片号) 排序: <slug>.feed.gz 在 <slug>.1.feed.gz 之前"""
+    stem = name[:-len(FILE_SUFFIX)]
+    base, _, part = stem.rpartition(".")
+    return (base, int(part)) if base and part.isdigit() else (stem, 0)
+
+
+def list_feed_files(path):
+    """path 为文件时返回自身, 为目录时按文件名 (即时间, 同一市场按分片号) 排序返回其中的录制文件"""
+    if os.path.isfile(path):
+        return [path]
+    names = sorted((n for n in os.listdir(path) if n.endswith(FILE_SUFFIX)), key=_feed_sort_key)
+    return [os.path.join(path, n) for n in names]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(f"用法: python {os.path.basename(__file__)} <录制文件或目录>")
+        return
+    for path in list_feed_files(sys.argv[1]):
+        counts = {}
+        first = last = None
+        for mono_ns, wall, source, _ in iter_feed(path):
+            counts[source] = counts.get(source, 0) + 1
+            first = wall if first is None else first
+            last = wall
+        span = (last - first) if first is not None else 0.0
+        text = " ".join(f"{SOURCE_NAMES.get(k, k)}={v}" for k, v in sorted(counts.items()))
+        print(f"{os.path.basename(path)}: {text} | 时长 {span:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+币安 → Chainlink 领先-滞后估计
+Chainlink 更新大致等于若干毫秒前的币安成交价加一个基差:  C(t) ≈ B(t - L) + basis
+每收到一条 Chainlink 更新, 对每个候选滞后 L 取 B(t - L), 用 EWMA 更新残差均值 (基差) 与方差,
+方差最小的 L 即当前滞后。于是最新币安价 + 基差 就是约 L 毫秒后 Chainlink 的预测值。
+
+  confidence: 1 - 预测均方误差 / "沿用上一条Chainlink" 的均方误差, 即相对不预测的改进 (0~1)
+  lead_ms:    Chainlink 更新到达时, 预测它的那条币安tick早到了多少毫秒 (预测误差超过 2×rmse 记 0), EWMA
+
+每条 Chainlink 更新的计算量为 O(候选滞后数), 只用到最近 max_lag 内的币安tick; 查询预测为 O(1)。
+"""
+import os
+import math
+import threading
+
+import numpy as np
+
+LEAD_LAG_MAX_MS = max(100, int(os.getenv("LEAD_LAG_MAX_MS", "5000")))
+LEAD_LAG_STEP_MS = max(10, int(os.getenv("LEAD_LAG_STEP_MS", "100")))
+# EWMA 衰减: 约等于最近多少条 Chainlink 更新的平均
+LEAD_LAG_SPAN = max(2, int(os.getenv("LEAD_LAG_SPAN", "60")))
+# 至少积累多少条更新才给出预测
+LEAD_LAG_WARMUP = max(2, int(os.getenv("LEAD_LAG_WARMUP", "10")))
+
+
+class LeadLagEstimator:
+    """Chainlink 更新线程写入, 主循环读取快照"""
+    def __init__(self, max_lag_ms=LEAD_LAG_MAX_MS, step_ms=LEAD_LAG_STEP_MS, span=LEAD_LAG_SPAN,
+                 warmup=LEAD_LAG_WARMUP):
+        self.lags = np.arange(0, int(max_lag_ms) + 1, int(step_ms)) / 1000.0  # 秒
+        self.max_lag = float(self.lags[-1])
+        self.alpha = 2.0 / (span + 1.0)
+        self.warmup = int(warmup)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        n = len(self.lags)
+        self.count = 0
+        self.mean = np.zeros(n)     # 各滞后下的残差 (基差) EWMA
+        self.var = np.zeros(n)      # 各滞后下的残差方差 EWMA
+        self.persist_mse = 0.0      # 沿用上一条 Chainlink 的均方误差 EWMA
+        self.best = 0
+        self.last_chainlink = None  # (时间, 价格)
+        self.lead_ms = None
+        self.hits = 0
+
+    def on_chainlink(self, ts, value, binance_ts, binance_val):
+        """
+        收到一条 Chainlink 更新; binance_ts/binance_val 为按时间排序的币安tick (至少覆盖 [ts - max_lag, ts])
+        """
+        with self.lock:
+            self._update(float(ts), float(value), binance_ts, binance_val)
+
+    def _update(self, ts, value, binance_ts, binance_val):
+        if len(binance_ts) == 0:
+            self.last_chainlink = (ts, value)
+            return
+        idx = np.searchsorted(binance_ts, ts - self.lags, side="right") - 1
+        if idx[-1] < 0:
+            # 币安数据不足以覆盖最大滞后, 用最早的一条代替
+            idx = np.maximum(idx, 0)
+        resid = value - binance_val[idx]
+        if self.count > 0:
+            self._measure_lead(ts, value, idx, binance_ts, binance_val)
+        a = 1.0 if self.count == 0 else self.alpha
+        delta = resid - self.mean
+        self.mean += a * delta
+        self.var = (1.0 - a) * (self.var + a * delta * delta)
+        if self.last_chainlink is not None:
+            step = value - self.last_chainlink[1]
+            self.persist_mse = step * step if self.count <= 1 else (
+                (1.0 - self.alpha) * self.persist_mse + self.alpha * step * step)
+        self.count += 1
+        # 方差相同 (例如币安在多个滞后内没有新成交) 时取最小的滞后
+        self.best = int(np.argmin(self.var))
+        self.last_chainlink = (ts, value)
+
+    def _measure_lead(self, ts, value, idx, binance_ts, binance_val):
+        """按当前滞后与基差, 这条 Chainlink 值在多久之前就已由币安tick预测到 (误差在 2×rmse 内)"""
+        i = idx[self.best]
+        err = value - (binance_val[i] + self.mean[self.best])
+        if abs(err) <= max(2.0 * self.rmse, 0.01):
+            lead = (ts - binance_ts[i]) * 1000.0
+            self.hits += 1
+        else:
+            lead = 0.0
+        self.lead_ms = lead if self.lead_ms is None else self.lead_ms + self.alpha * (lead - self.lead_ms)
+
+    @property
+    def ready(self):
+        return self.count >= self.warmup
+
+    @property
+    def lag_ms(self):
+        return float(self.lags[self.best] * 1000.0)
+
+    @property
+    def basis(self):
+        return float(self.mean[self.best])
+
+    @property
+    def rmse(self):
+        return math.sqrt(max(float(self.var[self.best]), 0.0))
+
+    @property
+    def confidence(self):
+        if not self.ready or self.persist_mse <= 0:
+            return 0.0
+        return max(0.0, min(1.0, 1.0 - float(self.var[self.best]) / self.persist_mse))
+
+    def predict(self, binance_price):
+        """由最新币安价预测约 lag_ms 后的 Chainlink, 未就绪时返回 None"""
+        if not self.ready or binance_price is None:
+            return None
+        return float(binance_price) + self.basis
+
+    def snapshot(self, binance_price=None):
+        with self.lock:
+            return self._snapshot(binance_price)
+
+    def _snapshot(self, binance_price):
+        return {
+            "ready": self.ready,
+            "updates": self.count,
+            "lag_ms": self.lag_ms,
+            "basis": self.basis,
+            "rmse": self.rmse,
+            "confidence": self.confidence,
+            "lead_ms": None if self.lead_ms is None else float(self.lead_ms),
+            "hit_rate": self.hits / (self.count - 1) if self.count > 1 else None,
+            "predicted": self.predict(binance_price),
+        }
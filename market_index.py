@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+历史15分钟市场结果索引
+把每个 btc-updown-15m-<ts> 窗口的开盘价 (PTB)、收盘价、UP/DOWN token 和结算结果
+存入本地 SQLite (按窗口开始时间建索引), 供回测和离线分析使用
+
+  - 批量回补: 线程池并发请求 Gamma events 与 crypto-price 接口, 全局令牌桶限速, 429/5xx 退避重试
+  - 增量更新: 实盘切换市场时通知后台线程, 补齐最近已结束但尚未完整入库的窗口
+
+用法:
+  python market_index.py backfill --days 90 [--db markets.db] [--rate 5] [--workers 8]
+  python market_index.py show [--last 20]
+  python market_index.py stats
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+GAMMA_API = "https://gamma-api.polymarket.com"
+CRYPTO_PRICE_API = "https://polymarket.com/api/crypto/crypto-price"
+SLUG_PREFIX = "btc-updown-15m-"
+WINDOW_SEC = 900
+
+OUTCOME_UP = "UP"
+OUTCOME_DOWN = "DOWN"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS windows (
+    start_ts     INTEGER PRIMARY KEY,
+    slug         TEXT NOT NULL UNIQUE,
+    end_ts       INTEGER NOT NULL,
+    open_price   REAL,
+    close_price  REAL,
+    up_token     TEXT,
+    down_token   TEXT,
+    condition_id TEXT,
+    outcome      TEXT,
+    resolved     INTEGER NOT NULL DEFAULT 0,
+    closed       INTEGER NOT NULL DEFAULT 0,
+    fetched_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_windows_outcome ON windows (outcome);
+CREATE INDEX IF NOT EXISTS idx_windows_resolved ON windows (resolved, start_ts);
+"""
+
+_COLUMNS = ("start_ts", "slug", "end_ts", "open_price", "close_price", "up_token", "down_token",
+            "condition_id", "outcome", "resolved", "closed", "fetched_at")
+
+
+def slug_for(start_ts):
+    return f"{SLUG_PREFIX}{int(start_ts)}"
+
+
+def start_of(slug):
+    return int(str(slug).rsplit("-", 1)[-1])
+
+
+def window_starts(since_ts, until_ts):
+    """[since, until) 内所有窗口开始时间 (按900秒对齐)"""
+    first = (int(since_ts) // WINDOW_SEC) * WINDOW_SEC
+    return list(range(first, int(until_ts), WINDOW_SEC))
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(int(ts), tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _json_list(v):
+    if isinstance(v, str):
+        try:
+            v = json.loads(v)
+        except Exception:
+            return []
+    return v if isinstance(v, list) else []
+
+
+class MarketIndex:
+    """SQLite 索引; 一个连接多线程共用, 写操作加锁"""
+    def __init__(self, path):
+        self.path = path
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(_SCHEMA)
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def upsert_many(self, rows):
+        if not rows:
+            return
+        sets = []
+        for c in _COLUMNS[1:]:
+            if c in ("resolved", "closed"):
+                sets.append(f"{c}=MAX(excluded.{c}, windows.{c})")
+            elif c == "outcome":
+                # 已确认的官方结算不会被推断结果覆盖
+                sets.append("outcome=CASE WHEN windows.resolved = 1 AND excluded.resolved = 0 "
+                            "THEN windows.outcome ELSE COALESCE(excluded.outcome, windows.outcome) END")
+            else:
+                sets.append(f"{c}=COALESCE(excluded.{c}, windows.{c})")
+        sql = (f"INSERT INTO windows ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))}) "
+               f"ON CONFLICT(start_ts) DO UPDATE SET " + ", ".join(sets))
+        with self.lock:
+            self.conn.executemany(sql, [tuple(r.get(c) for c in _COLUMNS) for r in rows])
+            self.conn.commit()
+
+    def upsert(self, row):
+        self.upsert_many([row])
+
+    def get(self, slug):
+        with self.lock:
+            r = self.conn.execute("SELECT * FROM windows WHERE start_ts = ?", (start_of(slug),)).fetchone()
+        return dict(r) if r else None
+
+    def range(self, since_ts=None, until_ts=None, resolved_only=False):
+        sql = "SELECT * FROM windows WHERE start_ts >= ? AND start_ts < ?"
+        if resolved_only:
+            sql += " AND resolved = 1"
+        sql += " ORDER BY start_ts"
+        args = (int(since_ts or 0), int(until_ts or 2 ** 62))
+        with self.lock:
+            return [dict(r) for r in self.conn.execute(sql, args).fetchall()]
+
+    def complete_starts(self, starts):
+        """已完整入库 (已结算且开/收盘价齐全) 的窗口开始时间集合"""
+        if not starts:
+            return set()
+        lo, hi = min(starts), max(starts)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT start_ts FROM windows WHERE start_ts BETWEEN ? AND ? AND resolved = 1 "
+                "AND open_price IS NOT NULL AND close_price IS NOT NULL", (lo, hi)).fetchall()
+        return {r[0] for r in rows}
+
+    def stats(self):
+        with self.lock:
+            r = self.conn.execute(
+                "SELECT COUNT(*), SUM(resolved), SUM(outcome = 'UP'), SUM(outcome = 'DOWN'), "
+                "MIN(start_ts), MAX(start_ts) FROM windows").fetchone()
+        total, resolved, up, down, first, last = r
+        return {
+            "windows": total or 0,
+            "resolved": resolved or 0,
+            "up": up or 0,
+            "down": down or 0,
+            "first": slug_for(first) if first is not None else "",
+            "last": slug_for(last) if last is not None else "",
+        }
+
+
+class RateLimiter:
+    """线程安全的令牌桶: rate 次/秒, 允许 burst 次突发"""
+    def __init__(self, rate, burst=None):
+        self.rate = max(0.1, float(rate))
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class WindowFetcher:
+    """抓取单个窗口: Gamma event (token, 结算) + crypto-price (开/收盘价)"""
+    def __init__(self, rate=5.0, proxies=None, retries=3, timeout=10):
+        self.limiter = RateLimiter(rate)
+        self.proxies = proxies or None
+        self.retries = int(retries)
+        self.timeout = timeout
+        self._local = threading.local()
+        self.requests = 0
+        self.errors = 0
+
+    def _session(self):
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = requests.Session()
+            s.headers.update({
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+                "Accept": "application/json",
+                "Referer": "https://polymarket.com/",
+            })
+            self._local.session = s
+        return s
+
+    def _get_json(self, url, params):
+        delay = 1.0
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            self.requests += 1
+            try:
+                r = self._session().get(url, params=params, proxies=self.proxies, timeout=self.timeout)
+                if r.status_code == 200:
+                    return r.json()
+                if r.status_code != 429 and r.status_code < 500:
+                    return None
+            except Exception:
+                pass
+            self.errors += 1
+            if attempt < self.retries:
+                time.sleep(delay)
+                delay = min(delay * 2, 30.0)
+        return None
+
+    def fetch_event(self, slug):
+        data = self._get_json(f"{GAMMA_API}/events", {"slug": slug})
+        if not data:
+            return None
+        event = data[0]
+        markets = event.get("markets") or []
+        if not markets:
+            return None
+        m = markets[0]
+        outcomes = [str(o).upper() for o in _json_list(m.get("outcomes"))]
+        prices = _json_list(m.get("outcomePrices"))
+        tokens = _json_list(m.get("clobTokenIds"))
+        up_i = outcomes.index(OUTCOME_UP) if OUTCOME_UP in outcomes else 0
+        down_i = outcomes.index(OUTCOME_DOWN) if OUTCOME_DOWN in outcomes else 1
+        closed = bool(m.get("closed") or event.get("closed"))
+        outcome = None
+        try:
+            up_p, down_p = float(prices[up_i]), float(prices[down_i])
+            if closed and up_p >= 0.99 and down_p <= 0.01:
+                outcome = OUTCOME_UP
+            elif closed and down_p >= 0.99 and up_p <= 0.01:
+                outcome = OUTCOME_DOWN
+        except (IndexError, TypeError, ValueError):
+            pass
+        return {
+            "up_token": tokens[up_i] if len(tokens) > up_i else None,
+            "down_token": tokens[down_i] if len(tokens) > down_i else None,
+            "condition_id": m.get("conditionId"),
+            "closed": 1 if closed else 0,
+            "outcome": outcome,
+        }
+
+    def fetch_prices(self, start_ts):
+        data = self._get_json(CRYPTO_PRICE_API, {
+            "symbol": "BTC",
+            "eventStartTime": _iso(start_ts),
+            "variant": "fifteen",
+            "endDate": _iso(start_ts + WINDOW_SEC),
+        })
+        if not isinstance(data, dict):
+            return None
+        return {
+            "open_price": float(data["openPrice"]) if data.get("openPrice") else None,
+            "close_price": float(data["closePrice"]) if data.get("closePrice") and data.get("completed") else None,
+        }
+
+    def fetch(self, start_ts):
+        """返回窗口记录, 两个接口都失败时返回 None"""
+        slug = slug_for(start_ts)
+        event = self.fetch_event(slug)
+        prices = self.fetch_prices(start_ts)
+        if event is None and prices is None:
+            return None
+        row = {"start_ts": int(start_ts), "slug": slug, "end_ts": int(start_ts) + WINDOW_SEC,
+               "fetched_at": time.time(), "resolved": 0, "closed": 0}
+        row.update(event or {})
+        row.update(prices or {})
+        if row.get("outcome"):
+            row["resolved"] = 1
+        elif row.get("open_price") and row.get("close_price"):
+            # 官方结算尚未更新时按 收盘价 ≥ 开盘价 推断, resolved 保持 0 以便之后再次确认
+            row["outcome"] = OUTCOME_UP if row["close_price"] >= row["open_price"] else OUTCOME_DOWN
+        return row
+
+
+def backfill(index, fetcher, starts, workers=4, skip_complete=True, progress=None):
+    """并发抓取 starts 中的窗口并写入索引; 返回 (抓取数, 成功数)"""
+    now = time.time()
+    starts = [s for s in starts if s + WINDOW_SEC <= now]
+    if skip_complete:
+        done = index.complete_starts(starts)
+        starts = [s for s in starts if s not in done]
+    if not starts:
+        return 0, 0
+    ok = 0
+    batch = []
+    with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+        futures = [pool.submit(fetcher.fetch, s) for s in starts]
+        for n, fut in enumerate(as_completed(futures), 1):
+            try:
+                row = fut.result()
+            except Exception:
+                row = None
+            if row:
+                batch.append(row)
+                ok += 1
+            if len(batch) >= 100:
+                index.upsert_many(batch)
+                batch = []
+            if progress:
+                progress(n, len(starts), ok)
+    index.upsert_many(batch)
+    return len(starts), ok
+
+
+class MarketIndexUpdater:
+    """实盘后台增量更新: 切换市场或定时唤醒, 补齐最近 lookback 个已结束窗口"""
+    def __init__(self, index, fetcher, lookback=8, interval=60.0):
+        self.index = index
+        self.fetcher = fetcher
+        self.lookback = max(1, int(lookback))
+        self.interval = float(interval)
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+        self.updated = 0
+        self.last_error = ""
+
+    def notify(self):
+        self.wake.set()
+
+    def _loop(self):
+        while self.running:
+            try:
+                end = (int(time.time()) // WINDOW_SEC) * WINDOW_SEC
+                starts = window_starts(end - self.lookback * WINDOW_SEC, end)
+                _, ok = backfill(self.index, self.fetcher, starts, workers=2)
+                self.updated += ok
+            except Exception as e:
+                self.last_error = str(e)
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+
+def _proxies_from_env():
+    proxies = {}
+    if os.getenv("HTTP_PROXY"):
+        proxies["http"] = os.getenv("HTTP_PROXY")
+    if os.getenv("HTTPS_PROXY"):
+        proxies["https"] = os.getenv("HTTPS_PROXY")
+    return proxies
+
+
+def _fmt_ts(ts):
+    return datetime.fromtimestamp(int(ts)).strftime("%Y-%m-%d %H:%M")
+
+
+def main():
+    from dotenv import load_dotenv
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    load_dotenv(os.path.join(base_dir, "config.env"))
+    default_db = os.getenv("MARKET_INDEX_FILE", "") or os.path.join(base_dir, "markets.db")
+
+    parser = argparse.ArgumentParser(description="历史15分钟市场结果索引")
+    parser.add_argument("--db", default=default_db)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_fill = sub.add_parser("backfill", help="回补历史窗口")
+    p_fill.add_argument("--days", type=float, default=7.0, help="回补最近多少天")
+    p_fill.add_argument("--since", default="", help="起始日期 YYYY-MM-DD (UTC), 优先于 --days")
+    p_fill.add_argument("--until", default="", help="结束日期 YYYY-MM-DD (UTC), 默认现在")
+    p_fill.add_argument("--rate", type=float, default=float(os.getenv("MARKET_INDEX_RATE", "5")), help="每秒请求数上限")
+    p_fill.add_argument("--workers", type=int, default=8)
+    p_fill.add_argument("--refetch", action="store_true", help="已完整入库的窗口也重新抓取")
+    p_show = sub.add_parser("show", help="显示最近的窗口")
+    p_show.add_argument("--last", type=int, default=20)
+    sub.add_parser("stats", help="索引概况")
+    args = parser.parse_args()
+
+    index = MarketIndex(args.db)
+    if args.cmd == "backfill":
+        def _date_ts(s):
+            return int(datetime.strptime(s, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+        until = _date_ts(args.until) if args.until else int(time.time())
+        since = _date_ts(args.since) if args.since else int(until - args.days * 86400)
+        fetcher = WindowFetcher(rate=args.rate, proxies=_proxies_from_env())
+        t0 = time.time()
+
+        def _progress(n, total, ok):
+            if n % 20 == 0 or n == total:
+                sys.stdout.write(f"\r进度: {n}/{total}  成功 {ok}  请求 {fetcher.requests}  "
+                                 f"{fetcher.requests / max(time.time() - t0, 1e-9):.1f} 次/秒")
+                sys.stdout.flush()
+
+        total, ok = backfill(index, fetcher, window_starts(since, until), workers=args.workers,
+                             skip_complete=not args.refetch, progress=_progress)
+        print(f"\n回补完成: 抓取 {total} 个窗口, 成功 {ok}, 失败重试 {fetcher.errors} 次")
+        print(json.dumps(index.stats(), ensure_ascii=False))
+    elif args.cmd == "show":
+        rows = index.range()[-args.last:]
+        for r in rows:
+            op = f"{r['open_price']:,.2f}" if r["open_price"] else "-"
+            cp = f"{r['close_price']:,.2f}" if r["close_price"] else "-"
+            mark = "" if r["resolved"] else " (未确认)"
+            print(f"{_fmt_ts(r['start_ts'])}  {r['slug']}  开 {op:>12}  收 {cp:>12}  {r['outcome'] or '-'}{mark}")
+    else:
+        print(json.dumps(index.stats(), ensure_ascii=False, indent=2))
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
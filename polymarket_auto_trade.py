@@ -8,12 +8,30 @@ import os
 import sys
 import time
 import json
+import queue
+import itertools
 import threading
 import requests
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
 from urllib.parse import urlencode
 from dotenv import load_dotenv
-from flask import Flask, Response, jsonify, send_from_directory, stream_with_context
+from flask import Flask, Response, jsonify, request, send_from_directory, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from activity_sync import ActivityLog, ActivitySync
+from chain_reader import ChainReader, RpcPool, redeem_calldata
+from condition_engine import ConditionEngine, load_rules
+from data_cache import TTLCache
+from feed_decode import decode_binance, decode_market, decode_rtds
+from feed_recorder import FeedRecorder, SOURCE_BINANCE, SOURCE_RTDS, SOURCE_MARKET
+from market_index import MarketIndex, MarketIndexUpdater, WindowFetcher
+from fair_value import FairValue, load_surface
+from lead_lag import LeadLagEstimator
+from price_bus import PriceBus
+from records import (Record, Position, PendingOrder, OrderAttempt, TradeEvent, TradeTape, MarketAggregator,
+                     KIND_CODES, json_default, events_from_dicts)
+from tick_store import TickStore, bucket_minmax, pair_mid, SERIES_BTC, SERIES_BINANCE, SERIES_UP_BID, SERIES_UP_ASK, SERIES_DOWN_BID, SERIES_DOWN_ASK
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
@@ -48,7 +66,7 @@ except:
 # ============== 配置 ==============
 GAMMA_API = "https://gamma-api.polymarket.com"
 CRYPTO_PRICE_API = "https://polymarket.com/api/crypto/crypto-price"
-BINANCE_WSS = "wss://stream.binance.com:9443/ws/btcusdt@trade"
+BINANCE_WSS = "wss://stream.binance.com:9443/stream?streams="
 POLYMARKET_WSS = "wss://ws-subscriptions-clob.polymarket.com/ws/market"
 CLOB_API = "https://clob.polymarket.com"
 RTDS_WS = "wss://ws-live-data.polymarket.com"  # Chainlink价格WebSocket
@@ -73,34 +91,19 @@ if HTTPS_PROXY:
 AUTO_TRADE = os.getenv("AUTO_TRADE", "false").lower() == "true"
 TRADE_AMOUNT = float(os.getenv("TRADE_AMOUNT", "5"))
 
-# 条件配置
-# 条件1: 剩余120秒内,价差≥30,UP概率≥95%
-C1_TIME = int(os.getenv("CONDITION_1_TIME", "120"))
-C1_DIFF = float(os.getenv("CONDITION_1_DIFF", "30"))
-C1_MIN_PROB = float(os.getenv("CONDITION_1_MIN_PROB", "0.95"))
-C1_MAX_PROB = float(os.getenv("CONDITION_1_MAX_PROB", "1.0"))
-
-# 条件2: 剩余120秒内,价差≥30,DOWN概率≤5%
-C2_TIME = int(os.getenv("CONDITION_2_TIME", "120"))
-C2_DIFF = float(os.getenv("CONDITION_2_DIFF", "30"))
-C2_MIN_PROB = float(os.getenv("CONDITION_2_MIN_PROB", "0.0"))
-C2_MAX_PROB = float(os.getenv("CONDITION_2_MAX_PROB", "0.05"))
-
-# 条件3: 剩余60秒内,价差≥50,UP概率≥90%
-C3_TIME = int(os.getenv("CONDITION_3_TIME", "60"))
-C3_DIFF = float(os.getenv("CONDITION_3_DIFF", "50"))
-C3_MIN_PROB = float(os.getenv("CONDITION_3_MIN_PROB", "0.90"))
-C3_MAX_PROB = float(os.getenv("CONDITION_3_MAX_PROB", "1.0"))
-
-# 条件4: 剩余60秒内,价差≥50,DOWN概率≤20%
-C4_TIME = int(os.getenv("CONDITION_4_TIME", "60"))
-C4_DIFF = float(os.getenv("CONDITION_4_DIFF", "50"))
-C4_MIN_PROB = float(os.getenv("CONDITION_4_MIN_PROB", "0.0"))
-C4_MAX_PROB = float(os.getenv("CONDITION_4_MAX_PROB", "0.20"))
-
-# 条件5: 剩余40秒内,价差≥60 (激进，无概率限制)
-C5_TIME = int(os.getenv("CONDITION_5_TIME", "40"))
-C5_DIFF = float(os.getenv("CONDITION_5_DIFF", "60"))
+# 条件配置: CONDITIONS_FILE (JSON) 或 CONDITION_N_TIME/DIFF/SIDE/MIN_PROB/MAX_PROB/PRIORITY/MAX_VOL/MIN_VELOCITY/MIN_EDGE
+# 默认5条: 条件1/3 看涨(UP概率区间), 条件2/4 看跌(DOWN概率区间), 条件5 激进(无概率限制)
+CONDITION_ENGINE = ConditionEngine(load_rules(base_dir=BASE_DIR))
+
+# 公允概率曲面 (价差, 剩余时间, 波动) → 模型UP概率, 每tick查表得到 模型-市场 edge
+FAIR_VALUE = FairValue(load_surface(base_dir=BASE_DIR))
+
+# 币安领先 Chainlink: 开启后, 估计置信度足够时条件按预测的 Chainlink 价差求值
+LEAD_LAG_TRIGGER = os.getenv("LEAD_LAG_TRIGGER", "false").lower() == "true"
+LEAD_LAG_MIN_CONFIDENCE = float(os.getenv("LEAD_LAG_MIN_CONFIDENCE", "0.5"))
+
+# 触发窗口起点: 所有条件中最大的剩余时间
+MAX_TRIGGER_TIME = CONDITION_ENGINE.max_time
 
 ORDER_TIMEOUT_SEC = int(os.getenv("ORDER_TIMEOUT_SEC", "8"))  # 下单后8秒未成交则撤单
 SLIPPAGE_THRESHOLD = float(os.getenv("SLIPPAGE_THRESHOLD", "0.05"))  # 滑点阈值5%
@@ -112,9 +115,13 @@ CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL", "2"))
 
 AUTO_REDEEM = os.getenv("AUTO_REDEEM", "true").lower() == "true"
 POLYGON_RPC_URL = os.getenv("POLYGON_RPC_URL", "")
+# POLYGON_RPC_URL 可用逗号分隔多个节点: 后台探测延迟, 读请求发往最快的健康节点, 超过 RPC_HEDGE_MS 未返回时向下一个节点对冲
+RPC_HEDGE_MS = max(50, int(os.getenv("RPC_HEDGE_MS", "400")))
+RPC_PROBE_INTERVAL_SEC = max(3, int(os.getenv("RPC_PROBE_INTERVAL_SEC", "15")))
 REDEEM_SCAN_INTERVAL = max(3, int(os.getenv("REDEEM_SCAN_INTERVAL", "15")))
 REDEEM_RETRY_INTERVAL = max(10, int(os.getenv("REDEEM_RETRY_INTERVAL", "120")))
-REDEEM_MAX_PER_SCAN = max(1, int(os.getenv("REDEEM_MAX_PER_SCAN", "2")))
+# 每次扫描最多领取的条件数; 同一次扫描的领取合并为一笔 Relayer 交易
+REDEEM_MAX_PER_SCAN = max(1, int(os.getenv("REDEEM_MAX_PER_SCAN", "50")))
 REDEEM_PENDING_LOG_INTERVAL = max(10, int(os.getenv("REDEEM_PENDING_LOG_INTERVAL", "30")))
 POLY_BUILDER_API_KEY = os.getenv("POLY_BUILDER_API_KEY", "")
 POLY_BUILDER_SECRET = os.getenv("POLY_BUILDER_SECRET", "")
@@ -122,8 +129,43 @@ POLY_BUILDER_PASSPHRASE = os.getenv("POLY_BUILDER_PASSPHRASE", "")
 RELAYER_URL = os.getenv("RELAYER_URL", "https://relayer-v2.polymarket.com")
 RELAYER_TX_TYPE = os.getenv("RELAYER_TX_TYPE", "SAFE").upper()
 DASHBOARD_ACCOUNT_SYNC_SEC = max(10, int(os.getenv("DASHBOARD_ACCOUNT_SYNC_SEC", "20")))
+# 钱包成交流水本地库 (增量同步), 每页条数与首次同步最多翻页数
+ACTIVITY_LOG_FILE = os.getenv("ACTIVITY_LOG_FILE", "") or os.path.join(BASE_DIR, "activity.db")
+ACTIVITY_PAGE_SIZE = min(1000, max(50, int(os.getenv("ACTIVITY_PAGE_SIZE", "500"))))
+ACTIVITY_MAX_PAGES = max(1, int(os.getenv("ACTIVITY_MAX_PAGES", "10")))
+# 持仓/已平仓/成交流水的共享缓存时长 (自动领取与面板共用), 自己交易或领取后立即作废
+DATA_CACHE_TTL_SEC = max(0.0, float(os.getenv("DATA_CACHE_TTL_SEC", "15")))
 MARKET_FOUND_LOG_INTERVAL = max(10, int(os.getenv("MARKET_FOUND_LOG_INTERVAL", "30")))
 MARKET_META_REFRESH_SEC = max(2, int(os.getenv("MARKET_META_REFRESH_SEC", "5")))
+# CLOB连接保活: 远离触发窗口时低频, 进入窗口前 LEAD 秒内逐步加密到 HOT 间隔
+CLOB_KEEPALIVE_IDLE_SEC = max(5.0, float(os.getenv("CLOB_KEEPALIVE_IDLE_SEC", "25")))
+CLOB_KEEPALIVE_HOT_SEC = max(0.5, float(os.getenv("CLOB_KEEPALIVE_HOT_SEC", "2")))
+CLOB_KEEPALIVE_LEAD_SEC = max(0, int(os.getenv("CLOB_KEEPALIVE_LEAD_SEC", "60")))
+
+# 原始行情录制 (按15分钟市场分文件, gzip压缩)
+FEED_RECORD_ENABLED = os.getenv("FEED_RECORD_ENABLED", "false").lower() == "true"
+FEED_RECORD_DIR = os.getenv("FEED_RECORD_DIR", "") or os.path.join(BASE_DIR, "captures")
+FEED_RECORD_QUEUE_MAX = max(1000, int(os.getenv("FEED_RECORD_QUEUE_MAX", "50000")))
+
+# 币安组合流: 每个交易对订阅 bookTicker + aggTrade, 第一个交易对作为BTC参考价
+BINANCE_SYMBOLS = [x.strip().lower() for x in os.getenv("BINANCE_SYMBOLS", "btcusdt").split(",") if x.strip()] or ["btcusdt"]
+
+# 历史市场结果索引 (SQLite), 实盘运行时增量补齐最近结束的窗口
+MARKET_INDEX_ENABLED = os.getenv("MARKET_INDEX_ENABLED", "false").lower() == "true"
+MARKET_INDEX_FILE = os.getenv("MARKET_INDEX_FILE", "") or os.path.join(BASE_DIR, "markets.db")
+MARKET_INDEX_RATE = max(0.1, float(os.getenv("MARKET_INDEX_RATE", "5")))
+
+# tick环形缓冲: 每个序列保留的条数, 以及预先维护的滚动统计窗口 (秒)
+# 持久化时每个序列映射到 TICK_STORE_DIR 下的定长文件, 重启后直接恢复
+TICK_STORE_CAPACITY = max(1024, int(os.getenv("TICK_STORE_CAPACITY", "131072")))
+TICK_STORE_PERSIST = os.getenv("TICK_STORE_PERSIST", "true").lower() == "true"
+TICK_STORE_DIR = os.getenv("TICK_STORE_DIR", "") or os.path.join(BASE_DIR, "ticks")
+TICK_STATS_WINDOWS = [int(x) for x in os.getenv("TICK_STATS_WINDOWS", "10,30,60").split(",") if x.strip()]
+
+# /api/series 图表: 最多返回的15m窗口数, 每个窗口的最多桶数
+SERIES_MAX_WINDOWS = max(1, int(os.getenv("SERIES_MAX_WINDOWS", "8")))
+SERIES_MAX_WIDTH = max(100, int(os.getenv("SERIES_MAX_WIDTH", "4000")))
+WINDOW_SEC = 900
 
 WEB_ENABLED = os.getenv("WEB_ENABLED", "true").lower() == "true"
 WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
@@ -131,16 +173,29 @@ WEB_PORT = int(os.getenv("WEB_PORT", "5080"))
 
 # 状态文件
 STATE_FILE = os.path.join(BASE_DIR, "state.json")
+# 交易/错误日志文件 (为空则不写), 是否在控制台输出日志
+TRADE_LOG_FILE = "trade.log"
+LOG_ECHO = True
 
-# 全局价格数据
-price_data = {
+# 全局价格数据: 监听线程通过 PRICE_BUS.publish 写入, price_data 为各键最新值 (只读使用);
+# 交易决策用 PRICE_BUS.snapshot() 取同一版本的全部价格
+PRICE_BUS = PriceBus({
     "btc": None,           # Chainlink BTC价格 (交易依据)
-    "binance": None,       # 币安BTC价格 (仅参考)
+    "binance": None,       # 币安BTC价格 (bookTicker 中间价, 无盘口时用最新成交价)
+    "binance_bid": None,
+    "binance_ask": None,
     "ptb": None,           # Price to Beat
     "up_price": None,      # UP token价格
     "down_price": None,    # DOWN token价格
     "last_update": None,
-}
+})
+price_data = PRICE_BUS.values
+
+# 币安各交易对最新行情: symbol → {"bid", "ask", "mid", "trade", "ts"}
+binance_quotes = {}
+
+# 各15m窗口的PTB (窗口起点 → PTB), 供图表计算历史价差
+window_ptbs = {}
 
 dashboard_lock = threading.Lock()
 dashboard_cond = threading.Condition(dashboard_lock)
@@ -150,24 +205,50 @@ dashboard_state = {
     "market": {},
     "wallet_balance": None,
     "prices": {},
-    "position": {},
-    "pending_order": {},
-    "last_order": {},
-    "trade_history": [],
+    "position": None,
+    "pending_order": None,
+    "last_order": None,
+    "trade_history": (),
     "wallet_positions": [],
-    "wallet_history": [],
-    "live_trades": [],
+    "wallet_history": (),
+    "live_trades": (),
     "live_positions_count": 0,
     "live_realized_pnl": 0.0,
     "live_unrealized_pnl": 0.0,
     "live_total_pnl": 0.0,
     "auto_redeem": {},
+    "clob": {},
     "activity": [],
 }
 
+
+
+class _DashboardJSONProvider(DefaultJSONProvider):
+    """面板状态中的记录对象只在输出 JSON 时才转成 dict"""
+    @staticmethod
+    def default(o):
+        if isinstance(o, (Record, TradeTape)):
+            return json_default(o)
+        return DefaultJSONProvider.default(o)
+
+
 app = Flask(__name__, static_folder=STATIC_DIR)
+app.json = _DashboardJSONProvider(app)
+
+feed_recorder = FeedRecorder(FEED_RECORD_DIR, enabled=FEED_RECORD_ENABLED, max_queue=FEED_RECORD_QUEUE_MAX)
+TICK_STATS_WINDOWS = sorted(set(TICK_STATS_WINDOWS + [CONDITION_ENGINE.stats_window]))
+# 先用内存缓冲, main() 中再映射到持久化文件, 避免仅导入模块 (回放/回测) 时就创建文件
+tick_store = TickStore(TICK_STORE_CAPACITY, windows=TICK_STATS_WINDOWS)
+lead_lag = LeadLagEstimator()
 
 _market_found_log_state = {"slug": "", "kind": "", "last_ts": 0.0}
+# 当前钱包的流水同步器、内存中的列式流水 (首次同步时从本地库加载) 与按市场的增量聚合
+_activity = {"user": "", "sync": None, "tape": None, "agg": None}
+DATA_CACHE = TTLCache(DATA_CACHE_TTL_SEC)
+# 长期持有的链上读取客户端 (首次使用时创建)
+_chain = {"reader": None, "error": ""}
+# 最近一次读写的状态文件 (路径, mtime, 大小) 与解析结果; 只有主循环写状态文件
+_state_cache = {"key": None, "state": None}
 _price_refresh_lock = threading.Lock()
 _price_refresh_running = False
 
@@ -194,11 +275,14 @@ def _trigger_price_refresh():
         try:
             chainlink_price = get_chainlink_btc_price()
             if chainlink_price:
-                price_data["btc"] = chainlink_price
+                on_chainlink_price(chainlink_price)
 
-            binance_price = get_binance_btc_price()
+            # 币安流在更新时不再轮询 REST
+            fresh = price_data.get("last_update") and time.time() - price_data["last_update"] < 10
+            binance_price = None if fresh else get_binance_btc_price()
             if binance_price:
-                price_data["binance"] = binance_price
+                PRICE_BUS.publish("binance", binance_price)
+                tick_store.append(SERIES_BINANCE, binance_price)
         finally:
             with _price_refresh_lock:
                 _price_refresh_running = False
@@ -206,6 +290,15 @@ def _trigger_price_refresh():
     threading.Thread(target=worker, daemon=True).start()
 
 
+def on_chainlink_price(price):
+    """Chainlink 更新: 写入价格与tick缓冲, 并用最近的币安tick推进领先-滞后估计"""
+    PRICE_BUS.publish("btc", price)
+    ts = tick_store.clock()
+    tick_store.append(SERIES_BTC, price, ts)
+    b_ts, b_val = tick_store.get(SERIES_BINANCE).since(ts - lead_lag.max_lag - 1.0)
+    lead_lag.on_chainlink(ts, price, b_ts, b_val)
+
+
 def _dashboard_set(**kwargs):
     global dashboard_version
     with dashboard_cond:
@@ -236,7 +329,7 @@ def dashboard_logs():
 @app.route("/api/stream")
 def dashboard_stream():
     def _event(name, payload):
-        return f"event: {name}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        return f"event: {name}\ndata: {json.dumps(payload, ensure_ascii=False, default=json_default)}\n\n"
 
     def generate():
         last_seen = -1
@@ -280,14 +373,63 @@ def dashboard_stream():
 @app.route("/api/history")
 def dashboard_history():
     with dashboard_lock:
-        live_items = list(dashboard_state.get("live_trades") or [])
+        live_items = dashboard_state.get("live_trades") or ()
         if live_items:
             return jsonify({"items": live_items[-300:]})
-        local_items = list(dashboard_state.get("trade_history") or [])
-        wallet_items = list(dashboard_state.get("wallet_history") or [])
+        local_items = tuple(dashboard_state.get("trade_history") or ())
+        wallet_items = tuple(dashboard_state.get("wallet_history") or ())
         return jsonify({"items": (local_items + wallet_items)[-300:]})
 
 
+def _series_columns(t, lo, hi, last):
+    return {"t": [round(float(x), 3) for x in t], "min": lo.tolist(), "max": hi.tolist(), "last": last.tolist()}
+
+
+@app.route("/api/series")
+def dashboard_series():
+    """
+    图表数据: Chainlink / PTB / 价差 / UP / DOWN 在当前及最近 windows 个窗口的历史。
+    服务端按 width 像素做 min/max 分桶; 带上次返回的 since 时只返回其后的桶 (含最后一个未满桶)。
+    """
+    width = min(SERIES_MAX_WIDTH, max(50, int(_to_float(request.args.get("width"), 600))))
+    windows = min(SERIES_MAX_WINDOWS, max(1, int(_to_float(request.args.get("windows"), 1))))
+    since = _maybe_float(request.args.get("since"))
+    now = tick_store.clock()
+    current = int(now // WINDOW_SEC) * WINDOW_SEC
+    start = current - (windows - 1) * WINDOW_SEC
+    end = current + WINDOW_SEC
+    bucket = round((end - start) / width, 3)
+    lower = start
+    if since is not None and since > start:
+        lower = (since // bucket) * bucket
+
+    btc_t, btc_v = tick_store.get(SERIES_BTC).since(lower)
+    ptbs = [(w, window_ptbs.get(w)) for w in range(start, end, WINDOW_SEC)]
+    ptb_v = np.full(len(btc_t), np.nan)
+    win = (btc_t // WINDOW_SEC) * WINDOW_SEC
+    for w, ptb in ptbs:
+        if ptb:
+            ptb_v[win == w] = ptb
+    has_ptb = ~np.isnan(ptb_v)
+
+    series = {
+        "btc": _series_columns(*bucket_minmax(btc_t, btc_v, bucket)),
+        "diff": _series_columns(*bucket_minmax(btc_t[has_ptb], btc_v[has_ptb] - ptb_v[has_ptb], bucket)),
+    }
+    for name, bid, ask in (("up", SERIES_UP_BID, SERIES_UP_ASK), ("down", SERIES_DOWN_BID, SERIES_DOWN_ASK)):
+        t, mid = pair_mid(*tick_store.get(bid).since(lower), *tick_store.get(ask).since(lower))
+        series[name] = _series_columns(*bucket_minmax(t, mid, bucket))
+    return jsonify({
+        "now": now,
+        "start": start,
+        "end": end,
+        "bucket": bucket,
+        "since": lower,
+        "windows": [{"start": w, "slug": f"btc-updown-15m-{w}", "ptb": ptb} for w, ptb in ptbs],
+        "series": series,
+    })
+
+
 def start_web_server():
     if not WEB_ENABLED:
         return
@@ -306,7 +448,8 @@ def log(msg, level="INFO", force=False):
         icon = icons.get(level, "ℹ️")
         ts = datetime.now().strftime("%H:%M:%S")
         log_msg = f"[{ts}] {icon} {msg}"
-        print(log_msg)
+        if LOG_ECHO:
+            print(log_msg)
 
         global dashboard_version
         with dashboard_cond:
@@ -324,9 +467,9 @@ def log(msg, level="INFO", force=False):
             dashboard_cond.notify_all()
         
         # 只写入重要日志到文件: TRADE(交易)和ERR(错误)
-        if level in ["TRADE", "ERR"]:
+        if level in ["TRADE", "ERR"] and TRADE_LOG_FILE:
             try:
-                with open("trade.log", "a", encoding="utf-8") as f:
+                with open(TRADE_LOG_FILE, "a", encoding="utf-8") as f:
                     f.write(log_msg + "\n")
             except:
                 pass
@@ -349,16 +492,11 @@ def get_chainlink_btc_price():
     result = {"price": None}
     
     def on_message(ws, message):
+        feed_recorder.record(SOURCE_RTDS, message)
         try:
-            data = json.loads(message)
-            if data.get("topic") == "crypto_prices" and data.get("payload"):
-                payload = data["payload"]
-                if "data" in payload and payload.get("symbol") == "btc/usd":
-                    prices = payload["data"]
-                    if prices:
-                        result["price"] = prices[-1]["value"]
-                elif "value" in payload:
-                    result["price"] = payload["value"]
+            price = decode_rtds(message)
+            if price is not None:
+                result["price"] = price
             ws.close()
         except:
             pass
@@ -566,27 +704,22 @@ def get_ptb(start_time, end_time):
 
 
 def _normalize_state(state):
+    """状态文件 dict → 记录对象: 持仓/挂单/下单记录为记录或 None, 交易历史为 TradeEvent 元组"""
     if not isinstance(state, dict):
         state = {}
-    if not isinstance(state.get("position"), dict):
-        state["position"] = {}
-    if not isinstance(state.get("pending_order"), dict):
-        state["pending_order"] = {}
-    if not isinstance(state.get("last_order"), dict):
-        state["last_order"] = {}
-    if not isinstance(state.get("trade_history"), list):
-        state["trade_history"] = []
+    state["position"] = Position.from_dict(state.get("position"))
+    state["pending_order"] = PendingOrder.from_dict(state.get("pending_order"))
+    state["last_order"] = OrderAttempt.from_dict(state.get("last_order"))
+    hist = state.get("trade_history")
+    state["trade_history"] = hist if isinstance(hist, tuple) else events_from_dicts(hist)
     return state
 
 
 def _append_trade_history(state, item):
     state = _normalize_state(state)
-    hist = list(state.get("trade_history") or [])
-    hist.append(item)
-    if len(hist) > 300:
-        hist = hist[-300:]
+    hist = (state["trade_history"] + (item,))[-300:]
     state["trade_history"] = hist
-    _dashboard_set(trade_history=list(hist))
+    _dashboard_set(trade_history=hist)
     return state
 
 
@@ -725,152 +858,72 @@ def _resolve_trade_reason(tr):
     return "市场"
 
 
-def _fetch_trade_activity(user, limit=500):
-    if not user:
-        return []
-    lim = min(max(int(limit), 50), 1000)
-    param_sets = [
-        {"user": user, "limit": lim, "offset": 0},
-        {"user": user},
-        {"address": user, "limit": lim, "offset": 0},
-        {"wallet": user, "limit": lim, "offset": 0},
-    ]
-
-    rows = []
-    seen = set()
-    for params in param_sets:
-        data = _data_api_get("/activity", params)
-        if not isinstance(data, list):
-            continue
-        for item in data:
-            if not isinstance(item, dict):
-                continue
-            kind = _trade_event_kind(item)
-            if kind == "IGNORE":
-                continue
-            tid = _text_scalar(item.get("id") or item.get("tradeID") or item.get("transaction_hash") or item.get("transactionHash"))
-            if not tid:
-                tid = f"act-{kind}-{_trade_ts_ms(item)}-{_trade_usdc_size(item):.6f}-{_trade_market_key(item)}"
-            if tid in seen:
-                continue
-            seen.add(tid)
-            norm = dict(item)
-            if norm.get("type") is not None:
-                norm["type"] = str(norm.get("type")).upper()
-            if norm.get("side") is not None:
-                norm["side"] = str(norm.get("side")).upper()
-            norm["id"] = tid
-            rows.append(norm)
-        if rows:
-            break
+def _activity_log():
+    try:
+        return ActivityLog(ACTIVITY_LOG_FILE)
+    except Exception as e:
+        log(f"成交流水库打开失败, 仅保存在内存: {e}", "WARN")
+        return ActivityLog(":memory:")
 
-    rows.sort(key=_trade_ts_ms)
-    return rows
 
+def _sync_trade_activity(user):
+    """增量同步钱包买/卖/领取流水, 返回累计的 TradeTape (无效成交已过滤); 经共享缓存, 同时只同步一次"""
+    if not user:
+        return TradeTape()
+    return DATA_CACHE.get("/activity", user, lambda: _pull_trade_activity(user))
 
-def _build_market_aggregated_trades(raw_trades):
-    groups = {}
-    for tr in sorted((raw_trades or []), key=_trade_ts_ms):
-        if not isinstance(tr, dict):
-            continue
-        kind = _trade_event_kind(tr)
-        if kind == "IGNORE":
-            continue
 
-        price = _maybe_float(tr.get("price"))
-        size = _maybe_float(tr.get("size_matched") or tr.get("size") or tr.get("original_size"))
-        usdc_size = _trade_usdc_size(tr)
-        if kind in ["BUY", "SELL"] and (price is None or size is None or size <= 0):
-            continue
-        if kind == "REDEEM" and usdc_size <= 0:
-            continue
+def _pull_trade_activity(user):
+    if _activity["user"] != user:
+        sync = ActivitySync(user, lambda params: _data_api_get("/activity", params), _normalize_activity,
+                            _activity_log(), page_size=ACTIVITY_PAGE_SIZE, max_pages=ACTIVITY_MAX_PAGES)
+        tape = TradeTape()
+        for row in sync.rows():
+            tape.append(*row)
+        _activity.update(user=user, sync=sync, tape=tape, agg=MarketAggregator())
+    tape = _activity["tape"]
+    for row in _activity["sync"].sync():
+        tape.append(*row)
+    return tape
 
-        key = _trade_market_key(tr)
-        ts = tr.get("matchtime") or tr.get("match_time") or tr.get("timestamp") or tr.get("created_at") or tr.get("time")
-        ts_ms = _trade_ts_ms(tr)
-        g = groups.get(key)
-        if g is None:
-            g = {
-                "id": f"agg-{key}",
-                "direction": _normalize_outcome_label(tr.get("outcome") or tr.get("direction")),
-                "outcomes": set(),
-                "reason": _resolve_trade_reason(tr),
-                "buy_count": 0,
-                "sell_count": 0,
-                "redeem_count": 0,
-                "buy_size": 0.0,
-                "sell_size": 0.0,
-                "buy_notional": 0.0,
-                "sell_notional": 0.0,
-                "redeem_notional": 0.0,
-                "first_ts": ts,
-                "last_ts": ts,
-                "first_ts_ms": ts_ms,
-                "last_ts_ms": ts_ms,
-            }
-            groups[key] = g
-
-        if ts_ms and ts_ms < g["first_ts_ms"]:
-            g["first_ts_ms"] = ts_ms
-            g["first_ts"] = ts
-        if ts_ms and ts_ms >= g["last_ts_ms"]:
-            g["last_ts_ms"] = ts_ms
-            g["last_ts"] = ts
-
-        outcome = _normalize_outcome_label(tr.get("outcome") or tr.get("direction"))
-        if outcome and outcome != "-":
-            g["outcomes"].add(outcome)
-
-        if kind == "BUY":
-            g["buy_count"] += 1
-            g["buy_size"] += float(size)
-            g["buy_notional"] += float(usdc_size)
-        elif kind == "SELL":
-            g["sell_count"] += 1
-            g["sell_size"] += float(size)
-            g["sell_notional"] += float(usdc_size)
-        elif kind == "REDEEM":
-            g["redeem_count"] += 1
-            g["redeem_notional"] += float(usdc_size)
-
-    rows = []
-    for g in groups.values():
-        if (g["buy_count"] + g["sell_count"] + g["redeem_count"]) <= 0:
-            continue
-        buy_avg = (g["buy_notional"] / g["buy_size"]) if g["buy_size"] > 1e-9 else None
-        sell_avg = (g["sell_notional"] / g["sell_size"]) if g["sell_size"] > 1e-9 else None
-        matched_size = min(g["buy_size"], g["sell_size"])
-        pnl = g["sell_notional"] + g["redeem_notional"] - g["buy_notional"]
-
-        if len(g["outcomes"]) == 1:
-            g["direction"] = list(g["outcomes"])[0]
-        elif len(g["outcomes"]) > 1:
-            g["direction"] = "MIX"
-
-        result = "CLOSED" if (g["sell_count"] > 0 or g["redeem_count"] > 0) else "OPEN"
-        rows.append({
-            "id": g["id"],
-            "pair_id": g["id"],
-            "direction": g["direction"],
-            "reason": g["reason"],
-            "buy_count": g["buy_count"],
-            "sell_count": g["sell_count"],
-            "redeem_count": g["redeem_count"],
-            "buy_usdc": g["buy_notional"],
-            "sell_usdc": g["sell_notional"],
-            "redeem_usdc": g["redeem_notional"],
-            "size": matched_size if matched_size > 1e-9 else max(g["buy_size"], g["sell_size"]),
-            "entry_price_quote": buy_avg,
-            "exit_price_quote": sell_avg,
-            "order_time": g["first_ts"],
-            "settle_time": g["last_ts"],
-            "profit": pnl,
-            "result": result,
-            "status": "AGG",
-        })
 
-    rows.sort(key=lambda x: _trade_ts_ms({"timestamp": x.get("settle_time")}) if isinstance(x, dict) else 0)
-    return rows
+def _activity_id(item, kind, ts_ms, usdc_size, size, key):
+    """
+    流水行的去重ID (本地库主键)。/activity 的行通常没有 id, 只有交易哈希;
+    一笔 Relayer 交易可以批量领取多个市场, 一笔撮合也可能有多条成交, 所以用 哈希+类型+市场/token+结果下标+数量 区分同一交易中的各行
+    """
+    tid = _text_scalar(item.get("id") or item.get("tradeID"))
+    if tid:
+        return tid
+    tx = _text_scalar(item.get("transaction_hash") or item.get("transactionHash"))
+    if not tx:
+        return f"act-{kind}-{ts_ms}-{usdc_size:.6f}-{key}"
+    market = _text_scalar(item.get("conditionId") or item.get("condition_id")) or key
+    asset = _text_scalar(item.get("asset") or item.get("asset_id"))
+    outcome_index = _text_scalar(item.get("outcomeIndex"))
+    qty = f"{size:.6f}" if size is not None else f"{usdc_size:.6f}"
+    return f"{tx}-{kind}-{market}-{asset}-{outcome_index}-{qty}"
+
+
+def _normalize_activity(item):
+    """只取聚合用到的字段: (id, kind, ts, ts_ms, price, size, usdc, market, outcome, reason);
+    非买卖领取或数量无效的条目返回 None"""
+    kind = _trade_event_kind(item)
+    if kind not in KIND_CODES:
+        return None
+    ts_ms = _trade_ts_ms(item)
+    usdc_size = _trade_usdc_size(item)
+    key = _trade_market_key(item)
+    price = _maybe_float(item.get("price"))
+    size = _maybe_float(item.get("size_matched") or item.get("size") or item.get("original_size"))
+    if kind in ["BUY", "SELL"] and (price is None or size is None or size <= 0):
+        return None
+    if kind == "REDEEM" and usdc_size <= 0:
+        return None
+    tid = _activity_id(item, kind, ts_ms, usdc_size, size, key)
+    ts = item.get("matchtime") or item.get("match_time") or item.get("timestamp") or item.get("created_at") or item.get("time")
+    outcome = _normalize_outcome_label(item.get("outcome") or item.get("direction"))
+    return (tid, kind, ts, ts_ms, price, size, usdc_size, key, outcome, _resolve_trade_reason(item))
 
 
 def _compute_wallet_realized_pnl(rows):
@@ -898,121 +951,182 @@ def _compute_wallet_unrealized_pnl(rows):
     return float(unrealized)
 
 
-def _fetch_wallet_usdc_balance(user):
-    if not HAS_WEB3:
-        return None
-    rpc_url = (POLYGON_RPC_URL or "").strip()
-    if not rpc_url or not user:
+def _chain_reader():
+    if _chain["reader"] is None and not _chain["error"]:
+        rpc_urls = [u.strip() for u in (POLYGON_RPC_URL or "").split(",") if u.strip()]
+        if not rpc_urls:
+            _chain["error"] = "未配置 POLYGON_RPC_URL"
+            return None
+        try:
+            pool = RpcPool(rpc_urls, hedge_ms=RPC_HEDGE_MS, probe_interval=RPC_PROBE_INTERVAL_SEC).start()
+            _chain["reader"] = ChainReader(pool, usdc=USDC_E_CONTRACT, ctf=CTF_CONTRACT)
+        except Exception as e:
+            _chain["error"] = str(e)
+            log(f"链上读取不可用: {e}", "WARN")
+    return _chain["reader"]
+
+
+def _fetch_wallet_chain_state(user):
+    """(USDC余额, {token_id: 链上持仓份额}); 持仓 token 来自共享缓存的 /positions, 一次 Multicall 读取。失败返回 None"""
+    reader = _chain_reader()
+    if reader is None or not user:
         return None
+    token_ids = [str(row["asset"]) for row in _fetch_wallet_positions(user) if str(row.get("asset") or "").isdigit()]
     try:
-        w3 = Web3(Web3.HTTPProvider(rpc_url, request_kwargs={"timeout": 8}))
-        if not w3.is_connected():
-            return None
-        usdc_addr = Web3.to_checksum_address(USDC_E_CONTRACT)
-        user_addr = Web3.to_checksum_address(user)
-        contract = w3.eth.contract(
-            address=usdc_addr,
-            abi=[
-                {
-                    "name": "balanceOf",
-                    "type": "function",
-                    "stateMutability": "view",
-                    "inputs": [{"name": "account", "type": "address"}],
-                    "outputs": [{"name": "", "type": "uint256"}],
-                },
-                {
-                    "name": "decimals",
-                    "type": "function",
-                    "stateMutability": "view",
-                    "inputs": [],
-                    "outputs": [{"name": "", "type": "uint8"}],
-                },
-            ],
-        )
-        raw = contract.functions.balanceOf(user_addr).call()
-        decimals = contract.functions.decimals().call()
-        return float(raw) / (10 ** int(decimals))
+        return reader.account_state(user, token_ids)
     except Exception:
         return None
 
 
-def _sync_dashboard_account_snapshot(user):
+def _wait_result(fut, default=None):
+    try:
+        return fut.result()
+    except Exception:
+        return default
+
+
+def _sync_dashboard_account_snapshot(user, pool=None):
+    """拉取并发布面板账户快照; 持仓、已平仓、成交流水、链上余额 (USDC 与持仓 token, 一次 Multicall) 在 pool 中并发执行"""
     u = str(user or "").strip().lower()
     if not u:
         return False
-    wallet_positions = _fetch_wallet_positions(u)
-    wallet_closed = _fetch_wallet_closed_positions(u)
+    if pool is None:
+        with ThreadPoolExecutor(max_workers=4) as own:
+            return _sync_dashboard_account_snapshot(u, own)
+    f_positions = pool.submit(_fetch_wallet_positions, u)
+    f_closed = pool.submit(_fetch_wallet_closed_positions, u)
+    f_activity = pool.submit(_sync_trade_activity, u)
+    f_chain = pool.submit(_fetch_wallet_chain_state, u)
+    wallet_positions = _wait_result(f_positions, [])
+    wallet_closed = _wait_result(f_closed, [])
+    activity = _wait_result(f_activity)
+    wallet_balance, chain_sizes = _wait_result(f_chain) or (None, {})
+    if chain_sizes:
+        # 缓存中的行与自动领取共用, 不原地修改
+        wallet_positions = [dict(row, chain_size=chain_sizes[str(row.get("asset"))])
+                            if str(row.get("asset")) in chain_sizes else row for row in wallet_positions]
     wallet_history = _build_wallet_history_items(wallet_closed)
-    raw_activity = _fetch_trade_activity(u, limit=500)
-    agg_trades = _build_market_aggregated_trades(raw_activity)
     realized_pnl = _compute_wallet_realized_pnl(wallet_closed)
     unrealized_pnl = _compute_wallet_unrealized_pnl(wallet_positions)
-    wallet_balance = _fetch_wallet_usdc_balance(u)
-    _dashboard_set(
+    account = dict(
         wallet_balance=wallet_balance,
-        wallet_positions=list(wallet_positions)[:120],
-        wallet_history=list(wallet_history)[:200],
-        live_trades=list(agg_trades)[-300:],
+        wallet_positions=wallet_positions[:120],
+        wallet_history=wallet_history[:200],
         live_positions_count=len(wallet_positions),
         live_realized_pnl=float(realized_pnl),
         live_unrealized_pnl=float(unrealized_pnl),
         live_total_pnl=float(realized_pnl + unrealized_pnl),
     )
+    if activity is not None:
+        # 只把新流水累加到涉及的市场, 排序增量维护; 没有市场变化时面板沿用上次的聚合列表
+        agg = _activity["agg"]
+        fresh = agg.applied == 0
+        if agg.apply_tape(activity) or fresh:
+            account["live_trades"] = tuple(agg.rows(300))
+    _dashboard_set(**account)
     return True
 
 
-def _fetch_wallet_positions(user):
+class AccountSync:
+    """
+    面板账户快照的后台刷新线程
+    request() 只做标记后立即返回, 下单/止损/领取线程不等待网络; 刷新进行中收到的多次请求合并为之后的一次刷新。
+    没有请求时每 interval 秒刷新一次
+    """
+    def __init__(self, interval=DASHBOARD_ACCOUNT_SYNC_SEC):
+        self.interval = float(interval)
+        self.user = ""
+        self.running = False
+        self.thread = None
+        self.pool = None
+        self.requested = 0
+        self.refreshes = 0
+        self.last_sec = None
+        self._wake = threading.Event()
+
+    def request(self, user=None):
+        if user:
+            self.user = str(user).strip().lower()
+        self.requested += 1
+        self._wake.set()
+
+    def _loop(self):
+        while self.running:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self.running:
+                break
+            t0 = time.time()
+            try:
+                _sync_dashboard_account_snapshot(self.user, self.pool)
+            except Exception as e:
+                log(f"账户快照刷新失败: {e}", "WARN")
+            self.refreshes += 1
+            self.last_sec = round(time.time() - t0, 3)
+
+    def stats(self):
+        return {"requested": self.requested, "refreshes": self.refreshes, "last_sec": self.last_sec}
+
+    def start(self, user=None):
+        if user:
+            self.user = str(user).strip().lower()
+        if self.running:
+            return
+        self.running = True
+        self.pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="account")
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        self._wake.set()
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+        if self.pool:
+            self.pool.shutdown(wait=False)
+
+
+ACCOUNT_SYNC = AccountSync()
+
+
+def _data_api_list(path, params):
+    rows = _data_api_get(path, params)
+    return rows if isinstance(rows, list) else None
+
+
+def _fetch_positions_cached(user):
+    """钱包全部持仓 (含可领取), 自动领取与面板共用缓存; 请求失败返回 []"""
     if not user:
         return []
-    try:
-        r = requests.get(
-            f"{DATA_API}/positions",
-            params={"user": user, "sizeThreshold": 0},
-            proxies=PROXIES if PROXIES else None,
-            timeout=12,
-        )
-        if r.status_code == 200:
-            rows = r.json()
-            if isinstance(rows, list):
-                out = []
-                for row in rows:
-                    if not isinstance(row, dict):
-                        continue
-                    size = _to_float(row.get("size"), 0)
-                    if size <= 0:
-                        continue
-                    if _to_bool(row.get("redeemable")) or _to_bool(row.get("mergeable")):
-                        continue
-                    out.append(row)
-                return out
-    except Exception:
-        pass
-    return []
+    rows = DATA_CACHE.get("/positions", user.lower(), lambda: _data_api_list(
+        "/positions", {"user": user, "sizeThreshold": 0}))
+    return rows or []
+
+
+def _fetch_wallet_positions(user):
+    out = []
+    for row in _fetch_positions_cached(user):
+        if not isinstance(row, dict):
+            continue
+        size = _to_float(row.get("size"), 0)
+        if size <= 0:
+            continue
+        if _to_bool(row.get("redeemable")) or _to_bool(row.get("mergeable")):
+            continue
+        out.append(row)
+    return out
 
 
 def _fetch_wallet_closed_positions(user):
     if not user:
         return []
-    try:
-        r = requests.get(
-            f"{DATA_API}/closed-positions",
-            params={
-                "user": user,
-                "limit": 200,
-                "offset": 0,
-                "sortBy": "TIMESTAMP",
-                "sortDirection": "DESC",
-            },
-            proxies=PROXIES if PROXIES else None,
-            timeout=12,
-        )
-        if r.status_code == 200:
-            rows = r.json()
-            if isinstance(rows, list):
-                return rows
-    except Exception:
-        pass
-    return []
+    rows = DATA_CACHE.get("/closed-positions", user.lower(), lambda: _data_api_list("/closed-positions", {
+        "user": user,
+        "limit": 200,
+        "offset": 0,
+        "sortBy": "TIMESTAMP",
+        "sortDirection": "DESC",
+    }))
+    return rows or []
 
 
 def _build_wallet_history_items(rows):
@@ -1021,64 +1135,141 @@ def _build_wallet_history_items(rows):
         if not isinstance(row, dict):
             continue
         side = row.get("outcome") or row.get("side") or row.get("positionSide") or "-"
-        item = {
-            "time": row.get("endDate") or row.get("timestamp") or row.get("updatedAt") or "-",
-            "slug": row.get("slug") or row.get("marketSlug") or row.get("question") or "-",
-            "action": "CLOSE",
-            "side": side,
-            "price": row.get("avgPrice") if row.get("avgPrice") is not None else row.get("avg_price"),
-            "amount": row.get("size"),
-            "order_id": row.get("transactionHash") or row.get("id") or "",
-            "status": "closed",
-            "reason": "wallet_sync",
-            "pnl": row.get("realizedPnl") if row.get("realizedPnl") is not None else row.get("realized_pnl"),
-        }
-        items.append(item)
-    return items[:200]
+        items.append(TradeEvent(
+            time=row.get("endDate") or row.get("timestamp") or row.get("updatedAt") or "-",
+            slug=row.get("slug") or row.get("marketSlug") or row.get("question") or "-",
+            action="CLOSE",
+            side=side,
+            price=row.get("avgPrice") if row.get("avgPrice") is not None else row.get("avg_price"),
+            amount=row.get("size"),
+            order_id=row.get("transactionHash") or row.get("id") or "",
+            status="closed",
+            reason="wallet_sync",
+            pnl=row.get("realizedPnl") if row.get("realizedPnl") is not None else row.get("realized_pnl"),
+        ))
+        if len(items) >= 200:
+            break
+    return tuple(items)
+
+def _state_file_key():
+    try:
+        st = os.stat(STATE_FILE)
+    except OSError:
+        return None
+    return (STATE_FILE, st.st_mtime_ns, st.st_size)
+
 
 def load_state():
-    """加载交易状态"""
-    if not os.path.exists(STATE_FILE):
+    """加载交易状态; 文件未变化时直接复用上次解析的结果 (记录不可变, 浅拷贝即可)"""
+    key = _state_file_key()
+    if key is None:
         return _normalize_state({})
+    if _state_cache["key"] == key:
+        return dict(_state_cache["state"])
     try:
         with open(STATE_FILE, "r", encoding="utf-8") as f:
-            return _normalize_state(json.load(f))
+            state = _normalize_state(json.load(f))
     except:
         return _normalize_state({})
+    _state_cache["key"], _state_cache["state"] = key, dict(state)
+    return state
 
 def save_state(state):
     """保存交易状态"""
     try:
         state = _normalize_state(state)
         # 添加实时价格数据
-        state["ptb"] = price_data.get("ptb")
-        state["chainlink"] = price_data.get("btc")
-        state["binance"] = price_data.get("binance")
-        state["up_price"] = price_data.get("up_price")
-        state["down_price"] = price_data.get("down_price")
+        snap = PRICE_BUS.snapshot()
+        state["ptb"] = snap.get("ptb")
+        state["chainlink"] = snap.get("btc")
+        state["binance"] = snap.get("binance")
+        state["up_price"] = snap.get("up_price")
+        state["down_price"] = snap.get("down_price")
         state["last_update"] = datetime.now().isoformat()
         
         with open(STATE_FILE, "w", encoding="utf-8") as f:
-            json.dump(state, f, indent=2)
+            json.dump(state, f, indent=2, default=json_default)
+        _state_cache["key"], _state_cache["state"] = _state_file_key(), dict(state)
     except Exception as e:
         log(f"保存状态失败: {e}", "ERR")
 
 # ============== WebSocket 价格监听 ==============
+def _binance_stream_key(message):
+    """组合流帧的流名 (如 btcusdt@aggTrade), 只做字符串查找不解析JSON; 单流帧返回空串"""
+    i = message.find('"stream"')
+    if i < 0:
+        return ""
+    i = message.find('"', i + 8) + 1
+    return message[i:message.find('"', i)]
+
+
 class BTCPriceListener:
-    """监听币安BTC价格 (WebSocket)"""
-    def __init__(self):
+    """
+    币安组合流 (各交易对 bookTicker + aggTrade)
+    接收线程只按流名保存最新一帧 (后到的覆盖未处理的旧帧), 合并线程被唤醒后解析每个流的最新帧,
+    行情剧烈时解析次数不随消息数增长, 最新价格的延迟仍是一次唤醒
+    """
+    def __init__(self, symbols=None):
+        self.symbols = list(symbols or BINANCE_SYMBOLS)
+        self.primary = self.symbols[0].upper()
         self.ws = None
         self.running = False
-    
+        self.received = 0
+        self.conflated = 0  # 未解析就被新帧覆盖的帧数
+        self.processed = 0
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._drain_thread = None
+
+    @property
+    def url(self):
+        return BINANCE_WSS + "/".join(f"{s}@{kind}" for s in self.symbols for kind in ("bookTicker", "aggTrade"))
+
     def on_message(self, ws, message):
-        try:
-            data = json.loads(message)
-            if "p" in data:  # 价格字段
-                price_data["btc"] = float(data["p"])
-                price_data["last_update"] = time.time()
-        except:
-            pass
-    
+        feed_recorder.record(SOURCE_BINANCE, message)
+        key = _binance_stream_key(message)
+        with self._lock:
+            if key in self._latest:
+                self.conflated += 1
+            self._latest[key] = message
+            self.received += 1
+        self._wake.set()
+
+    def _drain(self):
+        while self.running:
+            self._wake.wait(1.0)
+            self._wake.clear()
+            with self._lock:
+                batch, self._latest = self._latest, {}
+            for message in batch.values():
+                self.process(message)
+
+    def process(self, message):
+        """解析并应用一帧 (组合流, 或录制文件中的旧单流 trade 帧); 回放直接同步调用"""
+        decoded = decode_binance(message)
+        if decoded is None:
+            return
+        symbol, bid, ask, trade = decoded
+        symbol = (symbol or self.primary).upper()
+        quote = binance_quotes.setdefault(symbol, {})
+        now = time.time()
+        if trade is None:  # bookTicker
+            if not bid or not ask:
+                return
+            quote.update(bid=bid, ask=ask, mid=(bid + ask) / 2, ts=now)
+        else:  # aggTrade / trade
+            quote.update(trade=trade, ts=now)
+        self.processed += 1
+        if symbol != self.primary:
+            return
+        price = quote.get("mid") or quote.get("trade")
+        PRICE_BUS.update(binance=price, binance_bid=quote.get("bid"), binance_ask=quote.get("ask"), last_update=now)
+        tick_store.append(SERIES_BINANCE, price)
+
+    def stats(self):
+        return {"received": self.received, "conflated": self.conflated, "processed": self.processed}
+
     def on_error(self, ws, error):
         pass
     
@@ -1089,12 +1280,15 @@ class BTCPriceListener:
             self.start()
     
     def on_open(self, ws):
-        log("BTC价格WebSocket已连接", "OK")
+        log(f"币安组合流已连接: {', '.join(s.upper() for s in self.symbols)}", "OK")
     
     def start(self):
         self.running = True
+        if not (self._drain_thread and self._drain_thread.is_alive()):
+            self._drain_thread = threading.Thread(target=self._drain, daemon=True)
+            self._drain_thread.start()
         self.ws = websocket.WebSocketApp(
-            BINANCE_WSS,
+            self.url,
             on_open=self.on_open,
             on_message=self.on_message,
             on_error=self.on_error,
@@ -1104,6 +1298,7 @@ class BTCPriceListener:
     
     def stop(self):
         self.running = False
+        self._wake.set()
         if self.ws:
             self.ws.close()
 
@@ -1116,49 +1311,19 @@ class MarketPriceListener:
         self.running = False
     
     def on_message(self, ws, message):
+        feed_recorder.record(SOURCE_MARKET, message)
         try:
-            data = json.loads(message)
-            
-            # 处理列表或字典
-            items = data if isinstance(data, list) else [data]
-            
-            for item in items:
-                if not isinstance(item, dict):
-                    continue
-                
-                event_type = item.get("event_type")
-                asset_id = item.get("asset_id")
-                
-                # 处理订单簿数据
-                if event_type == "book":
-                    bids = item.get("bids") or []
-                    asks = item.get("asks") or []
-                    
-                    if bids and asks:
-                        best_bid = max([float(b["price"]) for b in bids], default=0)
-                        best_ask = min([float(a["price"]) for a in asks], default=0)
-                        mid_price = (best_bid + best_ask) / 2
-                        
-                        if asset_id == self.up_token:
-                            price_data["up_price"] = mid_price
-                        elif asset_id == self.down_token:
-                            price_data["down_price"] = mid_price
-                
-                # 处理价格变化数据
-                elif event_type == "price_change":
-                    price_changes = item.get("price_changes", [])
-                    if price_changes:
-                        pc = price_changes[0]
-                        best_bid = float(pc.get("best_bid", 0))
-                        best_ask = float(pc.get("best_ask", 0))
-                        
-                        if best_bid > 0 and best_ask > 0:
-                            mid_price = (best_bid + best_ask) / 2
-                            
-                            if asset_id == self.up_token:
-                                price_data["up_price"] = mid_price
-                            elif asset_id == self.down_token:
-                                price_data["down_price"] = mid_price
+            # book 与 price_change 都只取买一卖一
+            for asset_id, best_bid, best_ask in decode_market(message):
+                mid_price = (best_bid + best_ask) / 2
+                if asset_id == self.up_token:
+                    PRICE_BUS.publish("up_price", mid_price)
+                    tick_store.append(SERIES_UP_BID, best_bid)
+                    tick_store.append(SERIES_UP_ASK, best_ask)
+                elif asset_id == self.down_token:
+                    PRICE_BUS.publish("down_price", mid_price)
+                    tick_store.append(SERIES_DOWN_BID, best_bid)
+                    tick_store.append(SERIES_DOWN_ASK, best_ask)
         except:
             pass
     
@@ -1201,6 +1366,11 @@ class Trader:
         self.client = None
         self.connected = False
         self.address = None
+        self.remaining = None        # 当前市场剩余秒数, 用于调节保活频率
+        self.conn_state = "disconnected"
+        self.last_activity_ts = 0.0  # 最近一次与CLOB通信的时间
+        self.last_rtt_ms = None      # 最近一次请求往返耗时
+        self.last_order_rtt_ms = None
     
     def connect(self):
         """连接交易客户端"""
@@ -1231,6 +1401,7 @@ class Trader:
                 funder=funder
             )
             self.connected = True
+            self.conn_state = "idle"
             log("交易客户端已连接", "OK")
             return True
         except Exception as e:
@@ -1254,7 +1425,10 @@ class Trader:
             )
             
             signed_order = self.client.create_order(order_args)
+            t0 = time.time()
             resp = self.client.post_order(signed_order)
+            self._touch(t0)
+            self.last_order_rtt_ms = self.last_rtt_ms
             
             if resp and resp.get("orderID"):
                 order_id = resp.get("orderID")
@@ -1273,7 +1447,9 @@ class Trader:
             return None
         
         try:
+            t0 = time.time()
             order = self.client.get_order(order_id)
+            self._touch(t0)
             if order:
                 status = order.get("status", "").upper()
                 original_size = float(order.get("original_size", 0) or 0)
@@ -1296,7 +1472,9 @@ class Trader:
         
         try:
             log(f"撤销订单: {order_id}", "WARN")
+            t0 = time.time()
             resp = self.client.cancel(order_id)
+            self._touch(t0)
             if resp:
                 log("订单已撤销", "OK")
                 return True
@@ -1307,6 +1485,135 @@ class Trader:
             log(f"撤销异常: {e}", "ERR")
             return False
 
+    def _touch(self, t0):
+        now = time.time()
+        self.last_rtt_ms = (now - t0) * 1000.0
+        self.last_activity_ts = now
+        self.conn_state = "warm"
+
+    def ping(self):
+        """轻量请求, 预热与CLOB的HTTP连接"""
+        if not self.connected:
+            return False
+        try:
+            t0 = time.time()
+            self.client.get_ok()
+            self._touch(t0)
+            return True
+        except Exception:
+            self.conn_state = "error"
+            self.last_activity_ts = time.time()
+            return False
+
+    def keepalive_interval(self):
+        """保活间隔: 剩余时间越接近最大触发时间越频繁"""
+        remaining = self.remaining
+        if remaining is None:
+            return CLOB_KEEPALIVE_IDLE_SEC
+        ahead = remaining - MAX_TRIGGER_TIME
+        if ahead <= 0:
+            return CLOB_KEEPALIVE_HOT_SEC
+        if ahead >= CLOB_KEEPALIVE_LEAD_SEC:
+            return CLOB_KEEPALIVE_IDLE_SEC
+        ratio = ahead / float(CLOB_KEEPALIVE_LEAD_SEC)
+        return CLOB_KEEPALIVE_HOT_SEC + (CLOB_KEEPALIVE_IDLE_SEC - CLOB_KEEPALIVE_HOT_SEC) * ratio
+
+    def keepalive_wait(self):
+        """距离下一次保活还需等待的秒数"""
+        return max(0.05, self.last_activity_ts + self.keepalive_interval() - time.time())
+
+    def keepalive(self):
+        if self.connected and time.time() - self.last_activity_ts >= self.keepalive_interval():
+            self.ping()
+
+    def connection_info(self):
+        return {
+            "state": self.conn_state,
+            "last_rtt_ms": self.last_rtt_ms,
+            "last_order_rtt_ms": self.last_order_rtt_ms,
+            "idle_sec": (time.time() - self.last_activity_ts) if self.last_activity_ts else None,
+            "keepalive_sec": self.keepalive_interval(),
+        }
+
+# ============== 下单执行线程 ==============
+# 数值越小越优先: 撤单 > 止损卖出 > 状态查询 > 新开仓
+ORDER_PRIORITY_CANCEL = 0
+ORDER_PRIORITY_EXIT = 1
+ORDER_PRIORITY_STATUS = 2
+ORDER_PRIORITY_ENTRY = 3
+
+
+class OrderExecutor:
+    """独立下单线程: 策略提交交易意图并拿到Future, 不与面板刷新/账户同步等非交易工作排队"""
+    def __init__(self, trader):
+        self.trader = trader
+        self.queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self.running = False
+        self.thread = None
+
+    def submit(self, priority, fn, *args, **kwargs):
+        fut = Future()
+        # 同优先级按提交顺序执行
+        self.queue.put((int(priority), next(self._seq), fut, fn, args, kwargs))
+        return fut
+
+    def place_order(self, token_id, side, price, size, priority=ORDER_PRIORITY_ENTRY):
+        return self.submit(priority, self.trader.place_order, token_id, side, price, size)
+
+    def cancel_order(self, order_id):
+        return self.submit(ORDER_PRIORITY_CANCEL, self.trader.cancel_order, order_id)
+
+    def get_order_status(self, order_id):
+        return self.submit(ORDER_PRIORITY_STATUS, self.trader.get_order_status, order_id)
+
+    def check_and_cancel(self, order_id):
+        """查询订单状态, 未成交则在同一线程内立即撤单; 结果为 (状态, 是否已撤单)"""
+        def run():
+            status = self.trader.get_order_status(order_id)
+            if status and not status.get("filled"):
+                return status, self.trader.cancel_order(order_id)
+            return status, False
+        return self.submit(ORDER_PRIORITY_CANCEL, run)
+
+    def _loop(self):
+        # 线程启动先建立连接, 首单不必承担握手开销; 空闲时按保活间隔发送轻量请求
+        self.trader.ping()
+        while self.running:
+            try:
+                _, _, fut, fn, args, kwargs = self.queue.get(timeout=self.trader.keepalive_wait())
+            except queue.Empty:
+                self.trader.keepalive()
+                continue
+            if fn is None:
+                break
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                fut.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                fut.set_exception(e)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.queue.put((sys.maxsize, next(self._seq), None, None, (), {}))
+
+
+def _future_result(fut, default=None):
+    try:
+        return fut.result(timeout=0)
+    except Exception:
+        return default
+
 class AutoRedeemer:
     def __init__(self, private_key, funder_address):
         self.enabled = bool(AUTO_REDEEM)
@@ -1326,6 +1633,10 @@ class AutoRedeemer:
         self.last_claimable_count = 0
         self.last_result = {}
         self.last_error = ""
+        self.redeem_txs = {}        # conditionId → 预先编码好的 SafeTransaction
+        self.inflight = set()       # 已提交、等待确认的 conditionId
+        self.inflight_lock = threading.Lock()
+        self.confirmer = None       # 确认线程: 等待 Relayer 交易上链, 不阻塞扫描
 
         if not self.enabled:
             _dashboard_set(auto_redeem={"enabled": False, "pending_count": 0, "claimable_count": 0, "last_result": {}, "last_error": ""})
@@ -1376,20 +1687,7 @@ class AutoRedeemer:
         return "0x" + s
 
     def _fetch_positions(self, user):
-        try:
-            r = requests.get(
-                f"{DATA_API}/positions",
-                params={"user": user, "sizeThreshold": 0},
-                proxies=PROXIES if PROXIES else None,
-                timeout=12,
-            )
-            if r.status_code == 200:
-                data = r.json()
-                if isinstance(data, list):
-                    return data
-        except Exception:
-            pass
-        return []
+        return _fetch_positions_cached(user)
 
     def _create_relayer_client(self):
         try:
@@ -1468,84 +1766,133 @@ class AutoRedeemer:
 
         return pending, claimable
 
-    def _redeem_condition(self, condition_id):
-        try:
+    def _redeem_tx(self, condition_id):
+        tx = self.redeem_txs.get(condition_id)
+        if tx is None:
             from py_builder_relayer_client.models import SafeTransaction, OperationType
-
-            ctf_addr = Web3.to_checksum_address(CTF_CONTRACT)
-            usdc_addr = Web3.to_checksum_address(USDC_E_CONTRACT)
-            contract = Web3().eth.contract(
-                address=ctf_addr,
-                abi=[{
-                    "name": "redeemPositions",
-                    "type": "function",
-                    "stateMutability": "nonpayable",
-                    "inputs": [
-                        {"name": "collateralToken", "type": "address"},
-                        {"name": "parentCollectionId", "type": "bytes32"},
-                        {"name": "conditionId", "type": "bytes32"},
-                        {"name": "indexSets", "type": "uint256[]"},
-                    ],
-                    "outputs": [],
-                }],
-            )
-            cond_bytes = bytes.fromhex(condition_id[2:])
-            data = contract.encode_abi(
-                abi_element_identifier="redeemPositions",
-                args=[usdc_addr, b"\x00" * 32, cond_bytes, [1, 2]],
-            )
             op_call = getattr(OperationType, "Call", None)
             if op_call is None:
                 op_call = list(OperationType)[0]
-            tx = SafeTransaction(to=str(ctf_addr), operation=op_call, data=str(data), value="0")
-
-            def execute_once():
-                resp = self.relayer_client.execute([tx], f"Redeem {condition_id}")
-                result = resp.wait()
-                txh = str(getattr(resp, "transaction_hash", "") or "")
-                state = ""
-                if isinstance(result, dict):
-                    txh = str(result.get("transaction_hash") or result.get("transactionHash") or txh)
-                    state = str(result.get("state") or "")
-                else:
-                    txh = str(getattr(result, "transaction_hash", "") or getattr(result, "transactionHash", "") or txh)
-                    state = str(getattr(result, "state", "") or "")
-                if result is None:
-                    return False, txh, "relayer_not_confirmed"
-                if state and state not in ["STATE_CONFIRMED", "STATE_MINED", "STATE_EXECUTED"]:
-                    return False, txh, f"state={state}"
-                return True, txh, ""
-
-            try:
-                return execute_once()
-            except Exception as e:
-                msg = str(e)
-                low = msg.lower()
-                if "expected safe" in low and "not deployed" in low:
-                    dep = self.relayer_client.deploy()
-                    dep.wait()
-                    return execute_once()
-                return False, "", msg
+            tx = SafeTransaction(to=Web3.to_checksum_address(CTF_CONTRACT), operation=op_call,
+                                 data=redeem_calldata(condition_id, USDC_E_CONTRACT), value="0")
+            self.redeem_txs[condition_id] = tx
+        return tx
+
+    def _submit_batch(self, condition_ids):
+        """一笔 Relayer 交易领取多个条件, 返回 Relayer 响应 (确认在 _confirm_batch 中等待)"""
+        txs = [self._redeem_tx(cid) for cid in condition_ids]
+        label = f"Redeem {condition_ids[0]}" if len(condition_ids) == 1 else f"Redeem {len(condition_ids)} conditions"
+        try:
+            return self.relayer_client.execute(txs, label)
         except Exception as e:
-            return False, "", str(e)
-
-    def scan_once(self):
-        if not self.enabled:
+            low = str(e).lower()
+            if "expected safe" in low and "not deployed" in low:
+                dep = self.relayer_client.deploy()
+                dep.wait()
+                return self.relayer_client.execute(txs, label)
+            raise
+
+    def _dispatch(self, condition_ids):
+        """提交一批并交给确认线程; 条件已在 inflight 中"""
+        try:
+            resp = self._submit_batch(condition_ids)
+        except Exception as e:
+            # Relayer 不可用/超时等提交错误与批次内容无关, 整批退避, 不拆分
+            self._batch_done(False, condition_ids, "", str(e))
+            return
+        log(f"已提交自动领取 {len(condition_ids)} 条, 等待确认", "INFO", force=True)
+        self._publish_status()
+        self.confirmer.submit(self._confirm_batch, resp, condition_ids)
+
+    def _batch_done(self, ok, condition_ids, tx_hash, err, reverted=False):
+        """
+        一笔交易整体成功或失败。Relayer 报告交易本身失败 (reverted) 且批次有多个条件时, 拆成两半立即重新提交,
+        直到定位出失败的单个条件, 只有它进入 REDEEM_RETRY_INTERVAL 退避;
+        提交异常、确认超时等与内容无关的失败整批退避
+        """
+        if reverted and len(condition_ids) > 1:
+            log(f"自动领取批次失败 ({len(condition_ids)}条), 拆分重试: {err}", "WARN", force=True)
+            half = len(condition_ids) // 2
+            self._dispatch(condition_ids[:half])
+            self._dispatch(condition_ids[half:])
             return
+        with self.inflight_lock:
+            self.inflight.difference_update(condition_ids)
+            if ok:
+                for cid in condition_ids:
+                    self.redeem_txs.pop(cid, None)
+            else:
+                now = time.time()
+                for cid in condition_ids:
+                    self.last_try_by_condition[cid] = now
+        self._record_result(ok, condition_ids, tx_hash, err)
 
-        pending, claimable = self._collect_redeemable()
-        now = time.time()
-        self.last_pending_count = len(pending)
-        self.last_claimable_count = len(claimable)
+    def _confirm_batch(self, resp, condition_ids):
+        reverted = False
+        try:
+            result = resp.wait()
+            txh = str(getattr(resp, "transaction_hash", "") or "")
+            state = ""
+            if isinstance(result, dict):
+                txh = str(result.get("transaction_hash") or result.get("transactionHash") or txh)
+                state = str(result.get("state") or "")
+            else:
+                txh = str(getattr(result, "transaction_hash", "") or getattr(result, "transactionHash", "") or txh)
+                state = str(getattr(result, "state", "") or "")
+            if result is None:
+                ok, err = False, "relayer_not_confirmed"
+            elif state and state not in ["STATE_CONFIRMED", "STATE_MINED", "STATE_EXECUTED"]:
+                ok, err, reverted = False, f"state={state}", True
+            else:
+                ok, err = True, ""
+        except Exception as e:
+            ok, txh, err = False, str(getattr(resp, "transaction_hash", "") or ""), str(e)
+        self._batch_done(ok, condition_ids, txh, err, reverted)
+
+    def _record_result(self, ok, condition_ids, tx_hash, err):
+        cids = ", ".join(condition_ids[:3]) + (f" 等{len(condition_ids)}条" if len(condition_ids) > 3 else "")
+        if ok:
+            log(f"代理钱包自动领取成功: {cids} | tx {tx_hash}", "TRADE", force=True)
+            self.last_error = ""
+        else:
+            log(f"代理钱包自动领取失败: {cids} | {err}", "ERR", force=True)
+            self.last_error = str(err)
+        self.last_result = {
+            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "ok": ok,
+            "condition_id": cids,
+            "count": len(condition_ids),
+            "tx": tx_hash,
+            "message": "ok" if ok else str(err),
+        }
+        self._publish_status()
+        if ok:
+            DATA_CACHE.invalidate()
+            ACCOUNT_SYNC.request(self.funder_address)
+
+    def _publish_status(self):
+        with self.inflight_lock:
+            inflight = len(self.inflight)
         _dashboard_set(auto_redeem={
             "enabled": self.enabled,
             "pending_count": self.last_pending_count,
             "claimable_count": self.last_claimable_count,
+            "inflight_count": inflight,
             "last_result": dict(self.last_result or {}),
             "last_error": self.last_error,
             "scan_interval": REDEEM_SCAN_INTERVAL,
         })
 
+    def scan_once(self):
+        if not self.enabled:
+            return
+
+        pending, claimable = self._collect_redeemable()
+        now = time.time()
+        self.last_pending_count = len(pending)
+        self.last_claimable_count = len(claimable)
+        self._publish_status()
+
         if pending:
             signature = "|".join([f"{x['owner']}:{x['condition_id']}" for x in pending])
             if signature != self.last_pending_signature or (now - self.last_pending_log_ts) >= REDEEM_PENDING_LOG_INTERVAL:
@@ -1560,48 +1907,23 @@ class AutoRedeemer:
         if not claimable:
             return
 
-        processed = 0
-        for cid in claimable:
-            t0 = self.last_try_by_condition.get(cid, 0)
-            if now - t0 < REDEEM_RETRY_INTERVAL:
-                continue
-            self.last_try_by_condition[cid] = now
-
-            ok, tx_hash, err = self._redeem_condition(cid)
-            if ok:
-                log(f"代理钱包自动领取成功: {cid} | tx {tx_hash}", "TRADE", force=True)
-                self.last_error = ""
-                self.last_result = {
-                    "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "ok": True,
-                    "condition_id": cid,
-                    "tx": tx_hash,
-                    "message": "ok",
-                }
-            else:
-                log(f"代理钱包自动领取失败: {cid} | {err}", "ERR", force=True)
-                self.last_error = str(err)
-                self.last_result = {
-                    "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "ok": False,
-                    "condition_id": cid,
-                    "tx": tx_hash,
-                    "message": str(err),
-                }
-
-            _dashboard_set(auto_redeem={
-                "enabled": self.enabled,
-                "pending_count": self.last_pending_count,
-                "claimable_count": self.last_claimable_count,
-                "last_result": dict(self.last_result or {}),
-                "last_error": self.last_error,
-                "scan_interval": REDEEM_SCAN_INTERVAL,
-            })
-            _sync_dashboard_account_snapshot(self.funder_address)
-
-            processed += 1
-            if processed >= REDEEM_MAX_PER_SCAN:
-                break
+        # 跳过等待确认和重试间隔内的条件, 其余合并为一笔交易提交; 确认交给确认线程, 扫描线程不等待上链
+        batch = []
+        with self.inflight_lock:
+            # 已不可领取 (已领取或不再出现) 的条件不再保留预编码交易
+            for cid in [c for c in self.redeem_txs if c not in claimable and c not in self.inflight]:
+                del self.redeem_txs[cid]
+            for cid in claimable:
+                if cid in self.inflight or now - self.last_try_by_condition.get(cid, 0) < REDEEM_RETRY_INTERVAL:
+                    continue
+                batch.append(cid)
+                if len(batch) >= REDEEM_MAX_PER_SCAN:
+                    break
+            for cid in batch:
+                self.last_try_by_condition[cid] = now
+                self.inflight.add(cid)
+        if batch:
+            self._dispatch(batch)
 
     def _loop(self):
         while self.running:
@@ -1620,23 +1942,413 @@ class AutoRedeemer:
         if self.running:
             return
         self.running = True
+        self.confirmer = ThreadPoolExecutor(max_workers=4, thread_name_prefix="redeem")
         self.thread = threading.Thread(target=self._loop, daemon=True)
         self.thread.start()
         log(f"代理钱包自动领取已开启: 每{REDEEM_SCAN_INTERVAL}s扫描", "OK", force=True)
-        _dashboard_set(auto_redeem={
-            "enabled": self.enabled,
-            "pending_count": self.last_pending_count,
-            "claimable_count": self.last_claimable_count,
-            "last_result": dict(self.last_result or {}),
-            "last_error": self.last_error,
-            "scan_interval": REDEEM_SCAN_INTERVAL,
-        })
+        self._publish_status()
 
     def stop(self):
         self.running = False
+        if self.confirmer:
+            self.confirmer.shutdown(wait=False)
 
 # ============== 主循环 ==============
+class TradingSession:
+    """
+    每个tick的交易决策: 读取价格 → 条件求值 → 下单/撤单/止损
+    主循环与回放共用; 时钟、Trader 和下单执行器均可替换
+    """
+    def __init__(self, trader, executor, dashboard_user="", clock=time.time, console=True):
+        self.trader = trader
+        self.executor = executor
+        self.dashboard_user = dashboard_user
+        self.clock = clock
+        self.console = console
+        self.inflight = {}  # 已提交给下单线程、尚未处理结果的交易意图
+        self.first_display = True
+        self.slug = ""      # 当前tick所在市场
+
+    def now_dt(self):
+        return datetime.fromtimestamp(self.clock())
+
+    def on_new_window(self):
+        """市场切换: 清除上一市场的持仓/下单记录/挂单和PTB缓存"""
+        state = load_state()
+        state.pop("position", None)
+        state.pop("last_order", None)
+        # 上一市场的挂单已无法管理, 不能阻塞新市场开仓 (成交的份额由自动领取结算)
+        stale = state.pop("pending_order", None)
+        if stale:
+            log(f"市场切换, 放弃跟踪上一市场挂单 (订单ID: {stale.order_id})", "WARN")
+        save_state(state)
+        
+        # 清空PTB缓存
+        PRICE_BUS.publish("ptb", None)
+        
+        # 标记需要重新显示
+        self.first_display = True
+
+    def apply_order_results(self):
+        """在主循环线程中处理下单线程已完成的交易意图 (状态文件只由主循环读写)"""
+        ctx = self.inflight.get("entry")
+        if ctx and ctx["future"].done():
+            self.inflight.pop("entry", None)
+            order_id = _future_result(ctx["future"])
+            state = load_state()
+            side, price, slug = ctx["side"], ctx["price"], ctx["slug"]
+            if order_id and slug != self.slug:
+                # 下单期间市场已切换, 只记录历史, 不再跟踪该挂单
+                log(f"订单在市场切换后才返回, 不再跟踪 (订单ID: {order_id})", "WARN")
+                status = "submitted"
+            elif order_id:
+                # 记录pending订单,开始监控
+                state["pending_order"] = PendingOrder(
+                    order_id=order_id,
+                    time=ctx["time"],
+                    slug=slug,
+                    side=side,
+                    price=price,
+                )
+                # 记录尝试次数
+                state["last_order"] = OrderAttempt(
+                    key=ctx["order_key"],
+                    time=ctx["time"],
+                    retry_count=ctx["retry_count"] + 1,
+                )
+                status = "submitted"
+            else:
+                # 下单失败,记录避免重复尝试
+                log(f"下单失败: {side} @ {price*100:.1f}%", "ERR")
+                state["last_order"] = OrderAttempt(key=ctx["order_key"], time=ctx["time"])
+                status = "failed"
+            state = _append_trade_history(state, TradeEvent(
+                time=self.now_dt().strftime("%Y-%m-%d %H:%M:%S"),
+                slug=slug,
+                action="BUY",
+                side=side,
+                price=price,
+                amount=TRADE_AMOUNT,
+                order_id=order_id or "",
+                status=status,
+                reason=ctx["condition"],
+                diff=ctx["diff"],
+            ))
+            save_state(state)
+            _dashboard_set(
+                pending_order=state["pending_order"],
+                last_order=state["last_order"],
+            )
+            DATA_CACHE.invalidate(self.dashboard_user)
+            ACCOUNT_SYNC.request(self.dashboard_user)
+            if order_id and slug == self.slug:
+                log(f"订单已提交,开始监控 (订单ID: {order_id})", "TRADE")
+
+        ctx = self.inflight.get("check")
+        if ctx and ctx["future"].done():
+            self.inflight.pop("check", None)
+            order_status, _ = _future_result(ctx["future"], (None, False))
+            order_id = ctx["order_id"]
+            pending_order = ctx["pending"]
+            state = load_state()
+            if getattr(state["pending_order"], "order_id", None) != order_id:
+                order_status = None
+            if order_status and not order_status.get("filled"):
+                # 订单未成交,已撤销
+                log(f"订单超时未成交,已撤销 (订单ID: {order_id})", "TRADE")
+                state.pop("pending_order", None)
+                save_state(state)
+                _dashboard_set(
+                    position=state["position"],
+                    pending_order=None,
+                    last_order=state["last_order"],
+                )
+            elif order_status and order_status.get("filled"):
+                # 订单已成交
+                filled_side = pending_order.side or ctx["side"]
+                filled_price = float(pending_order.price or ctx["price"] or 0)
+                filled_slug = pending_order.slug or ctx["slug"]
+                log(f"订单已成交! {filled_side} @ {filled_price*100:.2f}% (市场: {filled_slug})", "TRADE")
+                state.pop("pending_order", None)
+                state["position"] = Position(
+                    slug=filled_slug,
+                    side=filled_side,
+                    entry_price=filled_price,
+                    entry_diff=ctx["diff_abs"],
+                )
+                state = _append_trade_history(state, TradeEvent(
+                    time=self.now_dt().strftime("%Y-%m-%d %H:%M:%S"),
+                    slug=filled_slug,
+                    action="BUY",
+                    side=filled_side,
+                    price=filled_price,
+                    amount=TRADE_AMOUNT,
+                    order_id=order_id,
+                    status="filled",
+                    reason="pending_filled",
+                    diff=ctx["diff"],
+                ))
+                save_state(state)
+                _dashboard_set(
+                    position=state["position"],
+                    pending_order=None,
+                    last_order=state["last_order"],
+                )
+                DATA_CACHE.invalidate(self.dashboard_user)
+                ACCOUNT_SYNC.request(self.dashboard_user)
+
+        ctx = self.inflight.get("exit")
+        if ctx and ctx["future"].done():
+            self.inflight.pop("exit", None)
+            sell_order_id = _future_result(ctx["future"])
+            state = load_state()
+            state = _append_trade_history(state, TradeEvent(
+                time=self.now_dt().strftime("%Y-%m-%d %H:%M:%S"),
+                slug=ctx["slug"],
+                action="SELL",
+                side=ctx["side"],
+                price=ctx["price"],
+                amount=TRADE_AMOUNT,
+                order_id=sell_order_id or "",
+                status="submitted" if sell_order_id else "failed",
+                reason="stop_loss",
+                diff=ctx["diff"],
+            ))
+            save_state(state)
+            DATA_CACHE.invalidate(self.dashboard_user)
+            ACCOUNT_SYNC.request(self.dashboard_user)
+            log(f"止损卖出完成: {ctx['side']} @ {ctx['price']*100:.2f}%", "TRADE")
+
+    def render_console(self, slug, remaining, btc, ptb, up_price, down_price, diff, binance):
+        # 首次显示完整界面
+        if self.first_display:
+            print("\n" + "="*90)
+            print(f"📊 市场: {slug}")
+            print(f"⏱️  剩余时间: {remaining//60}分{remaining%60}秒")
+            print()
+            print("┌────────────────────────┬────────────────────────┬────────────────────────┐")
+            print("│ 标定价 (PTB)           │ Chainlink 现价 (依据)  │ 币安现价 (参考)        │")
+            ptb_display = f"${ptb:,.2f}" if ptb > 0 else "获取中..."
+            btc_display = f"${btc:,.2f}" if btc > 0 else "获取中..."
+            binance_display = f"${binance:,.2f}" if binance > 0 else "获取中..."
+            print(f"│ {ptb_display:22s} │ {btc_display:22s} │ {binance_display:22s} │")
+            print("├────────────────────────┴────────────────────────┴────────────────────────┤")
+            print("│ 市场现价                                                                 │")
+            print(f"│ UP: {up_price*100:.2f}%  DOWN: {down_price*100:.2f}%                                                │")
+            print("├──────────────────────────────────────────────────────────────────────────┤")
+            print("│ 实时价差 (Chainlink - PTB)                                               │")
+            if btc > 0 and ptb > 0:
+                diff_display = f"{diff:+.0f} USD"
+            else:
+                diff_display = "等待价格数据..."
+            print(f"│ {diff_display:72s} │")
+            print("└──────────────────────────────────────────────────────────────────────────┘")
+            print()
+            print("="*90)
+            print("实时日志:")
+            print("="*90)
+            self.first_display = False
+        
+        # 后续只更新状态行
+        ptb_str = f"${ptb:,.0f}" if ptb > 0 else "获取中"
+        btc_str = f"${btc:,.0f}" if btc > 0 else "获取中"
+        binance_str = f"${binance:,.0f}" if binance > 0 else "N/A"
+        diff_str = f"{diff:+.0f}" if (btc > 0 and ptb > 0) else "N/A"
+        status = f"[{self.now_dt().strftime('%H:%M:%S')}] 剩余:{remaining//60:02d}分{remaining%60:02d}秒 | Chainlink:{btc_str} | 币安:{binance_str} | PTB:{ptb_str} | 价差:{diff_str} | UP:{up_price*100:.1f}% DOWN:{down_price*100:.1f}%"
+        print(f"\r{status}" + " "*10, end="", flush=True)
+
+    def on_tick(self, market):
+        slug = market["slug"]
+        remaining = market["remaining"]
+        self.trader.remaining = remaining
+        self.slug = slug
+        
+        # 处理下单线程已完成的交易意图
+        self.apply_order_results()
+        
+        # 从WebSocket获取的实时数据: 本tick所有决策都用同一个快照, 不会混用不同时刻的价格
+        snap = PRICE_BUS.snapshot()
+        btc = snap["btc"] or 0  # 如果Chainlink获取失败,使用0
+        ptb = snap["ptb"] or 0
+        up_price = snap["up_price"] or market["up_price"]
+        down_price = snap["down_price"] or market["down_price"]
+        binance = snap["binance"]
+        
+        # 计算价差
+        diff = btc - ptb if (btc > 0 and ptb > 0) else 0
+        diff_abs = abs(diff)
+        # Chainlink 滚动统计 (PTB 窗口内不变, 速度即价差变化速度)
+        btc_stats = tick_store.stats(SERIES_BTC, CONDITION_ENGINE.stats_window)
+        # 币安领先估计: 开启且置信度足够时, 条件按预测的下一个 Chainlink 价差求值
+        lead = lead_lag.snapshot(binance)
+        use_prediction = (LEAD_LAG_TRIGGER and btc > 0 and ptb > 0 and lead["predicted"] is not None
+                          and lead["confidence"] >= LEAD_LAG_MIN_CONFIDENCE)
+        signal_diff = lead["predicted"] - ptb if use_prediction else diff
+        fair = FAIR_VALUE.evaluate(signal_diff, remaining, up_price, down_price, btc_stats) if (btc > 0 and ptb > 0) else None
+        fair_up = fair["fair_up"] if fair else None
+        _dashboard_set(
+            market={
+                "slug": slug,
+                "remaining": remaining,
+                "remaining_text": f"{remaining//60}分{remaining%60}秒",
+                "start": market.get("start"),
+                "end": market.get("end"),
+                "status": "active",
+            },
+            prices={
+                "ptb": ptb if ptb > 0 else None,
+                "chainlink_btc": btc if btc > 0 else None,
+                "binance_btc": binance or None,
+                "up_price": up_price,
+                "down_price": down_price,
+                "diff": diff if (btc > 0 and ptb > 0) else None,
+                "diff_abs": diff_abs if (btc > 0 and ptb > 0) else None,
+                "volatility": btc_stats["vol"] if btc_stats else None,
+                "velocity": btc_stats["velocity"] if btc_stats else None,
+                "stats_window": CONDITION_ENGINE.stats_window,
+                "fair_up": fair_up,
+                "edge_up": fair["edge_up"] if fair else None,
+                "edge_down": fair["edge_down"] if fair else None,
+                "sigma": fair["sigma"] if fair else None,
+                "lead_lag": lead,
+                "predicted_diff": lead["predicted"] - ptb if (lead["predicted"] is not None and ptb > 0) else None,
+                "use_prediction": use_prediction,
+                "updated_ts": self.clock(),
+            },
+            clob=self.trader.connection_info(),
+        )
+
+        state_snapshot = load_state()
+        _dashboard_set(
+            position=state_snapshot["position"],
+            pending_order=state_snapshot["pending_order"],
+            last_order=state_snapshot["last_order"],
+            trade_history=state_snapshot["trade_history"],
+        )
+        
+        if self.console:
+            self.render_console(slug, remaining, btc, ptb, up_price, down_price, diff, binance or 0)
+        
+        # 检查触发条件
+        triggered = False
+        condition = None
+        side = None
+        desired_side = None
+        price = None
+        token = None
+        
+        # 按优先级找到第一条 时间+价差 满足的规则, 由其概率区间决定触发或跳过
+        decision = CONDITION_ENGINE.evaluate(remaining, signal_diff, up_price, down_price, btc_stats, fair_up)
+        if decision:
+            rule = decision["rule"]
+            if decision["triggered"]:
+                triggered = True
+                desired_side = decision["side"]
+                condition = rule.label(decision["side"], decision["prob"])
+                if use_prediction:
+                    condition += f" [预测价差{signal_diff:+.0f}, 领先{lead['lag_ms']:.0f}ms]"
+            elif decision["reason"] == "stats":
+                log(rule.stats_message(decision["side"], btc_stats), "INFO")
+            elif decision["reason"] == "edge":
+                log(rule.edge_message(decision["side"], decision["prob"], fair_up), "INFO")
+            else:
+                log(rule.skip_message(decision["side"], decision["prob"]), "INFO")
+        
+        if triggered:
+            side = desired_side or ("UP" if signal_diff > 0 else "DOWN")
+            price = up_price if side == "UP" else down_price
+            token = market["up_token"] if side == "UP" else market["down_token"]
+            
+            # 检查是否已下单
+            state = load_state()
+            last_order = state["last_order"] or OrderAttempt()
+            order_key = f"{slug}|{side}"
+            
+            # 检查是否有未完成的订单需要监控
+            pending_order = state["pending_order"]
+            if pending_order and self.trader.connected and "check" not in self.inflight:
+                order_id = pending_order.order_id
+                order_time = pending_order.time
+                
+                # 检查订单是否超时, 超时则交给下单线程查询状态并撤单
+                if order_time:
+                    elapsed = (self.now_dt() - datetime.fromisoformat(order_time)).total_seconds()
+                    if elapsed > ORDER_TIMEOUT_SEC:
+                        self.inflight["check"] = {
+                            "future": self.executor.check_and_cancel(order_id),
+                            "order_id": order_id,
+                            "pending": pending_order,
+                            "side": side,
+                            "price": price,
+                            "slug": slug,
+                            "diff": diff,
+                            "diff_abs": diff_abs,
+                        }
+            
+            # 如果没有pending订单且未记录过此订单,则下单
+            has_position = state["position"] is not None
+            if not pending_order and "entry" not in self.inflight and (not has_position) and last_order.key != order_key:
+                # 检查滑点：当前价格与下单价格差异
+                current_price = up_price if side == "UP" else down_price
+                if price > 0:
+                    slippage = abs(current_price - price) / price
+                    if slippage > SLIPPAGE_THRESHOLD:
+                        log(f"滑点过大: {slippage*100:.1f}% > {SLIPPAGE_THRESHOLD*100:.0f}%, 取消下单", "WARN")
+                        triggered = False
+                        condition = None
+                
+                # 检查尝试次数：同一市场避免多次追单
+                if triggered:
+                    retry_count = last_order.retry_count or 0
+                    if retry_count >= MAX_RETRY_PER_MARKET:
+                        log(f"尝试次数已达上限({MAX_RETRY_PER_MARKET}次), 跳过 {order_key}", "WARN")
+                        triggered = False
+                        condition = None
+                
+                if triggered:
+                    log(f"触发条件: {condition} → {side} @ {price*100:.1f}%", "TRADE")
+                    if AUTO_TRADE and self.trader.connected:
+                        self.inflight["entry"] = {
+                            "future": self.executor.place_order(token, "BUY", price, TRADE_AMOUNT),
+                            "time": self.now_dt().isoformat(),
+                            "slug": slug,
+                            "side": side,
+                            "price": price,
+                            "order_key": order_key,
+                            "retry_count": last_order.retry_count or 0,
+                            "condition": condition,
+                            "diff": diff,
+                        }
+                    else:
+                        log(f"提醒模式: 建议买入 {side} @ {price*100:.1f}%", "TRADE")
+                        state["last_order"] = OrderAttempt(key=order_key, time=self.now_dt().isoformat())
+                        save_state(state)
+                        _dashboard_set(last_order=state["last_order"])
+        
+        # 止损检查
+        state = load_state()
+        pos = state["position"]
+        if pos and pos.slug == slug and "exit" not in self.inflight:
+            if diff_abs < STOP_LOSS_DIFF:
+                log(f"止损触发! 价差${diff_abs:.0f} < ${STOP_LOSS_DIFF}", "TRADE")
+                
+                if AUTO_TRADE and self.trader.connected:
+                    pos_side = pos.side
+                    sell_price = up_price if pos_side == "UP" else down_price
+                    sell_token = market["up_token"] if pos_side == "UP" else market["down_token"]
+                    self.inflight["exit"] = {
+                        "future": self.executor.place_order(sell_token, "SELL", sell_price, TRADE_AMOUNT, priority=ORDER_PRIORITY_EXIT),
+                        "slug": slug,
+                        "side": pos_side,
+                        "price": sell_price,
+                        "diff": diff,
+                    }
+                    state.pop("position", None)
+                    save_state(state)
+                    _dashboard_set(position=None)
+
 def main():
+    global tick_store
     start_web_server()
     if WEB_ENABLED:
         log(f"前端面板已启动: http://{WEB_HOST}:{WEB_PORT}", "OK", force=True)
@@ -1647,11 +2359,8 @@ def main():
     print(f"  自动下单: {'开启' if AUTO_TRADE else '关闭'}")
     print(f"  自动领取: {'开启' if AUTO_REDEEM else '关闭'}")
     print(f"  下单金额: ${TRADE_AMOUNT}")
-    print(f"  条件1: 剩余≤{C1_TIME}秒 且 价差≥${C1_DIFF} (UP概率{C1_MIN_PROB*100:.0f}-{C1_MAX_PROB*100:.0f}%)")
-    print(f"  条件2: 剩余≤{C2_TIME}秒 且 价差≥${C2_DIFF} (DOWN概率{C2_MIN_PROB*100:.0f}-{C2_MAX_PROB*100:.0f}%)")
-    print(f"  条件3: 剩余≤{C3_TIME}秒 且 价差≥${C3_DIFF} (UP概率{C3_MIN_PROB*100:.0f}-{C3_MAX_PROB*100:.0f}%)")
-    print(f"  条件4: 剩余≤{C4_TIME}秒 且 价差≥${C4_DIFF} (DOWN概率{C4_MIN_PROB*100:.0f}-{C4_MAX_PROB*100:.0f}%)")
-    print(f"  条件5: 剩余≤{C5_TIME}秒 且 价差≥${C5_DIFF} (激进)")
+    for rule in CONDITION_ENGINE.rules:
+        print(f"  {rule.summary()}")
     print(f"  撤单超时: {ORDER_TIMEOUT_SEC}秒")
     print(f"  滑点阈值: {SLIPPAGE_THRESHOLD*100:.0f}%")
     print(f"  每市场最多尝试: {MAX_RETRY_PER_MARKET}次")
@@ -1659,23 +2368,45 @@ def main():
     print("="*60 + "\n")
     
     trader = Trader()
+    executor = OrderExecutor(trader)
     redeemer = AutoRedeemer(os.getenv("PRIVATE_KEY"), os.getenv("FUNDER_ADDRESS"))
     if AUTO_TRADE:
         if not trader.connect():
             log("无法连接交易客户端,退出", "ERR", force=True)
             return
+        executor.start()
     redeemer.start()
+    feed_recorder.start()
+    if feed_recorder.enabled:
+        log(f"行情录制已开启: {FEED_RECORD_DIR}", "OK", force=True)
+    if TICK_STORE_PERSIST:
+        try:
+            tick_store = TickStore(TICK_STORE_CAPACITY, windows=TICK_STATS_WINDOWS, directory=TICK_STORE_DIR)
+            recovered = {k: v for k, v in tick_store.recovered().items() if v}
+            if recovered:
+                log(f"已从 {TICK_STORE_DIR} 恢复tick: {recovered}", "OK", force=True)
+        except Exception as e:
+            log(f"tick文件映射失败, 改用内存缓冲: {e}", "ERR", force=True)
+    index_updater = None
+    if MARKET_INDEX_ENABLED:
+        try:
+            index_updater = MarketIndexUpdater(MarketIndex(MARKET_INDEX_FILE),
+                                               WindowFetcher(rate=MARKET_INDEX_RATE, proxies=PROXIES))
+            index_updater.start()
+            log(f"市场结果索引已开启: {MARKET_INDEX_FILE}", "OK", force=True)
+        except Exception as e:
+            log(f"市场结果索引初始化失败: {e}", "ERR", force=True)
 
     init_state = load_state()
     _dashboard_set(
-        position=dict(init_state.get("position") or {}),
-        pending_order=dict(init_state.get("pending_order") or {}),
-        last_order=dict(init_state.get("last_order") or {}),
-        trade_history=list(init_state.get("trade_history") or []),
+        position=init_state["position"],
+        pending_order=init_state["pending_order"],
+        last_order=init_state["last_order"],
+        trade_history=init_state["trade_history"],
         wallet_balance=None,
         wallet_positions=[],
-        wallet_history=[],
-        live_trades=[],
+        wallet_history=(),
+        live_trades=(),
         live_positions_count=0,
         live_realized_pnl=0.0,
         live_unrealized_pnl=0.0,
@@ -1683,12 +2414,13 @@ def main():
     )
     
     log("启动价格监听...", "INFO", force=True)
+    # 币安成交流: 参考价格, 并作为领先-滞后估计的输入
+    binance_listener = BTCPriceListener()
+    binance_listener.start()
     
     last_slug = None
     market_listener = None
-    first_display = True
     last_chainlink_update = 0
-    last_account_sync = 0.0
     last_market_fetch = 0.0
     market_data_cache = None
     dashboard_user = (os.getenv("FUNDER_ADDRESS", "") or "").strip().lower()
@@ -1696,6 +2428,9 @@ def main():
         dashboard_user = (os.getenv("PRIVATE_KEY_ADDRESS", "") or "").strip().lower()
     if AUTO_TRADE and trader.address:
         dashboard_user = ((os.getenv("FUNDER_ADDRESS", "") or trader.address) or "").strip().lower()
+    session = TradingSession(trader, executor, dashboard_user)
+    # 账户快照在后台线程定时/按需刷新, 主循环与下单线程不等待
+    ACCOUNT_SYNC.start(dashboard_user)
     
     try:
         while True:
@@ -1725,37 +2460,38 @@ def main():
                     market = dict(market_data_cache)
                     market["remaining"] = remaining_live
 
-            if now - last_account_sync >= DASHBOARD_ACCOUNT_SYNC_SEC:
-                _sync_dashboard_account_snapshot(dashboard_user)
-                last_account_sync = now
+            _dashboard_set(feeds={"bus": PRICE_BUS.stats(), "binance": binance_listener.stats(), "account": ACCOUNT_SYNC.stats(),
+                                  "chain": _chain["reader"].stats() if _chain["reader"] else None,
+                                  "data_cache": DATA_CACHE.stats()})
 
             if not market:
+                trader.remaining = None
                 state_snapshot = load_state()
+                snap = PRICE_BUS.snapshot()
                 _dashboard_set(
                     market={"slug": "", "remaining": 0, "status": "waiting"},
                     prices={
-                        "ptb": price_data.get("ptb"),
-                        "chainlink_btc": price_data.get("btc"),
-                        "binance_btc": price_data.get("binance"),
-                        "up_price": price_data.get("up_price"),
-                        "down_price": price_data.get("down_price"),
+                        "ptb": snap["ptb"],
+                        "chainlink_btc": snap["btc"],
+                        "binance_btc": snap["binance"],
+                        "up_price": snap["up_price"],
+                        "down_price": snap["down_price"],
                         "diff": None,
                         "diff_abs": None,
                     },
-                    position=dict(state_snapshot.get("position") or {}),
-                    pending_order=dict(state_snapshot.get("pending_order") or {}),
-                    last_order=dict(state_snapshot.get("last_order") or {}),
-                    trade_history=list(state_snapshot.get("trade_history") or []),
+                    position=state_snapshot["position"],
+                    pending_order=state_snapshot["pending_order"],
+                    last_order=state_snapshot["last_order"],
+                    trade_history=state_snapshot["trade_history"],
                 )
-                if first_display:
+                if session.first_display:
                     print("\n⏳ 等待活跃市场...")
-                    if price_data["btc"]:
-                        print(f"当前BTC价格(Chainlink): ${price_data['btc']:,.2f}")
+                    if snap["btc"]:
+                        print(f"当前BTC价格(Chainlink): ${snap['btc']:,.2f}")
                 time.sleep(1)
                 continue
             
             slug = market["slug"]
-            remaining = market["remaining"]
             
             # 检测市场切换
             if last_slug and slug != last_slug:
@@ -1764,26 +2500,21 @@ def main():
                     market_listener.stop()
                 
                 # 清除状态
-                state = load_state()
-                state.pop("position", None)
-                state.pop("last_order", None)
-                save_state(state)
+                session.on_new_window()
+                if index_updater:
+                    index_updater.notify()
                 
                 # 启动新的市场监听
+                feed_recorder.set_window(slug, market)
                 market_listener = MarketPriceListener(market["up_token"], market["down_token"])
                 market_listener.start()
                 
-                # 清空PTB缓存
-                price_data["ptb"] = None
-                
-                # 标记需要重新显示
-                first_display = True
-                
                 # 等待获取市场价格
                 time.sleep(2)
             
             elif not last_slug:
                 # 首次启动市场监听
+                feed_recorder.set_window(slug, market)
                 market_listener = MarketPriceListener(market["up_token"], market["down_token"])
                 market_listener.start()
                 time.sleep(2)
@@ -1794,333 +2525,19 @@ def main():
             if not price_data["ptb"]:
                 crypto_data = get_crypto_price_api(market["start"], market["end"])
                 if crypto_data.get("openPrice"):
-                    price_data["ptb"] = crypto_data["openPrice"]
+                    PRICE_BUS.publish("ptb", crypto_data["openPrice"])
                 # 如果当前周期 PTB 获取失败，尝试使用前一周期的 closePrice
                 elif crypto_data.get("closePrice"):
-                    price_data["ptb"] = crypto_data["closePrice"]
+                    PRICE_BUS.publish("ptb", crypto_data["closePrice"])
                     log(f"使用前一周期的closePrice作为PTB: {price_data['ptb']}", "INFO")
+                if price_data["ptb"]:
+                    feed_recorder.record_meta("ptb", {"slug": slug, "ptb": price_data["ptb"]})
+                    window_start = int(now // WINDOW_SEC) * WINDOW_SEC
+                    window_ptbs[window_start] = price_data["ptb"]
+                    for w in [w for w in window_ptbs if w < window_start - SERIES_MAX_WINDOWS * WINDOW_SEC]:
+                        window_ptbs.pop(w, None)
             
-            # 从WebSocket获取的实时数据
-            btc = price_data["btc"] or 0  # 如果Chainlink获取失败,使用0
-            ptb = price_data["ptb"] or 0
-            up_price = price_data["up_price"] or market["up_price"]
-            down_price = price_data["down_price"] or market["down_price"]
-            
-            # 计算价差
-            diff = btc - ptb if (btc > 0 and ptb > 0) else 0
-            diff_abs = abs(diff)
-            _dashboard_set(
-                market={
-                    "slug": slug,
-                    "remaining": remaining,
-                    "remaining_text": f"{remaining//60}分{remaining%60}秒",
-                    "start": market.get("start"),
-                    "end": market.get("end"),
-                    "status": "active",
-                },
-                prices={
-                    "ptb": ptb if ptb > 0 else None,
-                    "chainlink_btc": btc if btc > 0 else None,
-                    "binance_btc": (price_data.get("binance") or None),
-                    "up_price": up_price,
-                    "down_price": down_price,
-                    "diff": diff if (btc > 0 and ptb > 0) else None,
-                    "diff_abs": diff_abs if (btc > 0 and ptb > 0) else None,
-                    "updated_ts": time.time(),
-                },
-            )
-
-            state_snapshot = load_state()
-            _dashboard_set(
-                position=dict(state_snapshot.get("position") or {}),
-                pending_order=dict(state_snapshot.get("pending_order") or {}),
-                last_order=dict(state_snapshot.get("last_order") or {}),
-                trade_history=list(state_snapshot.get("trade_history") or []),
-            )
-            
-            # 首次显示完整界面
-            if first_display:
-                print("\n" + "="*90)
-                print(f"📊 市场: {slug}")
-                print(f"⏱️  剩余时间: {remaining//60}分{remaining%60}秒")
-                print()
-                print("┌────────────────────────┬────────────────────────┬────────────────────────┐")
-                print("│ 标定价 (PTB)           │ Chainlink 现价 (依据)  │ 币安现价 (参考)        │")
-                ptb_display = f"${ptb:,.2f}" if ptb > 0 else "获取中..."
-                btc_display = f"${btc:,.2f}" if btc > 0 else "获取中..."
-                binance = price_data.get("binance") or 0
-                binance_display = f"${binance:,.2f}" if binance > 0 else "获取中..."
-                print(f"│ {ptb_display:22s} │ {btc_display:22s} │ {binance_display:22s} │")
-                print("├────────────────────────┴────────────────────────┴────────────────────────┤")
-                print("│ 市场现价                                                                 │")
-                print(f"│ UP: {up_price*100:.2f}%  DOWN: {down_price*100:.2f}%                                                │")
-                print("├──────────────────────────────────────────────────────────────────────────┤")
-                print("│ 实时价差 (Chainlink - PTB)                                               │")
-                if btc > 0 and ptb > 0:
-                    diff_display = f"{diff:+.0f} USD"
-                else:
-                    diff_display = "等待价格数据..."
-                print(f"│ {diff_display:72s} │")
-                print("└──────────────────────────────────────────────────────────────────────────┘")
-                print()
-                print("="*90)
-                print("实时日志:")
-                print("="*90)
-                first_display = False
-            
-            # 后续只更新状态行
-            ptb_str = f"${ptb:,.0f}" if ptb > 0 else "获取中"
-            btc_str = f"${btc:,.0f}" if btc > 0 else "获取中"
-            binance = price_data.get("binance") or 0
-            binance_str = f"${binance:,.0f}" if binance > 0 else "N/A"
-            diff_str = f"{diff:+.0f}" if (btc > 0 and ptb > 0) else "N/A"
-            status = f"[{datetime.now().strftime('%H:%M:%S')}] 剩余:{remaining//60:02d}分{remaining%60:02d}秒 | Chainlink:{btc_str} | 币安:{binance_str} | PTB:{ptb_str} | 价差:{diff_str} | UP:{up_price*100:.1f}% DOWN:{down_price*100:.1f}%"
-            print(f"\r{status}" + " "*10, end="", flush=True)
-            
-            # 检查触发条件
-            triggered = False
-            condition = None
-            side = None
-            desired_side = None
-            price = None
-            token = None
-            
-            # 条件1: 剩余120秒内,价差为正且≥30,UP概率高
-            if remaining <= C1_TIME and diff >= C1_DIFF:
-                prob = up_price
-                if C1_MIN_PROB <= prob <= C1_MAX_PROB:
-                    triggered = True
-                    desired_side = "UP"
-                    condition = f"条件1: 剩余≤{C1_TIME}s 且 价差≥${C1_DIFF} (UP概率{prob*100:.0f}%)"
-                else:
-                    log(f"条件1跳过: UP概率{prob*100:.1f}% < {C1_MIN_PROB*100:.0f}%", "INFO")
-            
-            # 条件2: 剩余120秒内,价差为负且≤-阈值,DOWN概率高
-            elif remaining <= C2_TIME and diff <= -C2_DIFF:
-                prob = down_price
-                if C2_MIN_PROB <= prob <= C2_MAX_PROB:
-                    triggered = True
-                    desired_side = "DOWN"
-                    condition = f"条件2: 剩余≤{C2_TIME}s 且 价差≤-${C2_DIFF} (DOWN概率{prob*100:.0f}%)"
-                else:
-                    log(f"条件2跳过: DOWN概率{prob*100:.1f}% 不在 {C2_MIN_PROB*100:.0f}%~{C2_MAX_PROB*100:.0f}%", "INFO")
-            
-            # 条件3: 剩余60秒内,价差为正且≥50,UP概率高
-            elif remaining <= C3_TIME and diff >= C3_DIFF:
-                prob = up_price
-                if C3_MIN_PROB <= prob <= C3_MAX_PROB:
-                    triggered = True
-                    desired_side = "UP"
-                    condition = f"条件3: 剩余≤{C3_TIME}s 且 价差≥${C3_DIFF} (UP概率{prob*100:.0f}%)"
-                else:
-                    log(f"条件3跳过: UP概率{prob*100:.1f}% < {C3_MIN_PROB*100:.0f}%", "INFO")
-            
-            # 条件4: 剩余60秒内,价差为负且≤-阈值,DOWN概率高
-            elif remaining <= C4_TIME and diff <= -C4_DIFF:
-                prob = down_price
-                if C4_MIN_PROB <= prob <= C4_MAX_PROB:
-                    triggered = True
-                    desired_side = "DOWN"
-                    condition = f"条件4: 剩余≤{C4_TIME}s 且 价差≤-${C4_DIFF} (DOWN概率{prob*100:.0f}%)"
-                else:
-                    log(f"条件4跳过: DOWN概率{prob*100:.1f}% 不在 {C4_MIN_PROB*100:.0f}%~{C4_MAX_PROB*100:.0f}%", "INFO")
-            
-            # 条件5: 剩余40秒内,价差≥60 (激进，无概率限制)
-            elif remaining <= C5_TIME and diff_abs >= C5_DIFF:
-                triggered = True
-                condition = f"条件5: 剩余≤{C5_TIME}s 且 价差≥${C5_DIFF} (激进)"
-            
-            if triggered:
-                side = desired_side or ("UP" if diff > 0 else "DOWN")
-                price = up_price if side == "UP" else down_price
-                token = market["up_token"] if side == "UP" else market["down_token"]
-                
-                # 检查是否已下单
-                state = load_state()
-                last_order = state.get("last_order", {})
-                order_key = f"{slug}|{side}"
-                
-                # 检查是否有未完成的订单需要监控
-                pending_order = state.get("pending_order")
-                _dashboard_set(
-                    position=dict(state.get("position") or {}),
-                    pending_order=dict(pending_order or {}),
-                    last_order=dict(last_order or {}),
-                )
-                if pending_order:
-                    order_id = pending_order.get("order_id")
-                    order_time = pending_order.get("time")
-                    
-                    # 检查订单是否超时（使用条件4的超时设置）
-                    if order_time:
-                        elapsed = (datetime.now() - datetime.fromisoformat(order_time)).total_seconds()
-                        if elapsed > ORDER_TIMEOUT_SEC:
-                            # 检查订单状态
-                            order_status = trader.get_order_status(order_id)
-                            if order_status and not order_status.get("filled"):
-                                # 订单未成交,撤销并重试
-                                log(f"订单超时未成交,撤销重试 (订单ID: {order_id})", "TRADE")
-                                trader.cancel_order(order_id)
-                                state.pop("pending_order", None)
-                                save_state(state)
-                                _dashboard_set(
-                                    position=dict(state.get("position") or {}),
-                                    pending_order={},
-                                    last_order=dict(state.get("last_order") or {}),
-                                )
-                            elif order_status and order_status.get("filled"):
-                                # 订单已成交
-                                filled_side = pending_order.get("side") or side
-                                filled_price = float(pending_order.get("price") or price or 0)
-                                filled_slug = pending_order.get("slug") or slug
-                                log(f"订单已成交! {filled_side} @ {filled_price*100:.2f}% (市场: {filled_slug})", "TRADE")
-                                state.pop("pending_order", None)
-                                state["position"] = {
-                                    "slug": filled_slug,
-                                    "side": filled_side,
-                                    "entry_price": filled_price,
-                                    "entry_diff": diff_abs
-                                }
-                                state = _append_trade_history(state, {
-                                    "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                                    "slug": filled_slug,
-                                    "action": "BUY",
-                                    "side": filled_side,
-                                    "price": filled_price,
-                                    "amount": TRADE_AMOUNT,
-                                    "order_id": order_id,
-                                    "status": "filled",
-                                    "reason": "pending_filled",
-                                    "diff": diff,
-                                })
-                                save_state(state)
-                                _dashboard_set(
-                                    position=dict(state.get("position") or {}),
-                                    pending_order={},
-                                    last_order=dict(state.get("last_order") or {}),
-                                    trade_history=list(state.get("trade_history") or []),
-                                )
-                                _sync_dashboard_account_snapshot(dashboard_user)
-                
-                # 如果没有pending订单且未记录过此订单,则下单
-                has_position = bool(state.get("position"))
-                if not pending_order and (not has_position) and last_order.get("key") != order_key:
-                    # 检查滑点：当前价格与下单价格差异
-                    current_price = up_price if side == "UP" else down_price
-                    if price > 0:
-                        slippage = abs(current_price - price) / price
-                        if slippage > SLIPPAGE_THRESHOLD:
-                            log(f"滑点过大: {slippage*100:.1f}% > {SLIPPAGE_THRESHOLD*100:.0f}%, 取消下单", "WARN")
-                            triggered = False
-                            condition = None
-                    
-                    # 检查尝试次数：同一市场避免多次追单
-                    if triggered:
-                        retry_count = last_order.get("retry_count", 0)
-                        if retry_count >= MAX_RETRY_PER_MARKET:
-                            log(f"尝试次数已达上限({MAX_RETRY_PER_MARKET}次), 跳过 {order_key}", "WARN")
-                            triggered = False
-                            condition = None
-                    
-                    if triggered:
-                        log(f"触发条件: {condition} → {side} @ {price*100:.1f}%", "TRADE")
-                    
-                    if AUTO_TRADE and trader.connected:
-                        order_id = trader.place_order(token, "BUY", price, TRADE_AMOUNT)
-                        
-                        if order_id:
-                            # 记录pending订单,开始监控
-                            state["pending_order"] = {
-                                "order_id": order_id,
-                                "time": datetime.now().isoformat(),
-                                "slug": slug,
-                                "side": side,
-                                "price": price
-                            }
-                            # 记录尝试次数
-                            current_retry = last_order.get("retry_count", 0)
-                            state["last_order"] = {
-                                "key": order_key, 
-                                "time": datetime.now().isoformat(),
-                                "retry_count": current_retry + 1
-                            }
-                            state = _append_trade_history(state, {
-                                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                                "slug": slug,
-                                "action": "BUY",
-                                "side": side,
-                                "price": price,
-                                "amount": TRADE_AMOUNT,
-                                "order_id": order_id,
-                                "status": "submitted",
-                                "reason": condition,
-                                "diff": diff,
-                            })
-                            save_state(state)
-                            _dashboard_set(
-                                pending_order=dict(state.get("pending_order") or {}),
-                                last_order=dict(state.get("last_order") or {}),
-                                trade_history=list(state.get("trade_history") or []),
-                            )
-                            _sync_dashboard_account_snapshot(dashboard_user)
-                            log(f"订单已提交,开始监控 (订单ID: {order_id})", "TRADE")
-                        else:
-                            # 下单失败,记录避免重复尝试
-                            log(f"下单失败: {side} @ {price*100:.1f}%", "ERR")
-                            state["last_order"] = {"key": order_key, "time": datetime.now().isoformat()}
-                            state = _append_trade_history(state, {
-                                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                                "slug": slug,
-                                "action": "BUY",
-                                "side": side,
-                                "price": price,
-                                "amount": TRADE_AMOUNT,
-                                "order_id": "",
-                                "status": "failed",
-                                "reason": condition,
-                                "diff": diff,
-                            })
-                            save_state(state)
-                            _dashboard_set(
-                                last_order=dict(state.get("last_order") or {}),
-                                trade_history=list(state.get("trade_history") or []),
-                            )
-                            _sync_dashboard_account_snapshot(dashboard_user)
-                    else:
-                        log(f"提醒模式: 建议买入 {side} @ {price*100:.1f}%", "TRADE")
-                        state["last_order"] = {"key": order_key, "time": datetime.now().isoformat()}
-                        save_state(state)
-                        _dashboard_set(last_order=dict(state.get("last_order") or {}))
-            
-            # 止损检查
-            state = load_state()
-            pos = state.get("position")
-            if pos and pos.get("slug") == slug:
-                if diff_abs < STOP_LOSS_DIFF:
-                    log(f"止损触发! 价差${diff_abs:.0f} < ${STOP_LOSS_DIFF}", "TRADE")
-                    
-                    if AUTO_TRADE and trader.connected:
-                        pos_side = pos.get("side")
-                        sell_price = up_price if pos_side == "UP" else down_price
-                        sell_token = market["up_token"] if pos_side == "UP" else market["down_token"]
-                        sell_order_id = trader.place_order(sell_token, "SELL", sell_price, TRADE_AMOUNT)
-                        state = _append_trade_history(state, {
-                            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                            "slug": slug,
-                            "action": "SELL",
-                            "side": pos_side,
-                            "price": sell_price,
-                            "amount": TRADE_AMOUNT,
-                            "order_id": sell_order_id or "",
-                            "status": "submitted" if sell_order_id else "failed",
-                            "reason": "stop_loss",
-                            "diff": diff,
-                        })
-                        state.pop("position", None)
-                        save_state(state)
-                        _dashboard_set(position={}, trade_history=list(state.get("trade_history") or []))
-                        _sync_dashboard_account_snapshot(dashboard_user)
-                        log(f"止损卖出完成: {pos_side} @ {sell_price*100:.2f}%", "TRADE")
+            session.on_tick(market)
             
             time.sleep(1)  # 每1秒刷新一次
             
@@ -2128,7 +2545,16 @@ def main():
         print("\n\n退出监控")
         if market_listener:
             market_listener.stop()
+        binance_listener.stop()
+        executor.stop()
         redeemer.stop()
+        ACCOUNT_SYNC.stop()
+        if _chain["reader"]:
+            _chain["reader"].rpc.stop()
+        feed_recorder.stop()
+        tick_store.close()
+        if index_updater:
+            index_updater.stop()
 
 if __name__ == "__main__":
     main()
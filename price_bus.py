@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+行情发布/订阅 (按键合并)
+监听线程调用 publish() 写入最新值; 每个订阅者各自保存 "尚未取走的最新值", 同一个键的旧值被新值覆盖,
+所以慢消费者只会看到更少的中间值, 不会积压, 也不会阻塞发布线程。
+每个订阅者单独统计: 送达数、被合并掉的中间值数、取到时的延迟 (发布到被取走的时长)、距上次取值的时长。
+
+bus.values 始终是各键的最新值, 可以像普通 dict 一样读取。
+需要多个键在同一时刻一致时 (一次交易决策同时用到 Chainlink、PTB、UP、DOWN) 用 bus.snapshot():
+每次写入都生成新的不可变快照并整体替换引用, 读者取到的快照内各键来自同一版本, 读取不加锁;
+写入之间用一把写锁串行, update() 的多个键作为同一版本提交。
+
+一致性检查:
+  python price_bus.py check [--writers 3] [--reads 300000]
+  多个写线程不断用 update() 同时写入4个键 (值相同), 读线程取快照检查4个键是否来自同一次写入;
+  同时统计逐键读取 bus.values 出现的混合版本数作为对照
+"""
+import sys
+import time
+import argparse
+import threading
+
+
+class Subscription:
+    def __init__(self, bus, name, keys=None):
+        self.bus = bus
+        self.name = name
+        self.keys = None if keys is None else frozenset(keys)
+        self.delivered = 0
+        self.conflated = 0     # 未被取走就被新值覆盖的更新数
+        self.lag_ms = 0.0      # 最近一次取值时, 其中最旧一条更新等待的时长
+        self.max_lag_ms = 0.0
+        self.last_poll = time.monotonic()
+        self._pending = {}     # 键 → (值, 发布时间)
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+
+    def _offer(self, key, value, ts):
+        if self.keys is not None and key not in self.keys:
+            return
+        with self._lock:
+            old = self._pending.get(key)
+            if old is not None:
+                self.conflated += 1
+                ts = old[1]  # 保留最早未取走的发布时间, 延迟按等待最久的算
+            self._pending[key] = (value, ts)
+        self._event.set()
+
+    def poll(self):
+        """取走所有键的最新值 {键: 值}, 不阻塞; 没有更新时返回空 dict"""
+        now = time.monotonic()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._event.clear()
+            self.last_poll = now
+            if pending:
+                lag = (now - min(ts for _, ts in pending.values())) * 1000.0
+                self.lag_ms = lag
+                self.max_lag_ms = max(self.max_lag_ms, lag)
+                self.delivered += len(pending)
+        return {k: v for k, (v, _) in pending.items()}
+
+    def wait(self, timeout=None):
+        """等待到有更新 (或超时) 后取值"""
+        self._event.wait(timeout)
+        return self.poll()
+
+    def stats(self):
+        with self._lock:
+            backlog = len(self._pending)
+            oldest = min((ts for _, ts in self._pending.values()), default=None)
+        now = time.monotonic()
+        return {
+            "name": self.name,
+            "delivered": self.delivered,
+            "conflated": self.conflated,
+            "backlog": backlog,
+            "lag_ms": round(self.lag_ms, 1),
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "pending_ms": round((now - oldest) * 1000.0, 1) if oldest is not None else 0.0,
+            "idle_ms": round((now - self.last_poll) * 1000.0, 1),
+        }
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class PriceSnapshot(tuple):
+    """某一版本的全部价格 (不可变元组: 版本号, 各键值, 各键最近写入的单调时钟时间)"""
+    __slots__ = ()
+    # 下标访问按键取价格, 字段用 tuple 自身的下标
+    seq = property(lambda self: tuple.__getitem__(self, 0))
+    values = property(lambda self: tuple.__getitem__(self, 1))
+    times = property(lambda self: tuple.__getitem__(self, 2))
+
+    def __new__(cls, seq, values, times):
+        return tuple.__new__(cls, (seq, values, times))
+
+    def __getitem__(self, key):
+        return tuple.__getitem__(self, 1)[key]
+
+    def get(self, key, default=None):
+        return tuple.__getitem__(self, 1).get(key, default)
+
+    def age(self, key, now=None):
+        """键距最近一次写入的秒数, 从未写入返回 None"""
+        ts = self.times.get(key)
+        return None if ts is None else (time.monotonic() if now is None else now) - ts
+
+
+class PriceBus:
+    def __init__(self, initial=None):
+        self.values = dict(initial or {})
+        self.published = 0
+        self._subs = ()   # 写时复制, 发布时无需加锁遍历
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._snapshot = PriceSnapshot(0, dict(self.values), {})
+
+    def snapshot(self):
+        """当前一致快照 (只是读取一个引用, 不加锁)"""
+        return self._snapshot
+
+    def publish(self, key, value):
+        self._commit({key: value})
+
+    def update(self, **kwargs):
+        if kwargs:
+            self._commit(kwargs)
+
+    def _commit(self, changes):
+        ts = time.monotonic()
+        with self._write_lock:
+            snap = self._snapshot
+            seq, values, times = snap
+            values = {**values, **changes}
+            times = times.copy()
+            for key in changes:
+                times[key] = ts
+            self._snapshot = PriceSnapshot(seq + 1, values, times)
+            self.values.update(changes)
+            self.published += len(changes)
+        for sub in self._subs:
+            for key, value in changes.items():
+                sub._offer(key, value, ts)
+
+    def subscribe(self, name, keys=None):
+        sub = Subscription(self, name, keys)
+        with self._lock:
+            self._subs = self._subs + (sub,)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subs = tuple(s for s in self._subs if s is not sub)
+
+    def stats(self):
+        return {"published": self.published, "seq": self._snapshot.seq, "subscribers": [s.stats() for s in self._subs]}
+
+
+# ============== 一致性检查 ==============
+_CHECK_KEYS = ("btc", "ptb", "up_price", "down_price")
+
+
+def check_consistency(writers=3, reads=300000):
+    """返回 (快照读取的混合版本数, 逐键读取 bus.values 的混合版本数, 写入版本数)"""
+    bus = PriceBus({k: (0, 0) for k in _CHECK_KEYS})
+    stop = threading.Event()
+
+    def write(wid):
+        n = 0
+        while not stop.is_set():
+            n += 1
+            v = (wid, n)
+            bus.update(**{k: v for k in _CHECK_KEYS})
+
+    threads = [threading.Thread(target=write, args=(i,), daemon=True) for i in range(writers)]
+    for t in threads:
+        t.start()
+    mixed_snapshot = mixed_values = 0
+    try:
+        for _ in range(reads):
+            snap = bus.snapshot()
+            if len({snap[k] for k in _CHECK_KEYS}) > 1:
+                mixed_snapshot += 1
+            values = bus.values
+            if len({values[k] for k in _CHECK_KEYS}) > 1:
+                mixed_values += 1
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    return mixed_snapshot, mixed_values, bus.snapshot().seq
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PriceBus 快照一致性检查")
+    sub = parser.add_subparsers(dest="cmd")
+    p_check = sub.add_parser("check", help="多写线程下检查快照是否出现混合版本")
+    p_check.add_argument("--writers", type=int, default=3)
+    p_check.add_argument("--reads", type=int, default=300000)
+    args = parser.parse_args()
+    if args.cmd != "check":
+        parser.print_help()
+        return
+    t0 = time.perf_counter()
+    mixed_snapshot, mixed_values, seq = check_consistency(args.writers, args.reads)
+    print(f"写线程 {args.writers} | 读取 {args.reads:,} 次 | 写入版本 {seq:,} | 耗时 {time.perf_counter() - t0:.1f}s")
+    print(f"快照混合版本: {mixed_snapshot}")
+    print(f"逐键读取 values 混合版本 (对照): {mixed_values}")
+    sys.exit(1 if mixed_snapshot else 0)
+
+
+if __name__ == "__main__":
+    main()
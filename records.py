@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+交易记录类型
+持仓、挂单、下单记录、交易历史、聚合成交都是 __slots__ 记录类: 创建后不可修改 (需要改动时用 replace 生成新对象),
+状态、面板和各线程之间直接共享引用, 不必 dict()/list() 复制; 交易历史用元组保存。
+只在出口处转成 dict: 写状态文件用 to_dict, Flask/SSE 输出 JSON 时用 json_default。
+
+成批的钱包成交流水用列式容器 TradeTape 保存: 数值列为 array, 文本列为 list, 不再为每行保留原始 dict。
+"""
+import math
+from array import array
+from bisect import bisect_left, insort
+
+
+class Record:
+    """不可变记录基类; 子类只需声明 __slots__。值为 None 的字段在 to_dict 中省略"""
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} 不可修改, 请使用 replace()")
+
+    def replace(self, **changes):
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return type(self)(**fields)
+
+    def get(self, name, default=None):
+        """与 dict.get 相同的读取方式, 兼容原来按键读取的代码"""
+        value = getattr(self, name, None) if name in self.__slots__ else None
+        return default if value is None else value
+
+    def to_dict(self):
+        out = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not None:
+                out[name] = value
+        return out
+
+    @classmethod
+    def from_dict(cls, data):
+        """状态文件中的 dict → 记录; 空值或非 dict 返回 None, 多余的键忽略"""
+        if isinstance(data, cls):
+            return data
+        if not isinstance(data, dict) or not data:
+            return None
+        return cls(**{name: data.get(name) for name in cls.__slots__})
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, n) for n in self.__slots__))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{k}={v!r}' for k, v in self.to_dict().items())})"
+
+
+class Position(Record):
+    """本地持仓 (挂单成交后建立, 止损卖出后清除)"""
+    __slots__ = ("slug", "side", "entry_price", "entry_diff")
+
+
+class PendingOrder(Record):
+    """已提交、等待成交的买单"""
+    __slots__ = ("order_id", "time", "slug", "side", "price")
+
+
+class OrderAttempt(Record):
+    """最近一次下单尝试, 用于同一市场同一方向去重与限制重试次数"""
+    __slots__ = ("key", "time", "retry_count")
+
+
+class TradeEvent(Record):
+    """交易历史条目 (本地下单/成交/止损, 以及钱包已平仓记录)"""
+    __slots__ = ("time", "slug", "action", "side", "price", "amount", "order_id", "status", "reason", "diff", "pnl")
+
+
+class TradeGroup(Record):
+    """按市场聚合的钱包成交 (面板 status=AGG 的行)"""
+    __slots__ = ("id", "pair_id", "direction", "reason", "buy_count", "sell_count", "redeem_count",
+                 "buy_usdc", "sell_usdc", "redeem_usdc", "size", "entry_price_quote", "exit_price_quote",
+                 "order_time", "settle_time", "profit", "result", "status")
+
+
+def json_default(obj):
+    """json.dumps / Flask JSON 的 default: 记录转 dict, 列式容器转列表"""
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    if isinstance(obj, TradeTape):
+        return obj.to_list()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def records_to_dicts(items):
+    return [x.to_dict() if isinstance(x, Record) else x for x in items or ()]
+
+
+def events_from_dicts(items):
+    """状态文件中的交易历史列表 → TradeEvent 元组"""
+    if not isinstance(items, (list, tuple)):
+        return ()
+    return tuple(e for e in (TradeEvent.from_dict(x) for x in items) if e is not None)
+
+
+# ============== 列式成交流水 ==============
+KIND_BUY = 1
+KIND_SELL = 2
+KIND_REDEEM = 3
+KIND_CODES = {"BUY": KIND_BUY, "SELL": KIND_SELL, "REDEEM": KIND_REDEEM}
+KIND_NAMES = {v: k for k, v in KIND_CODES.items()}
+
+
+class TradeTape:
+    """
+    钱包成交流水 (按追加顺序) 的列式存储; 缺失的价格/数量为 NaN。
+    ids 用于去重: 同一成交ID只追加一次。
+    """
+    __slots__ = ("ids", "ts_ms", "kind", "price", "size", "usdc", "ts", "market", "outcome", "reason", "_seen")
+
+    def __init__(self):
+        self.ids = []
+        self.ts_ms = array("q")
+        self.kind = array("b")
+        self.price = array("d")
+        self.size = array("d")
+        self.usdc = array("d")
+        self.ts = []        # 原始时间字段 (面板按原样显示)
+        self.market = []    # 聚合键: conditionId / slug / asset
+        self.outcome = []   # UP / DOWN / 原始标签
+        self.reason = []    # 市场标题
+        self._seen = set()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, trade_id):
+        return trade_id in self._seen
+
+    def append(self, trade_id, kind, ts, ts_ms, price, size, usdc, market, outcome, reason):
+        """追加一行, 重复ID返回 False"""
+        if trade_id in self._seen:
+            return False
+        self._seen.add(trade_id)
+        self.ids.append(trade_id)
+        self.ts_ms.append(int(ts_ms or 0))
+        self.kind.append(KIND_CODES[kind])
+        self.price.append(math.nan if price is None else float(price))
+        self.size.append(math.nan if size is None else float(size))
+        self.usdc.append(float(usdc or 0.0))
+        self.ts.append(ts)
+        self.market.append(market)
+        self.outcome.append(outcome)
+        self.reason.append(reason)
+        return True
+
+    def order(self):
+        """按成交时间排序的行号 (时间相同保持追加顺序)"""
+        ts_ms = self.ts_ms
+        return sorted(range(len(ts_ms)), key=ts_ms.__getitem__)
+
+    def row(self, i):
+        price, size = self.price[i], self.size[i]
+        return {
+            "id": self.ids[i],
+            "kind": KIND_NAMES[self.kind[i]],
+            "timestamp": self.ts[i],
+            "ts_ms": self.ts_ms[i],
+            "price": None if price != price else price,
+            "size": None if size != size else size,
+            "usdcSize": self.usdc[i],
+            "market": self.market[i],
+            "outcome": self.outcome[i],
+            "title": self.reason[i],
+        }
+
+    def to_list(self):
+        return [self.row(i) for i in self.order()]
+
+
+class MarketTradeAgg:
+    """单个市场的成交累加器 (可变), summary() 生成面板用的 TradeGroup"""
+    __slots__ = ("key", "reason", "outcomes", "counts", "buy_size", "sell_size", "buy_usdc", "sell_usdc",
+                 "redeem_usdc", "first_ts", "last_ts", "first_ts_ms", "last_ts_ms")
+
+    def __init__(self, key, reason, ts, ts_ms):
+        self.key = key
+        self.reason = reason
+        self.outcomes = set()
+        self.counts = [0, 0, 0, 0]  # 按 KIND_* 下标: 买/卖/领取
+        self.buy_size = self.sell_size = 0.0
+        self.buy_usdc = self.sell_usdc = self.redeem_usdc = 0.0
+        self.first_ts = self.last_ts = ts
+        self.first_ts_ms = self.last_ts_ms = ts_ms
+
+    def add(self, kind, ts, ts_ms, size, usdc, outcome):
+        if ts_ms and ts_ms < self.first_ts_ms:
+            self.first_ts_ms, self.first_ts = ts_ms, ts
+        if ts_ms and ts_ms >= self.last_ts_ms:
+            self.last_ts_ms, self.last_ts = ts_ms, ts
+        if outcome and outcome != "-":
+            self.outcomes.add(outcome)
+        self.counts[kind] += 1
+        if kind == KIND_BUY:
+            self.buy_size += size
+            self.buy_usdc += usdc
+        elif kind == KIND_SELL:
+            self.sell_size += size
+            self.sell_usdc += usdc
+        elif kind == KIND_REDEEM:
+            self.redeem_usdc += usdc
+
+    def summary(self):
+        buy_count, sell_count, redeem_count = self.counts[KIND_BUY], self.counts[KIND_SELL], self.counts[KIND_REDEEM]
+        matched_size = min(self.buy_size, self.sell_size)
+        if len(self.outcomes) == 1:
+            direction = next(iter(self.outcomes))
+        elif self.outcomes:
+            direction = "MIX"
+        else:
+            direction = "-"
+        gid = f"agg-{self.key}"
+        return TradeGroup(
+            id=gid,
+            pair_id=gid,
+            direction=direction,
+            reason=self.reason,
+            buy_count=buy_count,
+            sell_count=sell_count,
+            redeem_count=redeem_count,
+            buy_usdc=self.buy_usdc,
+            sell_usdc=self.sell_usdc,
+            redeem_usdc=self.redeem_usdc,
+            size=matched_size if matched_size > 1e-9 else max(self.buy_size, self.sell_size),
+            entry_price_quote=(self.buy_usdc / self.buy_size) if self.buy_size > 1e-9 else None,
+            exit_price_quote=(self.sell_usdc / self.sell_size) if self.sell_size > 1e-9 else None,
+            order_time=self.first_ts,
+            settle_time=self.last_ts,
+            profit=self.sell_usdc + self.redeem_usdc - self.buy_usdc,
+            result="CLOSED" if (sell_count > 0 or redeem_count > 0) else "OPEN",
+            status="AGG",
+        )
+
+
+class MarketAggregator:
+    """
+    按市场的增量聚合: 流水只追加, 每次只把尚未应用的行累加到对应市场, 只为这些市场重新生成 TradeGroup;
+    其余市场的 TradeGroup 对象原样复用。成交时间在写入流水时已解析为 ts_ms 列, 这里不再解析。
+    按最后成交时间的排序也增量维护: 只把有变化的市场从 order 中移出再按新时间插回, 不再整体重排。
+    """
+    __slots__ = ("groups", "summaries", "applied", "order")
+
+    def __init__(self):
+        self.groups = {}      # 市场键 → MarketTradeAgg
+        self.summaries = {}   # 市场键 → TradeGroup
+        self.applied = 0      # 已应用的流水行数
+        self.order = []       # (最后成交时间 ms, 市场键), 升序
+
+    def apply_tape(self, tape):
+        """应用 tape 新增的行, 返回有变化的市场键集合"""
+        changed = {}          # 市场键 → 应用前的最后成交时间 (新市场为 None)
+        n = len(tape)
+        for i in range(self.applied, n):
+            key = tape.market[i]
+            ts, ts_ms = tape.ts[i], tape.ts_ms[i]
+            g = self.groups.get(key)
+            if g is None:
+                g = self.groups[key] = MarketTradeAgg(key, tape.reason[i], ts, ts_ms)
+                changed.setdefault(key, None)
+            else:
+                changed.setdefault(key, g.last_ts_ms)
+            size = tape.size[i]
+            g.add(tape.kind[i], ts, ts_ms, 0.0 if size != size else size, tape.usdc[i], tape.outcome[i])
+        self.applied = n
+        order = self.order
+        for key, old_ts in changed.items():
+            self.summaries[key] = self.groups[key].summary()
+            new_ts = self.groups[key].last_ts_ms
+            if old_ts == new_ts:
+                continue
+            if old_ts is not None:
+                del order[bisect_left(order, (old_ts, key))]
+            insort(order, (new_ts, key))
+        return set(changed)
+
+    def rows(self, limit=None):
+        """按最后成交时间排序的 TradeGroup; limit 为只取最近的条数"""
+        order = self.order if limit is None else self.order[-limit:]
+        summaries = self.summaries
+        return [summaries[k] for _, k in order]
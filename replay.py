@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+录制行情回放
+按录制顺序把原始帧送入真实的 MarketPriceListener.on_message / RTDS 价格解析,
+用模拟时钟每秒驱动一次 TradingSession.on_tick, 下单走模拟 Trader
+可按倍速或尽可能快地运行, 结果可复现, 同时统计决策路径吞吐
+
+用法: python replay.py captures/ [--speed 0] [--json result.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime
+from concurrent.futures import Future
+
+import polymarket_auto_trade as bot
+from feed_decode import decode_rtds
+from feed_recorder import iter_feed, list_feed_files, SOURCE_META, SOURCE_BINANCE, SOURCE_RTDS, SOURCE_MARKET
+from tick_store import TickStore
+from lead_lag import LeadLagEstimator
+
+
+class SimClock:
+    """模拟时钟, 由回放按录制的接收时间推进"""
+    def __init__(self, now=0.0):
+        self.now = float(now)
+
+    def time(self):
+        return self.now
+
+
+class ReplayTrader(bot.Trader):
+    """
+    模拟交易客户端
+    BUY 限价单: 查询状态时当前中间价 ≤ 限价视为成交; SELL (止损) 按提交价立即成交
+    """
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+        self.connected = True
+        self.conn_state = "replay"
+        self.tokens = {}  # token_id -> price_data 中对应的键
+        self.orders = {}
+        self.fills = []
+        self._seq = 0
+
+    def connect(self):
+        return True
+
+    def ping(self):
+        return True
+
+    def _mid(self, token_id):
+        key = self.tokens.get(token_id)
+        return bot.price_data.get(key) if key else None
+
+    def place_order(self, token_id, side, price, size):
+        self._seq += 1
+        order_id = f"sim-{self._seq}"
+        order = {
+            "order_id": order_id,
+            "token_id": token_id,
+            "side": side,
+            "price": float(price),
+            "size": float(size),
+            "time": self.clock.time(),
+            "status": "LIVE",
+        }
+        self.orders[order_id] = order
+        if side == "SELL":
+            self._fill(order)
+        return order_id
+
+    def _fill(self, order):
+        order["status"] = "MATCHED"
+        self.fills.append(dict(order, fill_time=self.clock.time()))
+
+    def get_order_status(self, order_id):
+        order = self.orders.get(order_id)
+        if not order:
+            return None
+        if order["status"] == "LIVE":
+            mid = self._mid(order["token_id"])
+            if mid is not None and mid <= order["price"]:
+                self._fill(order)
+        filled = order["status"] == "MATCHED"
+        return {
+            "status": order["status"],
+            "original_size": order["size"],
+            "size_matched": order["size"] if filled else 0.0,
+            "filled": filled,
+        }
+
+    def cancel_order(self, order_id):
+        order = self.orders.get(order_id)
+        if order and order["status"] == "LIVE":
+            order["status"] = "CANCELED"
+        return True
+
+
+class InlineExecutor(bot.OrderExecutor):
+    """在提交线程内同步执行交易意图, 保证回放结果确定"""
+    def submit(self, priority, fn, *args, **kwargs):
+        fut = Future()
+        try:
+            fut.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def _end_ts(market):
+    return datetime.fromisoformat(str(market.get("end", "")).replace("Z", "+00:00")).timestamp()
+
+
+class Replayer:
+    def __init__(self, paths, speed=0.0, tick_sec=1.0, verbose=False):
+        self.paths = list(paths)
+        self.speed = float(speed)
+        self.tick_sec = float(tick_sec)
+        self.verbose = bool(verbose)
+        self.clock = SimClock()
+        self.trader = ReplayTrader(self.clock)
+        self.executor = InlineExecutor(self.trader)
+        self.session = bot.TradingSession(self.trader, self.executor, "", clock=self.clock.time, console=False)
+        self.binance_listener = bot.BTCPriceListener()
+        self.market_listener = None
+        self.market = None
+        self.market_end = 0.0
+        self.next_tick = None
+        self.frames = {}
+        self.ticks = 0
+        self.tick_times = []
+        self.handler_sec = 0.0
+        self.outcomes = {}  # slug -> 结算方向 (按窗口内最后的 Chainlink 与 PTB 判断)
+        self.token_info = {}  # token_id -> (slug, "UP"/"DOWN")
+        self._pace_origin = None
+
+    def _reset_bot(self):
+        for k in list(bot.price_data.keys()):
+            bot.PRICE_BUS.publish(k, None)
+        bot.binance_quotes.clear()
+        self._state_dir = tempfile.mkdtemp(prefix="replay-")
+        bot.STATE_FILE = os.path.join(self._state_dir, "state.json")
+        bot.TRADE_LOG_FILE = ""
+        bot.LOG_ECHO = self.verbose
+        # 回放使用独立的内存缓冲, 不触碰实盘的持久化tick文件
+        bot.tick_store = TickStore(bot.TICK_STORE_CAPACITY, windows=bot.TICK_STATS_WINDOWS, clock=self.clock.time)
+        bot.lead_lag = LeadLagEstimator()
+
+    def _settle_window(self):
+        if not self.market:
+            return
+        # 窗口结束时仍挂着的买单按当前价格最后判定一次是否成交
+        for order_id, order in list(self.trader.orders.items()):
+            if order["status"] == "LIVE" and self.token_info.get(order["token_id"], (None,))[0] == self.market["slug"]:
+                self.trader.get_order_status(order_id)
+        btc = bot.price_data.get("btc") or 0
+        ptb = bot.price_data.get("ptb") or 0
+        if btc > 0 and ptb > 0:
+            self.outcomes[self.market["slug"]] = "UP" if btc >= ptb else "DOWN"
+
+    def _on_meta(self, payload):
+        meta = json.loads(payload)
+        kind, data = meta.get("kind"), meta.get("data") or {}
+        if kind == "market":
+            if self.market and data.get("slug") == self.market.get("slug"):
+                return
+            if self.market:
+                self._settle_window()
+                self.session.on_new_window()
+            self.market = dict(data)
+            self.market_end = _end_ts(self.market)
+            self.market_listener = bot.MarketPriceListener(data.get("up_token"), data.get("down_token"))
+            self.trader.tokens = {data.get("up_token"): "up_price", data.get("down_token"): "down_price"}
+            self.token_info[data.get("up_token")] = (data.get("slug"), "UP")
+            self.token_info[data.get("down_token")] = (data.get("slug"), "DOWN")
+        elif kind == "ptb":
+            if self.market and data.get("slug") == self.market.get("slug"):
+                bot.PRICE_BUS.publish("ptb", data.get("ptb"))
+
+    def _dispatch(self, source, payload):
+        if source == SOURCE_META:
+            self._on_meta(payload)
+            return
+        t0 = time.perf_counter()
+        if source == SOURCE_MARKET:
+            if self.market_listener:
+                self.market_listener.on_message(None, payload)
+        elif source == SOURCE_RTDS:
+            price = decode_rtds(payload)
+            if price is not None:
+                bot.on_chainlink_price(price)
+        elif source == SOURCE_BINANCE:
+            self.binance_listener.process(payload)
+        self.handler_sec += time.perf_counter() - t0
+
+    def _run_ticks(self, until):
+        while self.next_tick is not None and self.next_tick <= until:
+            self.clock.now = self.next_tick
+            if self.market:
+                remaining = int(self.market_end - self.next_tick)
+                if remaining > 0:
+                    market = dict(self.market)
+                    market["remaining"] = remaining
+                    t0 = time.perf_counter()
+                    self.session.on_tick(market)
+                    self.tick_times.append(time.perf_counter() - t0)
+                    self.ticks += 1
+            self.next_tick += self.tick_sec
+
+    def _pace(self, wall):
+        if self.speed <= 0:
+            return
+        if self._pace_origin is None:
+            self._pace_origin = (wall, time.perf_counter())
+            return
+        target = (wall - self._pace_origin[0]) / self.speed
+        delay = target - (time.perf_counter() - self._pace_origin[1])
+        if delay > 0:
+            time.sleep(delay)
+
+    def run(self):
+        self._reset_bot()
+        t0 = time.perf_counter()
+        for path in self.paths:
+            for _, wall, source, payload in iter_feed(path):
+                if self.next_tick is None:
+                    self.next_tick = wall
+                self._pace(wall)
+                self._run_ticks(wall)
+                self.clock.now = wall
+                self._dispatch(source, payload)
+                self.frames[source] = self.frames.get(source, 0) + 1
+        if self.market and self.next_tick is not None:
+            self._run_ticks(self.market_end)
+        self._settle_window()
+        return self.report(time.perf_counter() - t0)
+
+    def report(self, elapsed):
+        # 结算: 买入成本, 止损卖出回款, 到期仍持有的份额按结算方向兑付
+        pnl = 0.0
+        held = {}
+        trades = []
+        for f in self.trader.fills:
+            slug, side = self.token_info.get(f["token_id"], (None, None))
+            trades.append(dict(f, slug=slug, outcome_side=side))
+            if f["side"] == "BUY":
+                pnl -= f["price"] * f["size"]
+                held[f["token_id"]] = held.get(f["token_id"], 0.0) + f["size"]
+            else:
+                pnl += f["price"] * f["size"]
+                held[f["token_id"]] = held.get(f["token_id"], 0.0) - f["size"]
+        for token_id, size in held.items():
+            slug, side = self.token_info.get(token_id, (None, None))
+            if size > 0 and self.outcomes.get(slug) == side:
+                pnl += size
+        frames = sum(self.frames.values())
+        tick_sorted = sorted(self.tick_times)
+        p99 = tick_sorted[min(len(tick_sorted) - 1, int(len(tick_sorted) * 0.99))] if tick_sorted else 0.0
+        return {
+            "frames": frames,
+            "ticks": self.ticks,
+            "windows": len(self.outcomes),
+            "orders": len(self.trader.orders),
+            "fills": len(trades),
+            "pnl": pnl,
+            "outcomes": dict(self.outcomes),
+            "trades": trades,
+            "elapsed_sec": elapsed,
+            "frames_per_sec": frames / elapsed if elapsed > 0 else 0.0,
+            "ticks_per_sec": self.ticks / elapsed if elapsed > 0 else 0.0,
+            "handler_us_per_frame": (self.handler_sec / frames * 1e6) if frames else 0.0,
+            "tick_us_mean": (sum(self.tick_times) / len(self.tick_times) * 1e6) if self.tick_times else 0.0,
+            "tick_us_p99": p99 * 1e6,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的行情文件")
+    parser.add_argument("path", help="录制文件或目录")
+    parser.add_argument("--speed", type=float, default=0.0, help="回放倍速, 0 表示尽可能快")
+    parser.add_argument("--tick", type=float, default=1.0, help="决策间隔 (模拟秒)")
+    parser.add_argument("--verbose", action="store_true", help="输出交易日志")
+    parser.add_argument("--json", default="", help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    paths = list_feed_files(args.path)
+    if not paths:
+        print(f"没有找到录制文件: {args.path}")
+        sys.exit(1)
+    result = Replayer(paths, speed=args.speed, tick_sec=args.tick, verbose=args.verbose).run()
+
+    print(f"文件: {len(paths)}  窗口: {result['windows']}  帧: {result['frames']}  决策tick: {result['ticks']}")
+    print(f"订单: {result['orders']}  成交: {result['fills']}  估算盈亏: {result['pnl']:+.4f}")
+    for tr in result["trades"]:
+        ts = datetime.fromtimestamp(tr["fill_time"]).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"  {ts} {tr['slug']} {tr['side']} {tr['outcome_side']} {tr['size']:g} @ {tr['price']:.3f}")
+    print(f"耗时: {result['elapsed_sec']:.2f}s  帧/秒: {result['frames_per_sec']:,.0f}  tick/秒: {result['ticks_per_sec']:,.0f}")
+    print(f"帧处理: {result['handler_us_per_frame']:.1f}us/帧  决策: 平均 {result['tick_us_mean']:.1f}us, p99 {result['tick_us_p99']:.1f}us")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
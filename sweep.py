@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+参数网格扫描
+回测特征矩阵 (价差, 剩余时间, UP/DOWN 价格, 结算方向, 滚动波动/速度, 公允概率) 只计算一次并放入共享内存,
+进程池中的各进程直接映射同一块内存, 按配置编号批量调用 backtest.simulate
+窗口按时间顺序切成若干块, 每个配置按块记录盈亏, 之后可做滚动 (walk-forward) 检验
+结果按批写入输出目录下的列式 .npz 分片, 中断后重新运行会跳过已完成的配置
+
+网格文件 (JSON), 未列出的参数沿用 config.env 中的条件:
+  {
+    "conditions": {"1": {"time": [60, 120], "diff": [20, 30], "min_prob": [0.9, 0.95]},
+                   "5": {"diff": [50, 60, 80]}},
+    "stop_loss": [30, 40],
+    "timeout": [8],
+    "max_retry": [2]
+  }
+
+用法:
+  python sweep.py run windows.npz grid.json -o sweep_out [--workers 4] [--folds 5]
+  python sweep.py report sweep_out [--top 10]
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+from condition_engine import ConditionEngine, Rule, load_rules
+from backtest import (BASE_DIR, FILL_MODELS, EXIT_STOP, TRADE_AMOUNT, ORDER_TIMEOUT_SEC,
+                      MAX_RETRY_PER_MARKET, STOP_LOSS_DIFF, LEAD_LAG_TRIGGER, LEAD_LAG_MIN_CONFIDENCE,
+                      WindowData, condition_features, simulate)
+
+RULE_FIELDS = ("time", "diff", "min_prob", "max_prob", "max_vol", "min_velocity", "min_edge")
+GLOBAL_FIELDS = ("stop_loss", "timeout", "max_retry")
+MANIFEST = "manifest.json"
+PART_PREFIX = "part-"
+RESULTS_FILE = "results.npz"
+
+
+class Grid:
+    """参数网格: 配置编号按混合进制展开为各轴取值, 不需要预先生成全部组合"""
+    def __init__(self, spec, base_rules):
+        self.spec = spec
+        self.base_rules = list(base_rules)
+        by_order = {r.order: r for r in self.base_rules}
+        self.axes = []  # (列名, 规则order或None, 字段, 取值列表)
+        for key, fields in sorted((spec.get("conditions") or {}).items(), key=lambda kv: int(kv[0])):
+            n = int(key)
+            if n not in by_order:
+                raise ValueError(f"网格中的条件{n}不存在")
+            for field in RULE_FIELDS:
+                values = (fields or {}).get(field)
+                if values:
+                    self.axes.append((f"c{n}_{field}", n, field, list(values)))
+        for field in GLOBAL_FIELDS:
+            values = spec.get(field)
+            if values:
+                self.axes.append((field, None, field, list(values)))
+        self.shape = tuple(len(a[3]) for a in self.axes)
+        self.size = int(np.prod(self.shape, dtype=np.int64)) if self.axes else 1
+
+    @property
+    def columns(self):
+        return [a[0] for a in self.axes]
+
+    @property
+    def uses_stats(self):
+        """是否有配置用到滚动波动/速度 (公允概率也依赖波动)"""
+        return (any(r.has_filters or r.has_edge for r in self.base_rules)
+                or any(a[2] in ("max_vol", "min_velocity", "min_edge") for a in self.axes))
+
+    @property
+    def uses_fair(self):
+        """是否有配置用到公允概率 edge"""
+        return any(r.has_edge for r in self.base_rules) or any(a[2] == "min_edge" for a in self.axes)
+
+    def decode(self, cid):
+        """配置编号 → {列名: 取值}"""
+        if not self.axes:
+            return {}
+        idx = np.unravel_index(int(cid), self.shape)
+        return {a[0]: a[3][i] for a, i in zip(self.axes, idx)}
+
+    def build(self, params):
+        """按配置生成规则列表和全局参数"""
+        overrides = {}
+        settings = {"stop_loss": STOP_LOSS_DIFF, "timeout": ORDER_TIMEOUT_SEC, "max_retry": MAX_RETRY_PER_MARKET}
+        for name, n, field, _ in self.axes:
+            if n is None:
+                settings[field] = params[name]
+            else:
+                overrides.setdefault(n, {})[field] = params[name]
+        rules = []
+        for r in self.base_rules:
+            o = overrides.get(r.order, {})
+            rules.append(Rule(r.name, o.get("time", r.time), o.get("diff", r.diff), r.side,
+                              o.get("min_prob", r.min_prob), o.get("max_prob", r.max_prob),
+                              r.priority, r.order, o.get("max_vol", r.max_vol),
+                              o.get("min_velocity", r.min_velocity), o.get("min_edge", r.min_edge)))
+        return rules, settings
+
+
+class SharedFeatures:
+    """
+    共享内存中的回测特征, 接口与 simulate 用到的 WindowData 部分一致
+    父进程 create() 分配并写入, 子进程 attach() 映射同一块内存 (零拷贝)
+    滚动波动/速度与公允概率按统计窗口存为 vol_<窗口>/velocity_<窗口>/fair_<窗口>, 各配置共用
+    """
+    FIELDS = ("btc", "diff", "signal_diff", "up", "down", "remaining", "outcome", "block")
+    STATS_PREFIXES = ("vol_", "velocity_", "fair_")
+
+    def __init__(self, arrays, handles=None):
+        self.arrays = arrays
+        self.handles = handles or []
+        for name, arr in arrays.items():
+            if name in self.FIELDS and name not in ("diff", "signal_diff"):
+                setattr(self, name, arr)
+
+    def __len__(self):
+        return self.up.shape[0]
+
+    def diff(self):
+        return self.arrays["diff"]
+
+    def signal_diff(self):
+        return self.arrays["signal_diff"]
+
+    def condition_features(self, window):
+        """预先算好的 (vol, velocity, fair); 没有该窗口时返回 None, 由 simulate 现算"""
+        vol = self.arrays.get(f"vol_{window}")
+        if vol is None:
+            return None
+        return vol, self.arrays[f"velocity_{window}"], self.arrays.get(f"fair_{window}")
+
+    @classmethod
+    def create(cls, arrays):
+        handles, views, specs = [], {}, {}
+        for name in arrays:
+            src = np.ascontiguousarray(arrays[name])
+            shm = shared_memory.SharedMemory(create=True, size=max(1, src.nbytes))
+            view = np.ndarray(src.shape, dtype=src.dtype, buffer=shm.buf)
+            view[...] = src
+            handles.append(shm)
+            views[name] = view
+            specs[name] = (shm.name, src.shape, src.dtype.str)
+        obj = cls(views, handles)
+        obj.specs = specs
+        return obj
+
+    @classmethod
+    def attach(cls, specs):
+        handles, views = [], {}
+        for name, (shm_name, shape, dtype) in specs.items():
+            shm = shared_memory.SharedMemory(name=shm_name)
+            views[name] = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=shm.buf)
+            handles.append(shm)
+        return cls(views, handles)
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        for name in self.FIELDS:
+            self.__dict__.pop(name, None)
+        for shm in self.handles:
+            try:
+                shm.close()
+                if unlink:
+                    shm.unlink()
+            except Exception:
+                pass
+        self.handles = []
+
+
+def build_features(data, folds, stats_windows=(), with_fair=False):
+    """
+    价差 (及 LEAD_LAG_TRIGGER 下的信号价差) 只算一次; 窗口按时间顺序均分成 folds 块
+    stats_windows 中每个统计窗口的滚动波动/速度 (with_fair 时还有公允概率) 也只算一次
+    """
+    W = len(data)
+    block = np.zeros(W, dtype=np.int32)
+    for b, idx in enumerate(np.array_split(np.arange(W), max(1, folds))):
+        block[idx] = b
+    stats = {}
+    for window in sorted(set(stats_windows)):
+        vol, velocity, fair = condition_features(data, window, with_fair)
+        stats[f"vol_{window}"] = vol
+        stats[f"velocity_{window}"] = velocity
+        if fair is not None:
+            stats[f"fair_{window}"] = fair
+    return {
+        "btc": data.btc,
+        "diff": data.diff(),
+        "signal_diff": data.signal_diff(),
+        "up": data.up,
+        "down": data.down,
+        "remaining": data.remaining,
+        "outcome": data.outcome,
+        "block": block,
+        **stats,
+    }
+
+
+# 子进程全局状态 (由 _init_worker 设置)
+_W = {}
+
+
+def _init_worker(specs, grid_spec, base_rules, folds, fill_model, size):
+    _W["features"] = SharedFeatures.attach(specs) if specs is not None else None
+    rules = [Rule(*r) for r in base_rules]
+    _W["grid"] = Grid(grid_spec, rules)
+    _W["folds"] = folds
+    _W["fill_model"] = fill_model
+    _W["size"] = size
+
+
+def _rule_tuple(r):
+    return (r.name, r.time, r.diff, r.side, r.min_prob, r.max_prob, r.priority, r.order,
+            r.max_vol, r.min_velocity, r.min_edge)
+
+
+def evaluate_config(features, grid, cid, folds, fill_model, size):
+    """单个配置: 全样本统计 + 按块的盈亏/结算数/盈利数"""
+    params = grid.decode(cid)
+    rules, settings = grid.build(params)
+    engine = ConditionEngine(rules)
+    trades = simulate(features, engine, stop_loss_diff=float(settings["stop_loss"]),
+                      order_timeout=int(settings["timeout"]), max_retry=int(settings["max_retry"]),
+                      size=size, fill_model=fill_model, features=features.condition_features(engine.stats_window))
+    settled = ~np.isnan(trades.pnl)
+    pnl = np.where(settled, trades.pnl, 0.0)
+    block = features.block
+    row = {
+        "entries": int((trades.rule >= 0).sum()),
+        "fills": int(trades.filled.sum()),
+        "stops": int((trades.filled & (trades.exit_reason == EXIT_STOP)).sum()),
+        "settled": int(settled.sum()),
+        "wins": int((settled & (trades.pnl > 0)).sum()),
+        "pnl": float(pnl.sum()),
+        "block_pnl": np.bincount(block, weights=pnl.sum(axis=1), minlength=folds),
+        "block_settled": np.bincount(block, weights=settled.sum(axis=1), minlength=folds),
+        "block_wins": np.bincount(block, weights=(settled & (trades.pnl > 0)).sum(axis=1), minlength=folds),
+    }
+    return params, row
+
+
+def _run_chunk(ids):
+    grid, folds = _W["grid"], _W["folds"]
+    cols = {"config": np.asarray(ids, dtype=np.int64)}
+    for name in grid.columns:
+        cols[name] = np.empty(len(ids))
+    for name in ("entries", "fills", "stops", "settled", "wins"):
+        cols[name] = np.empty(len(ids), dtype=np.int32)
+    cols["pnl"] = np.empty(len(ids))
+    for name in ("block_pnl", "block_settled", "block_wins"):
+        cols[name] = np.empty((len(ids), folds))
+    for i, cid in enumerate(ids):
+        params, row = evaluate_config(_W["features"], grid, cid, folds, _W["fill_model"], _W["size"])
+        for name, v in params.items():
+            cols[name][i] = np.nan if v is None else float(v)
+        for name, v in row.items():
+            cols[name][i] = v
+    return cols
+
+
+def _file_digest(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _part_files(out_dir):
+    return sorted(os.path.join(out_dir, n) for n in os.listdir(out_dir)
+                  if n.startswith(PART_PREFIX) and n.endswith(".npz"))
+
+
+def load_results(out_dir):
+    """读取全部分片, 按配置编号排序拼接为列字典"""
+    merged = os.path.join(out_dir, RESULTS_FILE)
+    parts = _part_files(out_dir)
+    if not parts and os.path.exists(merged):
+        parts = [merged]
+    cols = {}
+    for path in parts:
+        with np.load(path, allow_pickle=False) as z:
+            for name in z.files:
+                cols.setdefault(name, []).append(z[name])
+    if not cols:
+        return {}
+    cols = {k: np.concatenate(v) for k, v in cols.items()}
+    cols["config"], first = np.unique(cols["config"], return_index=True)
+    return {k: (v if k == "config" else v[first]) for k, v in cols.items()}
+
+
+def run_sweep(data_path, grid_spec, out_dir, workers=None, folds=5, chunk=32,
+              fill_model="check", size=TRADE_AMOUNT, limit=0):
+    data = WindowData.load(data_path)
+    base_rules = load_rules(base_dir=BASE_DIR)
+    grid = Grid(grid_spec, base_rules)
+    folds = max(1, min(int(folds), max(1, len(data))))
+    manifest = {
+        "data": os.path.abspath(data_path),
+        "data_sha1": _file_digest(data_path),
+        "windows": len(data),
+        "grid": grid_spec,
+        "base_rules": [r.to_dict() for r in base_rules],
+        "columns": grid.columns,
+        "size": grid.size,
+        "folds": folds,
+        "fill_model": fill_model,
+        "trade_size": size,
+        "lead_lag_trigger": LEAD_LAG_TRIGGER,
+        "lead_lag_min_confidence": LEAD_LAG_MIN_CONFIDENCE if LEAD_LAG_TRIGGER else None,
+    }
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        keys = ("data_sha1", "grid", "base_rules", "folds", "fill_model", "trade_size",
+                "lead_lag_trigger", "lead_lag_min_confidence")
+        # 旧版清单没有领先触发字段, 当作未开启
+        old.setdefault("lead_lag_trigger", False)
+        old.setdefault("lead_lag_min_confidence", None)
+        if any(old.get(k) != manifest.get(k) for k in keys):
+            raise ValueError(f"{out_dir} 中已有不同数据或网格的扫描结果, 请换一个输出目录")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    done = load_results(out_dir).get("config", np.zeros(0, dtype=np.int64))
+    todo = np.setdiff1d(np.arange(grid.size, dtype=np.int64), done)
+    if limit:
+        todo = todo[:limit]
+    print(f"配置总数: {grid.size}  已完成: {len(done)}  本次: {len(todo)}  窗口: {len(data)}  分块: {folds}")
+    if LEAD_LAG_TRIGGER:
+        print(f"LEAD_LAG_TRIGGER 已开启: 条件按领先预测价差求值 (有预测的采样点 {data.prediction_coverage()*100:.1f}%)")
+    if len(todo) == 0:
+        _merge(out_dir)
+        return
+
+    chunks = [todo[i:i + chunk].tolist() for i in range(0, len(todo), max(1, chunk))]
+    # 统计窗口不在网格中, 所有配置共用同一个窗口的波动/速度/公允概率
+    stats_windows = (ConditionEngine(base_rules).stats_window,) if grid.uses_stats else ()
+    features = SharedFeatures.create(build_features(data, folds, stats_windows, grid.uses_fair))
+    del data
+    init_args = (features.specs, grid_spec, [_rule_tuple(r) for r in base_rules], folds, fill_model, size)
+    workers = workers or os.cpu_count() or 1
+    finished = 0
+    t0 = time.time()
+
+    def _save(cols):
+        nonlocal finished
+        path = os.path.join(out_dir, f"{PART_PREFIX}{int(cols['config'][0]):010d}.npz")
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, **cols)
+        os.replace(tmp, path)
+        finished += len(cols["config"])
+        rate = finished / max(time.time() - t0, 1e-9)
+        sys.stdout.write(f"\r进度: {finished}/{len(todo)}  {rate:,.1f} 配置/秒")
+        sys.stdout.flush()
+
+    try:
+        if workers <= 1:
+            _init_worker(None, grid_spec, init_args[2], folds, fill_model, size)
+            _W["features"] = features
+            for ids in chunks:
+                _save(_run_chunk(ids))
+        else:
+            with Pool(workers, initializer=_init_worker, initargs=init_args) as pool:
+                for cols in pool.imap_unordered(_run_chunk, chunks):
+                    _save(cols)
+    finally:
+        print()
+        _W.clear()
+        features.close(unlink=True)
+    _merge(out_dir)
+
+
+def _merge(out_dir):
+    """所有配置完成后合并为一个列式结果文件"""
+    with open(os.path.join(out_dir, MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    cols = load_results(out_dir)
+    if len(cols.get("config", [])) < manifest["size"]:
+        return
+    np.savez(os.path.join(out_dir, RESULTS_FILE), **cols)
+    for path in _part_files(out_dir):
+        os.remove(path)
+    print(f"已写入 {os.path.join(out_dir, RESULTS_FILE)}")
+
+
+def walk_forward(cols, folds, min_settled=1):
+    """
+    滚动检验: 第 k 块用前 k 块累计盈亏最好的配置 (结算笔数 ≥ min_settled), 记录其在第 k 块的表现
+    返回 [(块, 配置编号, 训练盈亏, 测试盈亏, 测试结算数), ...]
+    """
+    out = []
+    train_pnl = np.zeros(len(cols["config"]))
+    train_n = np.zeros(len(cols["config"]))
+    for k in range(folds):
+        if k > 0:
+            eligible = train_n >= min_settled
+            if eligible.any():
+                i = int(np.argmax(np.where(eligible, train_pnl, -np.inf)))
+                out.append((k, int(cols["config"][i]), float(train_pnl[i]),
+                            float(cols["block_pnl"][i, k]), int(cols["block_settled"][i, k])))
+        train_pnl += cols["block_pnl"][:, k]
+        train_n += cols["block_settled"][:, k]
+    return out
+
+
+def _params_text(cols, columns, i):
+    return " ".join(f"{c}={cols[c][i]:g}" for c in columns)
+
+
+def report(out_dir, top=10, min_settled=1):
+    with open(os.path.join(out_dir, MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    cols = load_results(out_dir)
+    if not cols:
+        print("没有结果")
+        return
+    columns, folds = manifest["columns"], manifest["folds"]
+    n = len(cols["config"])
+    print(f"已完成配置: {n}/{manifest['size']}  窗口: {manifest['windows']}  分块: {folds}  成交模型: {manifest['fill_model']}")
+
+    order = np.argsort(-cols["pnl"], kind="stable")[:top]
+    print(f"\n全样本盈亏前 {len(order)}:")
+    for i in order:
+        hit = cols["wins"][i] / cols["settled"][i] if cols["settled"][i] else 0.0
+        print(f"  #{cols['config'][i]:<8} 盈亏 {cols['pnl'][i]:>+10.3f}  结算 {cols['settled'][i]:>5}  "
+              f"胜率 {hit*100:5.1f}%  {_params_text(cols, columns, i)}")
+
+    wf = walk_forward(cols, folds, min_settled)
+    if wf:
+        print("\n滚动检验 (前k块最优配置 → 第k块):")
+        by_id = {int(c): i for i, c in enumerate(cols["config"])}
+        for k, cid, train, test, settled in wf:
+            print(f"  块{k}: #{cid:<8} 训练 {train:>+10.3f}  测试 {test:>+9.3f} ({settled}笔)  "
+                  f"{_params_text(cols, columns, by_id[cid])}")
+        print(f"  样本外合计: {sum(x[3] for x in wf):+.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="条件参数网格扫描")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_run = sub.add_parser("run", help="运行 (或继续) 扫描")
+    p_run.add_argument("data", help="backtest.py build 生成的 .npz 文件")
+    p_run.add_argument("grid", help="网格JSON文件")
+    p_run.add_argument("-o", "--output", default="sweep_out")
+    p_run.add_argument("--workers", type=int, default=0, help="进程数, 默认CPU核数")
+    p_run.add_argument("--folds", type=int, default=5, help="滚动检验的时间分块数")
+    p_run.add_argument("--chunk", type=int, default=32, help="每批配置数 (也是断点续跑的粒度)")
+    p_run.add_argument("--fill-model", choices=FILL_MODELS, default="check")
+    p_run.add_argument("--size", type=float, default=TRADE_AMOUNT)
+    p_run.add_argument("--limit", type=int, default=0, help="本次最多运行的配置数")
+
+    p_report = sub.add_parser("report", help="汇总扫描结果")
+    p_report.add_argument("output")
+    p_report.add_argument("--top", type=int, default=10)
+    p_report.add_argument("--min-settled", type=int, default=1, help="滚动检验选参要求的最少结算笔数")
+    args = parser.parse_args()
+
+    if args.cmd == "run":
+        with open(args.grid, "r", encoding="utf-8") as f:
+            grid_spec = json.load(f)
+        run_sweep(args.data, grid_spec, args.output, workers=args.workers, folds=args.folds,
+                  chunk=args.chunk, fill_model=args.fill_model, size=args.size, limit=args.limit)
+    else:
+        report(args.output, top=args.top, min_settled=args.min_settled)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+行情tick环形缓冲
+每个序列 (Chainlink, 币安, UP/DOWN 买一卖一) 一对定长 NumPy 数组 (时间, 数值), 追加 O(1), 不随tick分配内存
+每个序列可挂多个按时间长度的滚动窗口, 追加时增量维护 均值 / 已实现波动 / 速度, 读取 O(1):
+  - mean:     窗口内数值均值
+  - vol:      窗口内相邻变化的平方和开方 (美元), 即已实现波动
+  - velocity: (最新值 - 窗口内最早值) / 时间差 (美元/秒); PTB 在窗口内不变, 故也是价差的变化速度
+
+指定目录时每个序列映射到一个定长文件 <目录>/<序列>.ticks, 进程重启后直接恢复, 无需解析;
+外部分析工具可用 open_tick_file() 只读映射, 零拷贝读取。文件布局 (小端):
+  [0:8]   魔数 b"PMTICK01"
+  [8:12]  版本 u32 = 1
+  [12:16] 单条记录字节数 u32 = 16
+  [16:24] 容量 u64
+  [24:32] 累计写入条数 seq u64 (下一条写入位置 = seq % 容量)
+  [32:64] 保留
+  [64:]   容量 × 记录 {ts: f64 墙钟秒, value: f64}
+"""
+import os
+import sys
+import math
+import time
+import threading
+
+import numpy as np
+
+SERIES_BTC = "btc"          # Chainlink (交易依据)
+SERIES_BINANCE = "binance"
+SERIES_UP_BID = "up_bid"
+SERIES_UP_ASK = "up_ask"
+SERIES_DOWN_BID = "down_bid"
+SERIES_DOWN_ASK = "down_ask"
+
+DEFAULT_SERIES = (SERIES_BTC, SERIES_BINANCE, SERIES_UP_BID, SERIES_UP_ASK, SERIES_DOWN_BID, SERIES_DOWN_ASK)
+
+FILE_MAGIC = b"PMTICK01"
+FILE_VERSION = 1
+FILE_SUFFIX = ".ticks"
+HEADER_SIZE = 64
+RECORD_DTYPE = np.dtype([("ts", "<f8"), ("value", "<f8")])
+_HDR_CAPACITY = 2  # 头部按 u64 索引
+_HDR_SEQ = 3
+
+
+def _map_file(path, capacity, mode):
+    return np.memmap(path, dtype=np.uint8, mode=mode, shape=(HEADER_SIZE + capacity * RECORD_DTYPE.itemsize,))
+
+
+def _read_header(path):
+    """返回 (容量, seq), 文件无效时返回 None"""
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            head = f.read(HEADER_SIZE)
+    except OSError:
+        return None
+    if len(head) < HEADER_SIZE or head[:8] != FILE_MAGIC:
+        return None
+    version, rec_size = np.frombuffer(head, dtype="<u4", count=2, offset=8)
+    capacity, seq = np.frombuffer(head, dtype="<u8", count=2, offset=16)
+    if version != FILE_VERSION or rec_size != RECORD_DTYPE.itemsize:
+        return None
+    if size < HEADER_SIZE + int(capacity) * RECORD_DTYPE.itemsize:
+        return None
+    return int(capacity), int(seq)
+
+
+def open_tick_file(path):
+    """只读映射一个序列文件, 返回 (时间数组, 数值数组, 条数); 数组为文件视图, 按写入槽位排列"""
+    info = _read_header(path)
+    if info is None:
+        raise ValueError(f"不是有效的tick文件: {path}")
+    capacity, seq = info
+    mm = _map_file(path, capacity, "r")
+    rec = mm[HEADER_SIZE:].view(RECORD_DTYPE)
+    n = min(seq, capacity)
+    return rec["ts"], rec["value"], n
+
+
+class RollingWindow:
+    """挂在 TickSeries 上的时间窗口统计, 由序列在追加时推进"""
+    __slots__ = ("series", "window", "tail", "n", "sum", "sumsq", "evicted")
+
+    def __init__(self, series, window):
+        self.series = series
+        self.window = float(window)
+        self.tail = series.seq  # 窗口内最早元素的序号
+        self.n = 0
+        self.sum = 0.0
+        self.sumsq = 0.0        # 窗口内相邻变化的平方和
+        self.evicted = 0
+
+    def _evict(self):
+        s = self.series
+        cap = s.capacity
+        i = self.tail % cap
+        v = s.val[i]
+        self.sum -= v
+        if self.n > 1:
+            d = s.val[(self.tail + 1) % cap] - v
+            self.sumsq -= d * d
+        self.tail += 1
+        self.n -= 1
+        self.evicted += 1
+        if self.evicted >= cap:
+            self.resync()
+
+    def before_overwrite(self, seq):
+        """序号 seq 即将覆盖最旧的元素, 先把它移出窗口"""
+        while self.n > 0 and self.tail <= seq - self.series.capacity:
+            self._evict()
+
+    def push(self, seq, ts, v):
+        s = self.series
+        if self.n > 0:
+            d = v - s.val[(seq - 1) % s.capacity]
+            self.sumsq += d * d
+        self.sum += v
+        self.n += 1
+        cutoff = ts - self.window
+        while self.n > 1 and s.ts[self.tail % s.capacity] < cutoff:
+            self._evict()
+
+    def resync(self):
+        """按窗口内数据重算累计量, 消除浮点误差累积"""
+        self.evicted = 0
+        if self.n <= 0:
+            self.sum = self.sumsq = 0.0
+            return
+        vals = self.series.ordered(self.n)[1]
+        self.sum = float(vals.sum())
+        self.sumsq = float(np.square(np.diff(vals)).sum()) if self.n > 1 else 0.0
+
+    def stats(self):
+        s = self.series
+        if self.n <= 0:
+            return None
+        cap = s.capacity
+        head = (s.seq - 1) % cap
+        tail = self.tail % cap
+        dt = float(s.ts[head] - s.ts[tail])
+        return {
+            "window": self.window,
+            "count": self.n,
+            "mean": float(self.sum / self.n),
+            "vol": math.sqrt(self.sumsq) if self.sumsq > 0 else 0.0,
+            "velocity": float(s.val[head] - s.val[tail]) / dt if dt > 0 else 0.0,
+            "span": dt,
+        }
+
+
+class TickSeries:
+    """单个序列的定长环形缓冲; 给定 path 时映射到文件并恢复已有数据"""
+    def __init__(self, name, capacity, path=None):
+        self.name = name
+        self.capacity = max(2, int(capacity))
+        self.path = path
+        self.seq = 0  # 累计追加数, 下一个写入位置为 seq % capacity
+        self.windows = {}
+        self.lock = threading.Lock()
+        self._mm = None
+        self._hdr = None
+        if path:
+            self._open(path)
+        else:
+            rec = np.zeros(self.capacity, dtype=RECORD_DTYPE)
+            self.ts, self.val = rec["ts"], rec["value"]
+
+    def _open(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        info = _read_header(path)
+        carry = None
+        if info is not None and info[0] != self.capacity:
+            # 容量变化: 读出旧文件中最近的数据, 写入新文件
+            old_ts, old_val = read_series(path)
+            carry = (old_ts[-self.capacity:], old_val[-self.capacity:])
+            info = None
+        if info is None:
+            tmp = path + ".tmp"
+            mm = _map_file(tmp, self.capacity, "w+")
+            mm[:8] = np.frombuffer(FILE_MAGIC, dtype=np.uint8)
+            mm[8:16].view("<u4")[:] = (FILE_VERSION, RECORD_DTYPE.itemsize)
+            mm[16:24].view("<u8")[0] = self.capacity
+            mm.flush()
+            del mm
+            os.replace(tmp, path)
+        self._mm = _map_file(path, self.capacity, "r+")
+        self._hdr = self._mm[:HEADER_SIZE].view("<u8")
+        rec = self._mm[HEADER_SIZE:].view(RECORD_DTYPE)
+        self.ts, self.val = rec["ts"], rec["value"]
+        self.seq = int(self._hdr[_HDR_SEQ])
+        if carry is not None:
+            n = len(carry[0])
+            self.ts[:n], self.val[:n] = carry
+            self.seq = n
+            self._hdr[_HDR_SEQ] = n
+
+    def flush(self):
+        if self._mm is not None:
+            self._mm.flush()
+
+    def close(self):
+        with self.lock:
+            if self._mm is not None:
+                self._mm.flush()
+                self._hdr = None
+                self._mm = None
+
+    def __len__(self):
+        return min(self.seq, self.capacity)
+
+    def append(self, ts, value):
+        with self.lock:
+            seq = self.seq
+            for w in self.windows.values():
+                w.before_overwrite(seq)
+            i = seq % self.capacity
+            self.ts[i] = ts
+            self.val[i] = value
+            self.seq = seq + 1
+            if self._hdr is not None:
+                # 先写记录再推进 seq, 进程中途退出时最多丢失这一条
+                self._hdr[_HDR_SEQ] = self.seq
+            for w in self.windows.values():
+                w.push(seq, ts, value)
+
+    def last(self):
+        with self.lock:
+            if self.seq == 0:
+                return None
+            i = (self.seq - 1) % self.capacity
+            return float(self.ts[i]), float(self.val[i])
+
+    def ordered(self, n=None):
+        """按时间顺序返回最近 n 条 (时间数组, 数值数组) 的拷贝"""
+        size = len(self)
+        n = size if n is None else max(0, min(int(n), size))
+        if n == 0:
+            return np.zeros(0), np.zeros(0)
+        end = self.seq % self.capacity
+        start = (end - n) % self.capacity
+        if start < end:
+            return self.ts[start:end].copy(), self.val[start:end].copy()
+        return (np.concatenate((self.ts[start:], self.ts[:end])),
+                np.concatenate((self.val[start:], self.val[:end])))
+
+    def since(self, ts):
+        """时间 ≥ ts 的全部数据; 先在环上二分, 只拷贝需要的部分"""
+        with self.lock:
+            size = len(self)
+            start = (self.seq - size) % self.capacity
+            lo, hi = 0, size
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.ts[(start + mid) % self.capacity] < ts:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return self.ordered(size - lo)
+
+    def window(self, seconds):
+        """取得 (必要时创建) 该时间长度的滚动窗口; 新窗口用已有数据初始化"""
+        key = float(seconds)
+        with self.lock:
+            w = self.windows.get(key)
+            if w is None:
+                w = RollingWindow(self, key)
+                size = len(self)
+                if size:
+                    t, _ = self.ordered(size)
+                    first = int(np.searchsorted(t, t[-1] - key, side="left"))
+                    w.tail = self.seq - (size - first)
+                    w.n = size - first
+                    w.resync()
+                self.windows[key] = w
+            return w
+
+    def stats(self, seconds):
+        w = self.window(seconds)
+        with self.lock:
+            return w.stats()
+
+    def reset(self):
+        with self.lock:
+            self.seq = 0
+            if self._hdr is not None:
+                self._hdr[_HDR_SEQ] = 0
+            for key in list(self.windows.keys()):
+                self.windows[key] = RollingWindow(self, key)
+
+
+class TickStore:
+    """全部序列; clock 可替换为回放的模拟时钟; directory 非空时各序列持久化到该目录"""
+    def __init__(self, capacity=131072, windows=(), series=DEFAULT_SERIES, clock=None, directory=None):
+        self.capacity = int(capacity)
+        self.clock = clock or time.time
+        self.directory = directory or None
+        self.series = {}
+        for name in series:
+            self.get(name)
+        for name in self.series:
+            for w in windows:
+                self.series[name].window(w)
+
+    def get(self, name):
+        s = self.series.get(name)
+        if s is None:
+            path = os.path.join(self.directory, f"{name}{FILE_SUFFIX}") if self.directory else None
+            s = TickSeries(name, self.capacity, path)
+            self.series[name] = s
+        return s
+
+    def recovered(self):
+        """各序列已有的条数 (重启后恢复的数据量)"""
+        return {name: len(s) for name, s in self.series.items()}
+
+    def flush(self):
+        for s in self.series.values():
+            s.flush()
+
+    def close(self):
+        for s in self.series.values():
+            s.close()
+
+    def append(self, name, value, ts=None):
+        if value is None:
+            return
+        self.get(name).append(self.clock() if ts is None else ts, float(value))
+
+    def stats(self, name, seconds):
+        return self.get(name).stats(seconds)
+
+    def reset(self):
+        for s in self.series.values():
+            s.reset()
+
+
+def read_series(path):
+    """按时间顺序读取一个序列文件 (拷贝), 返回 (时间数组, 数值数组)"""
+    ts, val, n = open_tick_file(path)
+    capacity = len(ts)
+    info = _read_header(path)
+    end = info[1] % capacity
+    if n < capacity:
+        return np.array(ts[:n]), np.array(val[:n])
+    return np.concatenate((ts[end:], ts[:end])), np.concatenate((val[end:], val[:end]))
+
+
+def bucket_minmax(ts, val, bucket):
+    """
+    图表用 min/max 分桶降采样, 返回 (桶起点, 最小, 最大, 末值) 四个数组。
+    桶按绝对时间对齐到 bucket 的整数倍, 与请求范围无关: 增量请求得到的桶与全量一致,
+    客户端只需替换最后一个 (可能未满的) 桶再追加。
+    """
+    if len(ts) == 0:
+        empty = np.zeros(0)
+        return empty, empty, empty, empty
+    idx = np.floor(ts / bucket).astype(np.int64)
+    cuts = np.flatnonzero(np.diff(idx)) + 1
+    starts = np.concatenate(([0], cuts))
+    ends = np.concatenate((cuts - 1, [len(ts) - 1]))
+    return (idx[starts] * bucket, np.minimum.reduceat(val, starts),
+            np.maximum.reduceat(val, starts), val[ends])
+
+
+def pair_mid(bid_ts, bid, ask_ts, ask):
+    """按时间对齐买一/卖一 (每条卖一配最近一条不晚于它的买一), 返回 (时间, 中间价)"""
+    i = np.searchsorted(bid_ts, ask_ts, side="right") - 1
+    ok = i >= 0
+    return ask_ts[ok], (bid[i[ok]] + ask[ok]) / 2
+
+
+def rolling_matrix_stats(values, window):
+    """
+    回测用: 按秒采样矩阵 [W, T] 上的滚动 已实现波动 / 速度 (与 RollingWindow 定义一致)
+    窗口内数据不足或有缺失时为 NaN
+    """
+    values = np.asarray(values, dtype=np.float64)
+    w = max(1, int(window))
+    W, T = values.shape
+    vol = np.full((W, T), np.nan)
+    velocity = np.full((W, T), np.nan)
+    if T <= w:
+        return vol, velocity
+    d = np.diff(values, axis=1)
+    bad = np.isnan(d)
+    zero = np.zeros((W, 1))
+    sq = np.concatenate((zero, np.cumsum(np.where(bad, 0.0, np.square(d)), axis=1)), axis=1)
+    nbad = np.concatenate((zero, np.cumsum(bad, axis=1)), axis=1)
+    complete = (nbad[:, w:] - nbad[:, :-w]) == 0
+    vol[:, w:] = np.where(complete, np.sqrt(np.maximum(sq[:, w:] - sq[:, :-w], 0.0)), np.nan)
+    velocity[:, w:] = np.where(complete, (values[:, w:] - values[:, :-w]) / w, np.nan)
+    return vol, velocity
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(f"用法: python {os.path.basename(__file__)} <tick目录或文件>")
+        return
+    path = sys.argv[1]
+    paths = [path] if os.path.isfile(path) else sorted(
+        os.path.join(path, n) for n in os.listdir(path) if n.endswith(FILE_SUFFIX))
+    for p in paths:
+        ts, val = read_series(p)
+        if len(ts) == 0:
+            print(f"{os.path.basename(p)}: 空")
+            continue
+        span = ts[-1] - ts[0]
+        print(f"{os.path.basename(p)}: {len(ts)} 条, 时长 {span/3600:.2f}h, 最新 {val[-1]:g} "
+              f"@ {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts[-1]))}")
+
+
+if __name__ == "__main__":
+    main()